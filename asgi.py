@@ -0,0 +1,168 @@
+import asyncio
+import gzip
+import os
+import sqlite3
+import time
+
+import asyncpg
+from quart import Quart, g, request, render_template, session, url_for
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from jinja2 import DictLoader
+
+import main
+from pool_db import parametros_conexion
+from ingesta import extraer_lote, guardar_pagos_async
+from cola_ingesta import encolar, asegurar_worker
+from verificacion import canjear_referencia_async
+from notificaciones import ESCUCHA
+from cache_refs import CACHE
+from comercios import COMERCIO_PRINCIPAL, hash_token, comercio_de_hash_async, token_rechazado
+from metricas import HTTP_DURACION, VERIFICACIONES, DB_CONEXION
+
+# --- MODO ASÍNCRONO (ASGI) ---
+# /webhook-bdv, /verificar y /health se atienden con Quart y asyncpg: mientras una consulta espera
+# a Postgres (Neon está lejos) el mismo proceso sigue atendiendo a otros teléfonos y cajeros, sin un
+# hilo bloqueado por petición. El resto de la app (login, admin, exportaciones, /metrics...) sigue
+# siendo la app Flask de main.py, servida en hilos por el mismo proceso. Mismas rutas, misma sesión
+# (misma SECRET_KEY y mismo formato de cookie) y mismas plantillas.
+# Uso: hypercorn asgi:app -b 0.0.0.0:8000 -w 2   (o uvicorn asgi:app --workers 2)
+ASYNC_POOL_MIN = int(os.getenv("ASYNC_POOL_MIN", "1"))
+ASYNC_POOL_MAX = int(os.getenv("ASYNC_POOL_MAX", "20"))
+RUTAS_ASYNC = {"/webhook-bdv", "/verificar", "/health"}
+
+rapida = Quart(__name__)
+rapida.secret_key = main.app.secret_key
+rapida.jinja_loader = DictLoader(main.PLANTILLAS)
+# Las plantillas enlazan la hoja de estilos por su endpoint. La sirve Flask (el despacho de abajo no
+# manda /estilos.css aquí); la regla solo existe para que url_for('estilos') construya la URL.
+rapida.add_url_rule("/estilos.css", "estilos", lambda: ("", 404))
+POOL = {"pg": None}
+
+class ConexionSinReset(asyncpg.Connection):
+    # Ninguna ruta deja LISTEN, SET ni cursores abiertos: devolverla al pool no necesita otro viaje a Postgres
+    def get_reset_query(self): return ""
+
+def parametros_asyncpg():
+    p = parametros_conexion()
+    # asyncpg prepara cada consulta y tras unas ejecuciones Postgres pasaría a un plan genérico: con
+    # "LIKE $2" no puede usar el índice de referencia invertida ni descartar particiones por fecha.
+    # force_custom_plan planifica con los valores reales, como psycopg2. El pooler de Neon (pgbouncer
+    # en modo transacción) no admite sentencias preparadas con nombre y rechaza parámetros de arranque
+    # que no conoce: ahí no hay caché de sentencias (cada consulta ya se planifica con sus valores) ni
+    # server_settings.
+    pooler = "-pooler" in (p["host"] or "")
+    return dict(host=p["host"], port=int(p["port"]), database=p["database"], user=p["user"], password=p["password"] or None,
+                ssl="require" if p["sslmode"] == "require" else False,
+                server_settings={} if pooler else {"plan_cache_mode": "force_custom_plan"},
+                statement_cache_size=0 if pooler else 100, timeout=p["connect_timeout"])
+
+@rapida.before_serving
+async def abrir_pool():
+    inicio = time.perf_counter()
+    POOL["pg"] = await asyncpg.create_pool(min_size=ASYNC_POOL_MIN, max_size=ASYNC_POOL_MAX,
+                                           connection_class=ConexionSinReset, **parametros_asyncpg())
+    DB_CONEXION.observar(time.perf_counter() - inicio)
+    if main.USAR_CACHE: ESCUCHA.asegurar()
+
+@rapida.after_serving
+async def cerrar_pool():
+    if POOL["pg"]: await POOL["pg"].close()
+
+# --- MÉTRICAS (mismas series que la app Flask) ---
+@rapida.before_request
+async def iniciar_cronometro(): g.inicio = time.perf_counter()
+
+@rapida.after_request
+async def medir_y_comprimir(resp):
+    ruta = request.url_rule.rule if request.url_rule else "sin_ruta"
+    HTTP_DURACION.observar(time.perf_counter() - g.inicio, ruta, request.method, resp.status_code)
+    # gzip como main.comprimir (aquí solo hay respuestas pequeñas en memoria)
+    resp.vary.add('Accept-Encoding')
+    if resp.status_code < 200 or 'gzip' not in request.headers.get('Accept-Encoding', '') or not resp.mimetype.startswith('text/'):
+        return resp
+    datos = await resp.get_data()
+    if len(datos) < main.COMPRIMIR_MIN: return resp
+    resp.set_data(gzip.compress(datos, 6))
+    resp.headers['Content-Encoding'] = 'gzip'
+    return resp
+
+@rapida.context_processor
+async def version_css():
+    return {"css_version": main.CSS_VERSION, "eventos_url": main.EVENTOS_URL, "comercio_id": comercio_actual(),
+            "comercio_nombre": session.get('comercio_nombre', ''), "comercio_slug": session.get('comercio_slug', '')}
+
+def comercio_actual(): return session.get('comercio_id', COMERCIO_PRINCIPAL)
+
+# --- RUTAS ---
+@rapida.route('/health')
+async def health_check():
+    try:
+        await POOL["pg"].fetchval("SELECT 1")
+        return "OK - Sistema Activo", 200
+    except Exception as e: return f"Error: {str(e)}", 500
+
+@rapida.route('/verificar', methods=['POST'])
+async def verificar():
+    ref = (await request.form).get('ref', '').strip()
+    comercio_id = comercio_actual()
+    respuesta = CACHE.consultar(ref, comercio_id)
+    if respuesta: (estado, datos), origen = respuesta, "cache"
+    else:
+        generacion, origen = CACHE.generacion, "db"
+        async with POOL["pg"].acquire() as conn:
+            estado, datos = await canjear_referencia_async(conn, ref, comercio_id)
+        if estado == "NO_ENCONTRADO": CACHE.recordar_ausente(ref, generacion, comercio_id)
+    VERIFICACIONES.sumar(estado, origen)
+    res = main.RESULTADOS_VERIFICACION[estado].copy()
+    if datos: res["datos"] = datos
+    return await render_template('portal.html', resultado=res, logo_url=url_for('static', filename='logo.png'))
+
+def token_webhook():
+    # Como main.token_webhook: (token_hash, error), sin consultar Postgres
+    token = request.headers.get('X-Token') or request.args.get('token', '')
+    if not token: return ("", None) if not main.TOKEN_OBLIGATORIO else (None, "Falta el token del comercio")
+    token_hash = hash_token(token)
+    if token_rechazado(token_hash): return None, "Token inválido"
+    return token_hash, None
+
+@rapida.route('/webhook-bdv', methods=['POST'])
+async def webhook():
+    token_hash, error = token_webhook()
+    if error: return error, 401
+    try:
+        raw_data = await request.get_json(silent=True) or {"mensaje": await request.get_data(as_text=True)}
+        texto_recibido = str(raw_data.get('mensaje', ''))
+        if main.INGESTA_COLA:
+            try:
+                # SQLite hace fsync en cada mensaje: fuera del bucle de eventos
+                await asyncio.to_thread(encolar, [texto_recibido], token_hash)
+                if main.COLA_WORKER == "proceso": asegurar_worker()
+                return "OK", 200
+            except sqlite3.Error: pass  # Sin cola disponible se guarda directo
+        lista_pagos, _ = extraer_lote([texto_recibido])
+        if lista_pagos:
+            async with POOL["pg"].acquire() as conn:
+                comercio_id = await comercio_de_hash_async(conn, token_hash)
+                if comercio_id is None: return "Token inválido", 401
+                async with conn.transaction(): await guardar_pagos_async(conn, lista_pagos, comercio_id)
+        return "OK", 200
+    except Exception as e: return str(e), 200
+
+# --- ENTRADA ASGI: rutas rápidas en Quart, todo lo demás a Flask ---
+def wsgi_flask(environ, start_response):
+    # El adaptador WSGI de hypercorn solo envía la cabecera junto al primer trozo del cuerpo: una
+    # respuesta vacía (HEAD, 304 de /estilos.css, redirecciones sin cuerpo) necesita al menos b"".
+    cuerpo = main.app(environ, start_response)
+    try:
+        vacio = True
+        for trozo in cuerpo: vacio = False; yield trozo
+        if vacio: yield b""
+    finally:
+        if hasattr(cuerpo, "close"): cuerpo.close()
+
+flask_app = AsyncioWSGIMiddleware(wsgi_flask, max_body_size=32 * 1024 * 1024)
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan" or (scope["type"] == "http" and scope["path"] in RUTAS_ASYNC):
+        return await rapida(scope, receive, send)
+    return await flask_app(scope, receive, send)
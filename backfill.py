@@ -0,0 +1,64 @@
+import argparse
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import psycopg2
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+from pool_db import parametros_conexion
+from extractor import MOTOR
+from ingesta import ZONA_NEGOCIO
+
+# --- BACKFILL DE COLUMNAS TIPADAS (monto_num, moneda, recibido_en) ---
+# Recorre pagos por lotes de id dentro de cada comercio y hace commit tras cada uno, así solo bloquea
+# unas pocas filas a la vez. La clave primaria empieza por comercio_id: sin él cada lote recorrería
+# todas las particiones. Es reanudable: las filas ya convertidas no vuelven a seleccionarse.
+SQL_PENDIENTES = """SELECT id, banco, monto, fecha_recepcion, hora_recepcion FROM pagos
+    WHERE comercio_id = %s AND id > %s AND (moneda IS NULL OR recibido_en IS NULL) ORDER BY id LIMIT %s"""
+
+def convertir_fecha(fecha, hora, zona):
+    for formato, texto in (("%d/%m/%Y %I:%M %p", f"{fecha} {hora}"), ("%d/%m/%Y", fecha)):
+        try: return datetime.strptime(texto.strip(), formato).replace(tzinfo=zona)
+        except (ValueError, AttributeError): continue
+    return None
+
+def ejecutar_backfill(lote=5000, pausa=0.0, zona=ZONA_NEGOCIO):
+    conn = psycopg2.connect(**parametros_conexion())
+    cursor = conn.cursor()
+    total, inicio = 0, time.monotonic()
+    try:
+        cursor.execute("SELECT id FROM comercios ORDER BY id")
+        for (comercio_id,) in cursor.fetchall():
+            ultimo_id = 0
+            while True:
+                cursor.execute(SQL_PENDIENTES, (comercio_id, ultimo_id, lote))
+                filas = cursor.fetchall()
+                if not filas: break
+                valores = []
+                for id_pago, banco, monto, fecha, hora in filas:
+                    monto_num, moneda = MOTOR.normalizar_monto(banco, monto)
+                    valores.append((comercio_id, id_pago, monto_num, moneda, convertir_fecha(fecha, hora, zona)))
+                execute_values(cursor, """UPDATE pagos SET monto_num = COALESCE(pagos.monto_num, v.monto_num::numeric),
+                        moneda = COALESCE(pagos.moneda, v.moneda), recibido_en = COALESCE(pagos.recibido_en, v.recibido_en::timestamptz)
+                    FROM (VALUES %s) AS v (comercio_id, id, monto_num, moneda, recibido_en)
+                    WHERE pagos.comercio_id = v.comercio_id AND pagos.id = v.id""", valores, page_size=len(valores))
+                conn.commit()
+                ultimo_id, total = filas[-1][0], total + len(filas)
+                print(f"⏳ {total:,} filas convertidas (comercio {comercio_id}, hasta id {ultimo_id}) - "
+                      f"{total / (time.monotonic() - inicio):,.0f} filas/s")
+                if pausa: time.sleep(pausa)
+    finally:
+        cursor.close(); conn.close()
+    print(f"✅ Backfill completado: {total:,} filas")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Completa monto_num, moneda y recibido_en en las filas existentes de pagos")
+    parser.add_argument("--lote", type=int, default=5000, help="Filas por transacción (por defecto 5000)")
+    parser.add_argument("--pausa", type=float, default=0.0, help="Segundos de pausa entre lotes para no cargar la base de datos")
+    parser.add_argument("--zona", default=None, help="Zona horaria de las fechas antiguas (por defecto TZ_NEGOCIO)")
+    args = parser.parse_args()
+    ejecutar_backfill(args.lote, args.pausa, ZoneInfo(args.zona) if args.zona else ZONA_NEGOCIO)
@@ -1,70 +1,141 @@
-import psycopg2
+import argparse
+import csv
+import gzip
+import json
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
+
+import psycopg2
+from psycopg2 import extensions
 from dotenv import load_dotenv
 
-def ejecutar_respaldo():
+# --- RESPALDO INCREMENTAL DE LA TABLA PAGOS ---
+# Cada respaldo es un CSV generado con COPY (opcionalmente .gz). La marca de agua (la hora de la
+# instantánea) queda en respaldo_estado.json y el siguiente respaldo solo exporta las filas
+# insertadas o modificadas desde entonces (columna actualizado_en).
+COLUMNAS = ["fecha_recepcion", "hora_recepcion", "emisor", "monto", "referencia", "mensaje_completo", "estado",
+            "fecha_canje", "banco", "monto_num", "moneda", "recibido_en", "actualizado_en", "comercio_id", "alerta"]
+MARGEN = timedelta(minutes=5)  # Solape entre respaldos: cubre transacciones que confirmaron tarde
+
+def conectar():
     # 1. Cargar configuración actualizada
     load_dotenv(override=True)
-    
-    db_host = os.getenv("DB_HOST")
-    db_name = os.getenv("DB_NAME")
-    db_user = os.getenv("DB_USER")
-    db_pass = os.getenv("DB_PASS")
-    db_port = os.getenv("DB_PORT", "5432")
-    
-    entorno = "NUBE ☁️" if "neon.tech" in db_host else "LOCAL 🏠"
-    print(f"🚀 Iniciando respaldo desde: {entorno}...")
+    db_host = os.getenv("DB_HOST") or ""
+    conn = psycopg2.connect(
+        host=db_host,
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASS"),
+        port=os.getenv("DB_PORT", "5432"),
+        sslmode="require" if "neon.tech" in db_host else "disable"
+    )
+    return conn, "NUBE ☁️" if "neon.tech" in db_host else "LOCAL 🏠"
+
+def ruta_estado():
+    return os.path.join(os.getenv("RESPALDO_DIR", "."), "respaldo_estado.json")
+
+def leer_marca():
+    try:
+        with open(ruta_estado(), encoding="utf-8") as f: return datetime.fromisoformat(json.load(f)["marca"])
+    except (OSError, ValueError, KeyError): return None
+
+def abrir(nombre, modo):
+    return gzip.open(nombre, modo + "t", encoding="utf-8", newline="") if nombre.endswith(".gz") else open(nombre, modo, encoding="utf-8", newline="")
+
+def ejecutar_respaldo(completo=False, comprimir=False):
+    conn, entorno = conectar()
+    marca = None if completo else leer_marca()
+    tipo = f"incremental desde {marca:%d/%m/%Y %H:%M:%S}" if marca else "completo"
+    print(f"🚀 Iniciando respaldo {tipo} desde: {entorno}...")
 
     try:
-        # 2. Conectar a la base de datos
-        conn = psycopg2.connect(
-            host=db_host,
-            database=db_name,
-            user=db_user,
-            password=db_pass,
-            port=db_port,
-            sslmode="require" if "neon.tech" in db_host else "disable"
-        )
+        # 2. Instantánea consistente: todo lo exportado corresponde a un mismo instante
+        conn.set_session(isolation_level=extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
         cursor = conn.cursor()
+        cursor.execute("SELECT now()")
+        instante = cursor.fetchone()[0]
 
-        # 3. Obtener todos los registros de la tabla pagos
-        cursor.execute("SELECT * FROM pagos")
-        filas = cursor.fetchall()
-        
-        if not filas:
-            print("⚠️ La tabla está vacía. No hay datos para respaldar.")
-            return
+        consulta = f"SELECT {', '.join(COLUMNAS)} FROM pagos"
+        if marca: consulta = cursor.mogrify(consulta + " WHERE actualizado_en > %s", (marca - MARGEN,)).decode()
+        consulta += " ORDER BY id"
 
-        # 4. Crear el contenido del archivo SQL
+        # 3. COPY envía las filas en streaming; nunca se cargan todas en memoria
         fecha_str = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        nombre_archivo = f"Backup_Pagos_{fecha_str}.sql"
-        
-        with open(nombre_archivo, "w", encoding="utf-8") as f:
-            f.write(f"-- RESPALDO SISTEMA MV - {entorno}\n")
-            f.write(f"-- FECHA: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n")
-            f.write("-- -----------------------------------------------------\n\n")
-            
-            for r in filas:
-                # Limpiar textos para evitar errores de comillas en SQL
-                mensaje = r[6].replace("'", "''") if r[6] else ""
-                fecha_canje = f"'{r[8]}'" if r[8] else "NULL"
-                
-                sql_insert = (
-                    f"INSERT INTO pagos (fecha_recepcion, hora_recepcion, emisor, monto, referencia, mensaje_completo, estado, fecha_canje) "
-                    f"VALUES ('{r[1]}', '{r[2]}', '{r[3]}', '{r[4]}', '{r[5]}', '{mensaje}', '{r[7]}', {fecha_canje}) "
-                    f"ON CONFLICT (referencia) DO NOTHING;\n"
-                )
-                f.write(sql_insert)
+        nombre_archivo = os.path.join(os.getenv("RESPALDO_DIR", "."),
+                                      f"Backup_Pagos_{fecha_str}{'' if completo or not marca else '_inc'}.csv" + (".gz" if comprimir else ""))
+        with abrir(nombre_archivo, "w") as f:
+            cursor.copy_expert(f"COPY ({consulta}) TO STDOUT WITH (FORMAT csv, HEADER)", f)
+        filas = cursor.rowcount
+        conn.rollback()
 
-        print(f"✅ ¡Respaldo completado con éxito!")
+        # 4. Guardar la nueva marca solo cuando el archivo quedó escrito
+        with open(ruta_estado(), "w", encoding="utf-8") as f:
+            json.dump({"marca": instante.isoformat(), "archivo": nombre_archivo, "filas": filas}, f)
+
+        if filas == 0: print("⚠️ No hay filas nuevas ni modificadas desde el último respaldo.")
+        print(f"✅ ¡Respaldo completado con éxito! ({filas} filas)")
         print(f"📂 Archivo generado: {nombre_archivo}")
-        
-        cursor.close()
-        conn.close()
 
     except Exception as e:
         print(f"❌ Error durante el respaldo: {e}")
+    finally:
+        conn.close()
+
+def restaurar(archivos):
+    # Carga cada archivo con COPY en una tabla temporal, se queda con la última versión de cada
+    # referencia y de ahí actualiza las que existen e inserta las que faltan. Pasar primero el completo y
+    # luego los incrementales, en orden. Los respaldos anteriores a los comercios (sin columna
+    # comercio_id) se cargan en el comercio principal. Sirve también para los meses archivados por
+    # particiones.py: antes de insertar se crean las particiones de los meses que traiga el archivo.
+    from particiones import asegurar_para
+    conn, entorno = conectar()
+    print(f"🚀 Restaurando {len(archivos)} archivo(s) en: {entorno}...")
+    try:
+        cursor = conn.cursor()
+        for nombre in archivos:
+            with abrir(nombre, "r") as f:
+                columnas = next(csv.reader([f.readline()]))
+                desconocidas = set(columnas) - set(COLUMNAS)
+                if desconocidas: raise ValueError(f"{nombre}: columnas desconocidas {sorted(desconocidas)}")
+                lista = ", ".join(columnas)
+                cursor.execute(f"CREATE TEMP TABLE pagos_restaurar AS SELECT {lista} FROM pagos WITH NO DATA")
+                cursor.copy_expert(f"COPY pagos_restaurar ({lista}) FROM STDIN WITH (FORMAT csv)", f)
+            if "comercio_id" not in columnas:
+                cursor.execute("ALTER TABLE pagos_restaurar ADD COLUMN comercio_id INTEGER NOT NULL DEFAULT 1"); columnas.append("comercio_id")
+            if "recibido_en" not in columnas:
+                cursor.execute("ALTER TABLE pagos_restaurar ADD COLUMN recibido_en TIMESTAMPTZ"); columnas.append("recibido_en")
+            # recibido_en decide la partición: las filas viejas que no lo tienen toman su última modificación
+            respaldo = "actualizado_en, " if "actualizado_en" in columnas else ""
+            cursor.execute(f"UPDATE pagos_restaurar SET recibido_en = COALESCE({respaldo}now()) WHERE recibido_en IS NULL")
+            orden = "actualizado_en DESC NULLS LAST" if "actualizado_en" in columnas else "referencia"
+            cursor.execute(f"""CREATE TEMP TABLE pagos_ultimos AS SELECT DISTINCT ON (comercio_id, referencia) * FROM pagos_restaurar
+                               ORDER BY comercio_id, referencia, {orden}""")
+            asegurar_para(cursor, "pagos_ultimos")
+            lista = ", ".join(columnas)
+            actualizar = ", ".join(f"{c} = u.{c}" for c in columnas if c not in ("referencia", "comercio_id"))
+            cursor.execute(f"""UPDATE pagos p SET {actualizar} FROM pagos_ultimos u
+                               WHERE p.comercio_id = u.comercio_id AND p.referencia = u.referencia""")
+            actualizadas = cursor.rowcount
+            cursor.execute(f"""INSERT INTO pagos ({lista}) SELECT {lista} FROM pagos_ultimos u
+                               WHERE NOT EXISTS (SELECT 1 FROM pagos p WHERE p.comercio_id = u.comercio_id AND p.referencia = u.referencia)""")
+            insertadas = cursor.rowcount
+            cursor.execute("""INSERT INTO pagos_referencias (comercio_id, referencia, recibido_en)
+                              SELECT comercio_id, referencia, recibido_en FROM pagos_ultimos WHERE referencia IS NOT NULL
+                              ON CONFLICT (comercio_id, referencia) DO UPDATE SET recibido_en = EXCLUDED.recibido_en""")
+            print(f"✅ {nombre}: {insertadas} filas nuevas, {actualizadas} actualizadas")
+            cursor.execute("DROP TABLE pagos_restaurar, pagos_ultimos")
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Error durante la restauración: {e}")
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
-    ejecutar_respaldo()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Respaldo incremental y restauración de la tabla pagos")
+    parser.add_argument("--completo", action="store_true", help="Ignora la marca anterior y exporta toda la tabla")
+    parser.add_argument("--gzip", action="store_true", help="Comprime el archivo generado (.csv.gz)")
+    parser.add_argument("--restaurar", nargs="+", metavar="ARCHIVO", help="Carga uno o más respaldos (.csv o .csv.gz) con COPY")
+    args = parser.parse_args()
+    if args.restaurar: restaurar(args.restaurar)
+    else: ejecutar_respaldo(args.completo, args.gzip)
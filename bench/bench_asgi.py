@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from bench_carga import RAIZ, Cliente, canje_simultaneo, correr, escenarios, pedir, preparar_base, sembrar
+
+# --- SYNC (GUNICORN) CONTRA ASYNC (ASGI) ---
+# Misma base sembrada y mismos escenarios de bench_carga.py contra dos servidores:
+#   sync:  gunicorn -w W --threads T main:app  (sin gunicorn: servidor de desarrollo con hilos)
+#   async: hypercorn -w W asgi:app             (Quart + asyncpg en /webhook-bdv, /verificar y /health)
+# Ambos con el mismo tope de conexiones a Postgres (--conexiones). Postgres local responde en
+# microsegundos; --latencia-db pone delante un proxy TCP que retrasa cada viaje de ida y vuelta esos
+# milisegundos, como un Neon lejano.
+# Uso: python bench/bench_asgi.py --filas 100000 --concurrencia 50,200 --latencia-db 20
+ESCENARIOS = "health,webhook,verificar,verificar_inexistente"
+
+# --- PROXY CON LATENCIA ---
+async def _tubo(lector, escritor, retraso):
+    # Reenvía en orden, cada trozo `retraso` segundos después de recibirlo (no se acumula entre trozos)
+    loop, cola = asyncio.get_running_loop(), asyncio.Queue()
+    async def enviar():
+        while True:
+            hora, datos = await cola.get()
+            if datos is None: break
+            if hora > loop.time(): await asyncio.sleep(hora - loop.time())
+            escritor.write(datos); await escritor.drain()
+        escritor.close()
+    tarea = asyncio.create_task(enviar())
+    try:
+        while datos := await lector.read(65536): cola.put_nowait((loop.time() + retraso, datos))
+    except ConnectionError: pass
+    cola.put_nowait((0, None)); await tarea
+
+def proxy_latencia(destino, latencia_ms):
+    # Escucha en un puerto libre de 127.0.0.1 y conecta cada cliente con Postgres (host:puerto o socket unix)
+    retraso, listo = latencia_ms / 2000, threading.Event()
+    estado = {}
+    async def atender(lector, escritor):
+        host, puerto = destino
+        try:
+            if host.startswith("/"): pg_lector, pg_escritor = await asyncio.open_unix_connection(os.path.join(host, f".s.PGSQL.{puerto}"))
+            else: pg_lector, pg_escritor = await asyncio.open_connection(host, puerto)
+        except OSError: escritor.close(); return
+        await asyncio.gather(_tubo(lector, pg_escritor, retraso), _tubo(pg_lector, escritor, retraso))
+    async def servir():
+        servidor = await asyncio.start_server(atender, "127.0.0.1", 0)
+        estado["puerto"] = servidor.sockets[0].getsockname()[1]; listo.set()
+        async with servidor: await servidor.serve_forever()
+    threading.Thread(target=asyncio.run, args=(servir(),), daemon=True).start()
+    listo.wait()
+    return estado["puerto"]
+
+# --- SERVIDORES BAJO PRUEBA ---
+def levantar(modo, base, puerto, workers, hilos, conexiones, db):
+    entorno = dict(os.environ, PYTHON_DOTENV_DISABLED="1", DB_NAME=base, COLA_ARCHIVO=os.path.join(tempfile.mkdtemp(), "cola.db"), ADMIN_PASSWORD="bench",
+                   DB_POOL_MAX=str(conexiones), ASYNC_POOL_MAX=str(conexiones))
+    if db: entorno.update(DB_HOST=db[0], DB_PORT=str(db[1]))
+    if modo == "async":
+        orden = [sys.executable, "-m", "hypercorn", "-b", f"127.0.0.1:{puerto}", "-w", str(workers), "--log-level", "warning", "asgi:app"]
+    elif importlib.util.find_spec("gunicorn"):
+        orden = [sys.executable, "-m", "gunicorn", "-b", f"127.0.0.1:{puerto}", "-w", str(workers),
+                 "--threads", str(hilos), "--log-level", "warning", "main:app"]
+    else:
+        orden = [sys.executable, "-c", f"import main; main.app.run(host='127.0.0.1', port={puerto}, threaded=True)"]
+    proceso = subprocess.Popen(orden, cwd=RAIZ, env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(200):
+        try:
+            if pedir(Cliente("127.0.0.1", puerto), "GET", "/health")[0] == 200: return proceso, " ".join(orden[2:4] if "-m" in orden else orden[1:2])
+        except OSError: pass
+        time.sleep(0.1)
+    proceso.kill(); raise RuntimeError(f"El servidor {modo} no respondió en /health")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara gunicorn (sync) con el modo ASGI (async) bajo la misma carga")
+    parser.add_argument("--filas", type=int, default=100000, help="Pagos sembrados")
+    parser.add_argument("--concurrencia", default="50,200", help="Clientes simultáneos, separados por coma")
+    parser.add_argument("--duracion", type=float, default=10.0, help="Segundos por escenario")
+    parser.add_argument("--escenarios", default=ESCENARIOS)
+    parser.add_argument("--workers", type=int, default=1, help="Procesos de cada servidor")
+    parser.add_argument("--hilos", type=int, default=16, help="Hilos por worker de gunicorn")
+    parser.add_argument("--conexiones", type=int, default=16, help="Tope del pool de Postgres por worker (los dos servidores)")
+    parser.add_argument("--latencia-db", type=float, default=0.0, help="Milisegundos añadidos a cada ida y vuelta con Postgres")
+    parser.add_argument("--puerto", type=int, default=5097)
+    parser.add_argument("--salida", default=os.path.join(RAIZ, "bench", "resultados"))
+    parser.add_argument("--permitir-remoto", action="store_true", help="Acepta un DB_HOST que no es local")
+    args = parser.parse_args()
+
+    base = os.getenv("BENCH_DB_NAME", "notipagos_bench")
+    conn = preparar_base(base, args.permitir_remoto)
+    db = None
+    if args.latencia_db:
+        db = ("127.0.0.1", proxy_latencia((os.getenv("DB_HOST") or "localhost", int(os.getenv("DB_PORT", "5432"))), args.latencia_db))
+    commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True, text=True).stdout.strip()
+    informe = {"fecha": datetime.now().isoformat(timespec="seconds"), "commit": commit, "python": platform.python_version(),
+               "base": base, "parametros": vars(args), "resultados": {}}
+    for modo in ("sync", "async"):
+        informe["resultados"][modo] = por_modo = {}
+        for concurrencia in (int(c) for c in args.concurrencia.split(",")):
+            sembrar(conn, args.filas)
+            proceso, servidor = levantar(modo, base, args.puerto, args.workers, args.hilos, args.conexiones, db)
+            try:
+                generadores = escenarios(args.filas, None, 1)
+                generadores["health"] = lambda: ("GET", "/health", None, None, None)
+                por_modo[str(concurrencia)] = resultado = {"servidor": servidor}
+                for nombre in args.escenarios.split(","):
+                    resultado[nombre] = r = correr(args.puerto, generadores[nombre], concurrencia, args.duracion, 0)
+                    print(f"{modo:<5} | {concurrencia:>4} clientes | {nombre:<22} | {r['req_s']:>8} req/s | p50 {r['p50_ms']:>8} ms | "
+                          f"p95 {r['p95_ms']:>8} ms | p99 {r['p99_ms']:>8} ms | errores {r['errores']}")
+                resultado["canje_simultaneo"] = c = canje_simultaneo(conn, args.puerto, min(concurrencia, 32))
+                print(f"{modo:<5} | {concurrencia:>4} clientes | canje simultáneo       | {c['validos']} VÁLIDO de {c['concurrencia']} -> "
+                      f"{'✅' if c['correcto'] else '❌'}")
+            finally:
+                proceso.terminate(); proceso.wait()
+    conn.close()
+    os.makedirs(args.salida, exist_ok=True)
+    archivo = os.path.join(args.salida, f"asgi_{datetime.now():%Y-%m-%d_%H-%M-%S}.json")
+    with open(archivo, "w", encoding="utf-8") as f: json.dump(informe, f, ensure_ascii=False, indent=2)
+    print(f"📂 Resultados en {archivo}")
@@ -0,0 +1,260 @@
+import argparse
+import gzip
+import http.client
+import importlib.util
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlencode
+
+import psycopg2
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+from pool_db import parametros_conexion
+from esquema import migrar
+from particiones import asegurar, asegurar_para
+
+# --- PRUEBA DE CARGA CONTRA UN POSTGRES LOCAL ---
+# Crea (o reutiliza) la base de datos BENCH_DB_NAME (por defecto notipagos_bench; nunca la de .env)
+# en el servidor BENCH_DB_HOST, o en DB_HOST solo si es local (socket, localhost): .env suele apuntar a Neon.
+# la siembra con pagos sintéticos a cada escala, levanta la app en un proceso aparte y la somete a
+# varios escenarios con N hilos. Por escenario informa req/s, p50/p95/p99 y consultas a Postgres
+# por petición (leídas de /metrics), y guarda todo en bench/resultados/carga_<fecha>.json.
+# Uso: python bench/bench_carga.py --escalas 10000,100000,1000000 --concurrencia 16 --duracion 10
+BANCOS_SEMILLA = ("BDV", "BANESCO", "SOFITASA", "BINANCE", "NEQUI", "BANCOLOMBIA")
+MONEDAS_SEMILLA = ("VES", "VES", "VES", "USD", "COP", "COP")
+RE_CONSULTAS = re.compile(r"^notipagos_db_consulta_segundos_count\{[^}]*\} (\d+)$", re.M)
+
+def percentil(valores, p):
+    return valores[min(len(valores) - 1, int(len(valores) * p))] if valores else 0.0
+
+# --- BASE DE DATOS DE PRUEBA ---
+HOSTS_LOCALES = {"", "localhost", "127.0.0.1", "::1"}
+
+def servidor_bench(permitir_remoto=False):
+    # Fija DB_HOST/DB_PORT del benchmark (este proceso y la app que levanta). Un DB_HOST remoto (el de
+    # .env) solo con --permitir-remoto; BENCH_DB_HOST se toma tal cual porque se eligió a propósito.
+    host = os.getenv("BENCH_DB_HOST") or os.getenv("DB_HOST") or ""
+    if not (os.getenv("BENCH_DB_HOST") or permitir_remoto or host in HOSTS_LOCALES or host.startswith("/")):
+        raise SystemExit(f"❌ DB_HOST={host} no es local. Usa BENCH_DB_HOST=localhost (o --permitir-remoto si de verdad es un servidor de pruebas)")
+    os.environ["DB_HOST"] = host
+    if os.getenv("BENCH_DB_PORT"): os.environ["DB_PORT"] = os.environ["BENCH_DB_PORT"]
+
+def preparar_base(nombre, permitir_remoto=False):
+    servidor_bench(permitir_remoto)
+    parametros = parametros_conexion()
+    admin = psycopg2.connect(**dict(parametros, database="postgres")); admin.autocommit = True
+    cursor = admin.cursor()
+    cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (nombre,))
+    if not cursor.fetchone(): cursor.execute(f'CREATE DATABASE "{nombre}"')
+    admin.close()
+    conn = psycopg2.connect(**dict(parametros, database=nombre))
+    migrar(conn, salida=lambda _: None); asegurar(conn)
+    return conn
+
+def sembrar(conn, filas):
+    # Completa la tabla hasta `filas` pagos: las escalas se siembran de menor a mayor sin empezar de cero
+    cursor = conn.cursor()
+    # Lo que hayan dejado los escenarios anteriores (webhooks y canjes) se limpia para comparar igual
+    cursor.execute("DELETE FROM pagos WHERE referencia NOT LIKE 'B%'")
+    cursor.execute("DELETE FROM pagos_referencias WHERE referencia NOT LIKE 'B%'")
+    cursor.execute("DELETE FROM pagos_huellas WHERE referencia NOT LIKE 'B%'")
+    cursor.execute("UPDATE pagos SET estado = CASE WHEN id % 3 = 0 THEN 'CANJEADO' ELSE 'LIBRE' END, fecha_canje = NULL "
+                   "WHERE fecha_canje IS NOT NULL")
+    conn.commit()
+    cursor.execute("SELECT count(*) FROM pagos"); actuales = cursor.fetchone()[0]
+    if actuales > filas:
+        cursor.execute("TRUNCATE pagos, pagos_referencias, pagos_huellas RESTART IDENTITY"); actuales = 0
+    if actuales < filas:
+        inicio = time.perf_counter()
+        # Las filas llegan hasta filas × 7 s atrás (unos 81 días con un millón): los meses que asegurar()
+        # no crea se crean aquí, un punto por día basta para tocar todos
+        asegurar_para(cursor, f"""(SELECT 1 AS comercio_id, generate_series(now() - {int(filas)} * interval '7 seconds', now(),
+                                         interval '1 day') AS recibido_en) dias""")
+        # Sin el trigger de NOTIFY: sembrar un millón de filas no debe inundar la escucha de la app
+        cursor.execute("ALTER TABLE pagos DISABLE TRIGGER pagos_notificar_insert")
+        cursor.execute("""INSERT INTO pagos (fecha_recepcion, hora_recepcion, emisor, monto, referencia, mensaje_completo,
+                                             estado, banco, monto_num, moneda, recibido_en)
+            SELECT to_char(t, 'DD/MM/YYYY'), to_char(t, 'HH12:MI AM'), '0414' || lpad((g %% 10000000)::text, 7, '0'),
+                   (g %% 5000) || ',' || lpad((g %% 100)::text, 2, '0'), 'B' || lpad(g::text, 11, '0'), 'Mensaje sintético ' || g,
+                   CASE WHEN g %% 3 = 0 THEN 'CANJEADO' ELSE 'LIBRE' END, (%s::text[])[1 + g %% 6],
+                   (g %% 5000) + (g %% 100) / 100.0, (%s::text[])[1 + g %% 6], t
+            FROM generate_series(%s::bigint, %s) g, LATERAL (SELECT now() - (%s - g) * interval '7 seconds' AS t) r""",
+                       (list(BANCOS_SEMILLA), list(MONEDAS_SEMILLA), actuales + 1, filas, filas))
+        cursor.execute("""INSERT INTO pagos_referencias (comercio_id, referencia, recibido_en)
+            SELECT comercio_id, referencia, recibido_en FROM pagos WHERE referencia LIKE 'B%' ON CONFLICT DO NOTHING""")
+        cursor.execute("ALTER TABLE pagos ENABLE TRIGGER pagos_notificar_insert")
+        conn.commit()
+        conn.autocommit = True; cursor.execute("VACUUM ANALYZE pagos"); conn.autocommit = False
+        print(f"🌱 {filas - actuales:,} pagos sembrados en {time.perf_counter() - inicio:.1f} s")
+
+# --- SERVIDOR BAJO PRUEBA ---
+def levantar_app(base, puerto, workers, hilos, cache):
+    # PYTHON_DOTENV_DISABLED: la app no debe volver a leer DB_HOST/DB_NAME de .env
+    entorno = dict(os.environ, PYTHON_DOTENV_DISABLED="1", DB_NAME=base, COLA_ARCHIVO=os.path.join(tempfile.mkdtemp(), "cola.db"),
+                   CACHE_REFS="1" if cache else "0", DB_POOL_MAX=str(max(hilos, 10)), ADMIN_PASSWORD="bench")
+    if importlib.util.find_spec("gunicorn"):
+        orden = [sys.executable, "-m", "gunicorn", "-b", f"127.0.0.1:{puerto}", "-w", str(workers),
+                 "--threads", str(hilos), "--log-level", "warning", "main:app"]
+    else:
+        # Sin gunicorn: servidor de desarrollo con un hilo por petición (solo un proceso)
+        orden = [sys.executable, "-c", f"import main; main.app.run(host='127.0.0.1', port={puerto}, threaded=True)"]
+    proceso = subprocess.Popen(orden, cwd=RAIZ, env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            if pedir(Cliente("127.0.0.1", puerto), "GET", "/health")[0] == 200: return proceso, orden[2 if "gunicorn" in orden else 1]
+        except OSError: pass
+        time.sleep(0.1)
+    proceso.kill(); raise RuntimeError("La app no respondió en /health")
+
+class Cliente:
+    # Una conexión keep-alive por hilo; se reabre si el servidor la cierra
+    def __init__(self, host, puerto, cookie=None):
+        self.host, self.puerto, self.cookie, self.conn = host, puerto, cookie, None
+
+def pedir(cliente, metodo, ruta, cuerpo=None, tipo=None):
+    cabeceras = {"Accept-Encoding": "gzip"}
+    if tipo: cabeceras["Content-Type"] = tipo
+    if cliente.cookie: cabeceras["Cookie"] = cliente.cookie
+    for intento in range(2):
+        if cliente.conn is None: cliente.conn = http.client.HTTPConnection(cliente.host, cliente.puerto, timeout=120)
+        try:
+            cliente.conn.request(metodo, ruta, cuerpo, cabeceras)
+            resp = cliente.conn.getresponse(); datos = resp.read()
+            if resp.getheader("Connection", "").lower() == "close" or resp.version == 10: cliente.conn.close(); cliente.conn = None
+            return resp.status, datos, resp
+        except (http.client.HTTPException, ConnectionError):
+            cliente.conn.close(); cliente.conn = None
+            if intento: raise
+
+def texto(datos, resp):
+    return (gzip.decompress(datos) if resp.getheader("Content-Encoding") == "gzip" else datos).decode()
+
+def iniciar_sesion(puerto):
+    _, _, resp = pedir(Cliente("127.0.0.1", puerto), "POST", "/login", "password=bench", "application/x-www-form-urlencoded")
+    return resp.getheader("Set-Cookie").split(";")[0]
+
+def consultas_db(puerto):
+    # Suma de todas las series "proceso" que devuelva el worker que atienda el scrape
+    _, datos, resp = pedir(Cliente("127.0.0.1", puerto), "GET", "/metrics")
+    return sum(int(n) for n in RE_CONSULTAS.findall(texto(datos, resp)))
+
+# --- ESCENARIOS ---
+def mensaje_bdv(n):
+    return f"PagomovilBDV recibiste del 0414{n % 10000000:07d} por Bs.{n % 5000},{n % 100:02d} Ref: 9{n:011d}"
+
+def escenarios(filas, sesion, lote):
+    contador = iter(range(10**9))
+    refs = lambda: f"{random.randint(1, filas):011d}"[-6:]
+    return {
+        "webhook": lambda: ("POST", "/webhook-bdv", json.dumps({"mensaje": mensaje_bdv(next(contador))}), "application/json", None),
+        "webhook_lote": lambda: ("POST", "/webhook-bdv/lote", json.dumps({"mensajes": [mensaje_bdv(next(contador)) for _ in range(lote)]}),
+                                 "application/json", None),
+        "verificar": lambda: ("POST", "/verificar", urlencode({"ref": refs()}), "application/x-www-form-urlencoded", None),
+        "verificar_inexistente": lambda: ("POST", "/verificar", urlencode({"ref": f"{random.randint(0, 999999):06d}X"}),
+                                          "application/x-www-form-urlencoded", None),
+        "admin": lambda: ("GET", "/admin", None, None, sesion),
+        "admin_filtros": lambda: ("GET", "/admin?" + urlencode({"q": "0414" + str(random.randint(0, 999)), "banco": random.choice(BANCOS_SEMILLA)}),
+                                  None, None, sesion),
+        "exportar_csv": lambda: ("GET", "/admin/exportar?formato=csv&" + urlencode({"desde": datetime.now().strftime("%Y-%m-%d")}),
+                                 None, None, sesion),
+    }
+
+def correr(puerto, generador, concurrencia, duracion, maximo):
+    latencias, errores, hechas = [], [0], [0]
+    bloqueo, fin = threading.Lock(), time.perf_counter() + duracion
+    def hilo():
+        cliente, propias = Cliente("127.0.0.1", puerto), []
+        while time.perf_counter() < fin:
+            with bloqueo:
+                if maximo and hechas[0] >= maximo: break
+                hechas[0] += 1
+            metodo, ruta, cuerpo, tipo, cookie = generador()
+            cliente.cookie = cookie
+            inicio = time.perf_counter()
+            try: estado = pedir(cliente, metodo, ruta, cuerpo, tipo)[0]
+            except OSError: estado = 0
+            propias.append(time.perf_counter() - inicio)
+            if estado >= 400 or estado == 0:
+                with bloqueo: errores[0] += 1
+        with bloqueo: latencias.extend(propias)
+    antes = consultas_db(puerto)
+    inicio = time.perf_counter()
+    hilos = [threading.Thread(target=hilo) for _ in range(concurrencia)]
+    for h in hilos: h.start()
+    for h in hilos: h.join()
+    transcurrido = time.perf_counter() - inicio
+    consultas = consultas_db(puerto) - antes
+    latencias.sort(); ms = lambda p: round(percentil(latencias, p) * 1000, 2)
+    return {"peticiones": len(latencias), "errores": errores[0], "segundos": round(transcurrido, 2),
+            "req_s": round(len(latencias) / transcurrido, 1), "p50_ms": ms(0.5), "p95_ms": ms(0.95), "p99_ms": ms(0.99),
+            "max_ms": round(latencias[-1] * 1000, 2) if latencias else 0.0,
+            "consultas_db_por_peticion": round(consultas / len(latencias), 2) if latencias else 0.0}
+
+def canje_simultaneo(conn, puerto, concurrencia):
+    # N cajeros canjean la misma referencia a la vez: exactamente uno debe obtener VÁLIDO
+    cursor = conn.cursor()
+    cursor.execute("SELECT referencia FROM pagos WHERE estado = 'LIBRE' AND referencia LIKE 'B%' ORDER BY id DESC LIMIT 1")
+    ref = cursor.fetchone()[0]; conn.rollback()
+    barrera, resultados = threading.Barrier(concurrencia), []
+    def hilo():
+        cliente = Cliente("127.0.0.1", puerto); barrera.wait()
+        _, datos, resp = pedir(cliente, "POST", "/verificar", urlencode({"ref": ref}), "application/x-www-form-urlencoded")
+        resultados.append("VÁLIDO" in texto(datos, resp))
+    hilos = [threading.Thread(target=hilo) for _ in range(concurrencia)]
+    for h in hilos: h.start()
+    for h in hilos: h.join()
+    return {"concurrencia": concurrencia, "validos": sum(resultados), "correcto": sum(resultados) == 1}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga de la app contra un Postgres local")
+    parser.add_argument("--escalas", default="10000,100000,1000000", help="Filas sembradas por escala, separadas por coma")
+    parser.add_argument("--concurrencia", type=int, default=16)
+    parser.add_argument("--duracion", type=float, default=10.0, help="Segundos por escenario")
+    parser.add_argument("--escenarios", default="webhook,webhook_lote,verificar,verificar_inexistente,admin,admin_filtros,exportar_csv")
+    parser.add_argument("--max-export", type=int, default=20, help="Tope de exportaciones por corrida (son pesadas)")
+    parser.add_argument("--lote", type=int, default=100, help="Mensajes por petición en webhook_lote")
+    parser.add_argument("--workers", type=int, default=1, help="Workers de gunicorn (con más de 1, /metrics muestra solo uno)")
+    parser.add_argument("--hilos", type=int, default=16, help="Hilos por worker de gunicorn")
+    parser.add_argument("--sin-cache", action="store_true", help="Desactiva la caché de referencias (CACHE_REFS=0)")
+    parser.add_argument("--puerto", type=int, default=5099)
+    parser.add_argument("--salida", default=os.path.join(RAIZ, "bench", "resultados"))
+    parser.add_argument("--permitir-remoto", action="store_true", help="Acepta un DB_HOST que no es local")
+    args = parser.parse_args()
+
+    base = os.getenv("BENCH_DB_NAME", "notipagos_bench")
+    conn = preparar_base(base, args.permitir_remoto)
+    commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True, text=True).stdout.strip()
+    informe = {"fecha": datetime.now().isoformat(timespec="seconds"), "commit": commit, "python": platform.python_version(),
+               "base": base, "parametros": vars(args), "escalas": {}}
+    for filas in sorted(int(e) for e in args.escalas.split(",")):
+        sembrar(conn, filas)
+        proceso, servidor = levantar_app(base, args.puerto, args.workers, args.hilos, not args.sin_cache)
+        informe["servidor"] = servidor
+        try:
+            sesion = iniciar_sesion(args.puerto)
+            generadores, resultado = escenarios(filas, sesion, args.lote), {}
+            for nombre in args.escenarios.split(","):
+                maximo = args.max_export if nombre.startswith("exportar") else 0
+                resultado[nombre] = r = correr(args.puerto, generadores[nombre], args.concurrencia, args.duracion, maximo)
+                print(f"{filas:>9,} | {nombre:<22} | {r['req_s']:>8} req/s | p50 {r['p50_ms']:>8} ms | p95 {r['p95_ms']:>8} ms | "
+                      f"p99 {r['p99_ms']:>8} ms | {r['consultas_db_por_peticion']:>5} consultas/pet | errores {r['errores']}")
+            resultado["canje_simultaneo"] = c = canje_simultaneo(conn, args.puerto, args.concurrencia)
+            print(f"{filas:>9,} | canje simultáneo       | {c['validos']} VÁLIDO de {c['concurrencia']} -> {'✅' if c['correcto'] else '❌'}")
+            informe["escalas"][str(filas)] = resultado
+        finally:
+            proceso.terminate(); proceso.wait()
+    conn.close()
+    os.makedirs(args.salida, exist_ok=True)
+    archivo = os.path.join(args.salida, f"carga_{datetime.now():%Y-%m-%d_%H-%M-%S}.json")
+    with open(archivo, "w", encoding="utf-8") as f: json.dump(informe, f, ensure_ascii=False, indent=2)
+    print(f"📂 Resultados en {archivo}")
@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_carga import RAIZ, preparar_base
+
+# --- PRUEBA DE CARGA DEL SERVIDOR DE EVENTOS ---
+# Levanta eventos.py escuchando un canal propio (EVENTOS_CANAL=pagos_bench_eventos) sobre la base de
+# bench_carga.py (BENCH_DB_NAME, con la misma negativa ante un DB_HOST remoto), abre N conexiones SSE
+# a /eventos, dispara M avisos con pg_notify en ese canal y mide cuánto tarda cada aviso en llegar a
+# todos los clientes. Ni la tabla pagos ni el canal pagos_cambios de la app se tocan.
+# Uso: python bench/bench_eventos.py [clientes] [avisos] [--puerto 5098]
+CANAL_BENCH = "pagos_bench_eventos"
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))] if valores else 0.0
+
+def levantar_eventos(base, puerto):
+    entorno = dict(os.environ, PYTHON_DOTENV_DISABLED="1", DB_NAME=base, EVENTOS_CANAL=CANAL_BENCH, EVENTOS_PUERTO=str(puerto))
+    proceso = subprocess.Popen([sys.executable, "-u", "eventos.py"], cwd=RAIZ, env=entorno, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, text=True)
+    # Listo cuando ya escucha el canal: antes, los avisos se perderían
+    for linea in proceso.stdout:
+        if linea.startswith("👂"): return proceso
+    proceso.kill(); raise RuntimeError("eventos.py terminó sin escuchar el canal")
+
+async def cliente(host, puerto, ruta, listos, latencias, esperados):
+    reader, writer = await asyncio.open_connection(host, puerto)
+    writer.write(f"GET {ruta} HTTP/1.1\r\nHost: {host}\r\nAccept: text/event-stream\r\n\r\n".encode())
+    await writer.drain()
+    while (await reader.readline()) not in (b"\r\n", b""): pass
+    listos.release()
+    recibidos = 0
+    while recibidos < esperados:
+        linea = await reader.readline()
+        if not linea: break
+        if linea.startswith(b"data: "):
+            # La marca de envío viaja en el campo banco del evento de prueba
+            latencias.append(time.time() - float(json.loads(linea[6:])["banco"])); recibidos += 1
+    writer.close()
+
+async def principal(conn, clientes, avisos, puerto):
+    listos, latencias = asyncio.Semaphore(0), []
+    inicio = time.perf_counter()
+    tareas = [asyncio.create_task(cliente("127.0.0.1", puerto, "/eventos", listos, latencias, avisos)) for _ in range(clientes)]
+    for _ in range(clientes): await listos.acquire()
+    conexion = time.perf_counter() - inicio
+    cursor = conn.cursor()
+    for i in range(avisos):
+        # Igual que un aviso del trigger pagos_notificar del comercio 1 (el de /eventos sin sesión)
+        evento = {"op": "INSERT", "id": i + 1, "comercio_id": 1, "referencia": f"BENCH{i:06d}", "estado": "LIBRE",
+                  "banco": repr(time.time())}
+        cursor.execute("SELECT pg_notify(%s, %s)", (CANAL_BENCH, json.dumps(evento))); conn.commit()
+        await asyncio.sleep(0.05)
+    await asyncio.wait_for(asyncio.gather(*tareas), 30)
+    ms = [l * 1000 for l in latencias]
+    print(f"{clientes} clientes conectados en {conexion * 1000:.0f} ms | {len(ms)}/{clientes * avisos} eventos entregados")
+    print(f"latencia p50 {percentil(ms, 0.5):.1f} ms | p95 {percentil(ms, 0.95):.1f} ms | máx {max(ms, default=0):.1f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga del servidor de eventos (SSE)")
+    parser.add_argument("clientes", nargs="?", type=int, default=500)
+    parser.add_argument("avisos", nargs="?", type=int, default=20)
+    parser.add_argument("--puerto", type=int, default=5098)
+    parser.add_argument("--permitir-remoto", action="store_true", help="Acepta un DB_HOST que no es local")
+    args = parser.parse_args()
+    base = os.getenv("BENCH_DB_NAME", "notipagos_bench")
+    conn = preparar_base(base, args.permitir_remoto)
+    proceso = levantar_eventos(base, args.puerto)
+    try: asyncio.run(principal(conn, args.clientes, args.avisos, args.puerto))
+    finally:
+        proceso.terminate(); proceso.wait(); conn.close()
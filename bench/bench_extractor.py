@@ -0,0 +1,65 @@
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from extractor import extractor_inteligente
+
+# --- EXTRACTOR ORIGINAL (referencia para comparar salida y rendimiento) ---
+def extractor_original(texto):
+    texto_limpio = texto.replace('"', '').replace('\\n', ' ').replace('\n', ' ').strip()
+    pagos_detectados = []
+    patrones = {
+        "BDV": (r"BDV|PagomovilBDV", r"(?:del|tlf|desde el tlf)\s*(\d{4}[- ]\d+|\d{10,11})", r"(?:por|Bs\.?|Monto:)\s*([\d.]+,\d{2})", r"Ref:\s*(\d+)"),
+        "BANESCO": (r"Banesco", r"(?:de|desde|tlf)\s*(\d{10,11})", r"(?:Bs\.?|Monto:?\s*Bs\.?|por)\s*([\d.]+,\d{2})", r"Ref:\s*(\d+)"),
+        "SOFITASA": (r"SOFITASA", r"Telf\.(\d{4,11}|\d{4}\*\*\*\d{4})", r"Bs\.?([\d.]+,\d{2})", r"Ref:(\d+)"),
+        "BINANCE": (r"Binance", r"(?:from|de)\s+(.*?)\s+(?:received|el)", r"([\d.]+)\s*USDT", r"(?:ID|Order):\s*(\d+)"),
+        "BANCOLOMBIA": (r"Bancolombia", r"en\s+(.*?)\s+por", r"\$\s*([\d.]+)", r"Ref\.\s*(\d+)"),
+        "NEQUI": (r"Nequi", r"De\s+(.*?)\s?te", r"\$\s*([\d.]+)", r"referencia\s*(\d+)"),
+        "PLAZA": (r"Plaza", r"desde\s+(.*?)\s+por", r"Bs\.\s*([\d.]+,\d{2})", r"Ref:\s*(\d+)")
+    }
+    for banco, (key, re_emi, re_mon, re_ref) in patrones.items():
+        if re.search(key, texto_limpio, re.IGNORECASE):
+            m_emi = re.search(re_emi, texto_limpio, re.IGNORECASE)
+            m_mon = re.search(re_mon, texto_limpio, re.IGNORECASE)
+            m_ref = re.search(re_ref, texto_limpio, re.IGNORECASE)
+            if m_ref:
+                pagos_detectados.append({"banco": banco, "emisor": m_emi.group(1) if m_emi else "S/D",
+                                         "monto": m_mon.group(1) if m_mon else "0,00", "referencia": m_ref.group(1)})
+    return pagos_detectados
+
+# --- CORPUS (formato real de las notificaciones que envía MacroDroid) ---
+CORPUS = [
+    "PagomovilBDV Recibiste un PagomovilBDV por Bs. 1.250,00 del 0414-1234567 Ref: 001234567890 fecha: 17-10-26 hora: 09:15",
+    "BDV digital Recibiste un Pago Movil de Bs. 350,00 desde el tlf 04241234567 Ref: 000987654321",
+    "\"PagomovilBDV\" Recibiste un PagomovilBDV por Bs. 45.780,35 del 0412 7654321\\nRef: 123409876543",
+    "Banesco Pago Movil Recibido Monto: Bs. 2.000,00 de 04161112233 Ref: 84512369",
+    "Banesco: Has recibido un pago movil por Bs.120,00 tlf 04261239876 Ref: 11223344",
+    "SOFITASA Pago Movil Recibido Telf.0414***5678 Bs.120,50 Ref:987654",
+    "SOFITASA Recibiste Bs.1.000,00 de Telf.04145556677 Ref:123123",
+    "Binance You have received 25.50 USDT from Juan Perez received via Binance Pay Order: 298765432109",
+    "Binance Pay Recibiste 100 USDT de Maria Gonzalez el 17/10 ID: 300011122233",
+    "Bancolombia: Recibiste una transferencia en Ahorros por $ 80.000 Ref. 112233",
+    "Nequi De Carlos Ruiz te llegaron $ 150.000 referencia 556677",
+    "Nequi: De Ana te enviaron $ 20.000 referencia M1234567",
+    "Banco Plaza Pago recibido desde 04121234567 por Bs. 45,00 Ref: 334455",
+    "WhatsApp: Hola, ya te hice el pago por BDV",
+    "Recordatorio: su tarjeta vence pronto",
+    "PagomovilBDV Recibiste un PagomovilBDV por Bs. 10,00 del 04141234567",
+]
+
+def medir(funcion, iteraciones):
+    inicio = time.perf_counter()
+    for _ in range(iteraciones):
+        for texto in CORPUS: funcion(texto)
+    return time.perf_counter() - inicio
+
+if __name__ == "__main__":
+    # Que la salida sea idéntica a la del original lo comprueba tests/test_extractor.py
+    iteraciones = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    total = iteraciones * len(CORPUS)
+    t_viejo, t_nuevo = medir(extractor_original, iteraciones), medir(extractor_inteligente, iteraciones)
+    print(f"Original: {t_viejo:.3f}s  ({total / t_viejo:,.0f} msg/s)")
+    print(f"Motor:    {t_nuevo:.3f}s  ({total / t_nuevo:,.0f} msg/s)")
+    print(f"Aceleración: x{t_viejo / t_nuevo:.2f}")
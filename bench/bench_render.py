@@ -0,0 +1,40 @@
+import gzip
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flask import render_template, render_template_string
+import main
+
+# --- BENCHMARK DE RENDER DEL PANEL ADMIN ---
+# Antes: render_template_string (compila la plantilla en cada petición) con todo el CSS incrustado.
+# Ahora: plantilla precompilada + CSS en /estilos.css. Uso: python bench/bench_render.py [filas] [repeticiones]
+HTML_ADMIN_ANTERIOR = main.HTML_ADMIN.replace(
+    '<link rel="stylesheet" href="{{ url_for(\'estilos\', v=css_version) }}">', '<style>' + main.CSS_FINAL + '</style>')
+
+def pagos_falsos(n):
+    return [(i, "17/10/2026", "09:15 AM", f"0414{i:07d}", f"{i % 5000},00", f"{i:012d}",
+             "LIBRE" if i % 3 else "CANJEADO", ("BDV", "BANESCO", "BINANCE", "NEQUI")[i % 4]) for i in range(n, 0, -1)]
+
+def medir(renderizar, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones): html = renderizar()
+    return (time.perf_counter() - inicio) / repeticiones * 1000, html
+
+if __name__ == "__main__":
+    filas = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeticiones = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    contexto = dict(pagos=pagos_falsos(filas), totales={"bs": "0,00", "usd": "0,00", "cop": "0"}, filtros={},
+                    paginacion={}, bancos=["BDV", "BANESCO", "BINANCE", "NEQUI"], logo_url="/static/logo.png")
+    with main.app.test_request_context("/admin"):
+        t_antes, html_antes = medir(lambda: render_template_string(HTML_ADMIN_ANTERIOR, **contexto), repeticiones)
+        t_ahora, html_ahora = medir(lambda: render_template("admin.html", **contexto), repeticiones)
+        # Plantilla vacía: aísla el costo fijo por petición (compilación + CSS) del costo de las filas
+        vacio = dict(contexto, pagos=[])
+        t_antes_0, html_antes_0 = medir(lambda: render_template_string(HTML_ADMIN_ANTERIOR, **vacio), repeticiones * 10)
+        t_ahora_0, html_ahora_0 = medir(lambda: render_template("admin.html", **vacio), repeticiones * 10)
+
+    def tam(html): return f"{len(html.encode()) / 1024:8.1f} KB (gzip {len(gzip.compress(html.encode(), 6)) / 1024:7.1f} KB)"
+    print(f"{filas:,} filas  | antes: {t_antes:8.2f} ms  {tam(html_antes)} | ahora: {t_ahora:8.2f} ms  {tam(html_ahora)}")
+    print(f"0 filas       | antes: {t_antes_0:8.2f} ms  {tam(html_antes_0)} | ahora: {t_ahora_0:8.2f} ms  {tam(html_ahora_0)}")
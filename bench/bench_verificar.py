@@ -0,0 +1,58 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_carga import preparar_base, sembrar
+from verificacion import parametros_canje
+
+# --- BENCHMARK DE /verificar: LIKE '%sufijo' vs índice sobre reverse(referencia) ---
+# Usa la misma base que bench_carga.py (BENCH_DB_NAME, por defecto notipagos_bench; nunca la de .env)
+# con la misma protección contra un DB_HOST remoto, y la siembra con sus pagos sintéticos del comercio 1.
+# Lo nuevo es exactamente lo que hace verificacion.canjear_referencia: la CTE de canje en los últimos
+# VERIFICAR_DIAS y, si no aparece, en todo el comercio. Cada consulta se deshace (rollback) para que
+# los canjes no cambien las siguientes. Uso: python bench/bench_verificar.py [100000 1000000]
+COMERCIO = 1
+SQL_ANTERIOR = "SELECT emisor, monto, estado, referencia FROM pagos WHERE comercio_id = %s AND referencia LIKE %s LIMIT 1"
+
+def anterior(cursor, sufijo):
+    cursor.execute(SQL_ANTERIOR, (COMERCIO, "%" + sufijo)); cursor.fetchone()
+
+def nuevo(cursor, sufijo):
+    cursor.execute(*parametros_canje(sufijo, COMERCIO, True))
+    if not cursor.fetchone():
+        cursor.execute(*parametros_canje(sufijo, COMERCIO, False)); cursor.fetchone()
+
+def medir(conn, consulta, sufijos):
+    cursor = conn.cursor(); tiempos = []
+    for s in sufijos:
+        inicio = time.perf_counter()
+        consulta(cursor, s)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+        conn.rollback()
+    tiempos.sort()
+    return sum(tiempos) / len(tiempos), tiempos[int(len(tiempos) * 0.95) - 1]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara la búsqueda por últimos dígitos de /verificar contra LIKE '%ref'")
+    parser.add_argument("escalas", nargs="*", type=int, default=[100_000, 1_000_000], help="Filas sembradas por escala")
+    parser.add_argument("--permitir-remoto", action="store_true", help="Acepta un DB_HOST que no es local")
+    args = parser.parse_args()
+    consultas = int(os.getenv("BENCH_CONSULTAS", "200"))
+    conn = preparar_base(os.getenv("BENCH_DB_NAME", "notipagos_bench"), args.permitir_remoto)
+    cursor = conn.cursor()
+    try:
+        for filas in sorted(args.escalas):
+            sembrar(conn, filas)
+            # Mitad referencias que existen (de cualquier antigüedad), mitad que no
+            cursor.execute("SELECT referencia FROM pagos WHERE comercio_id = %s ORDER BY random() LIMIT %s", (COMERCIO, consultas // 2))
+            sufijos = [r[0][-6:] for r in cursor.fetchall()] + [f"{random.randint(0, 999999):06d}x" for _ in range(consultas // 2)]
+            conn.rollback()
+            media_a, p95_a = medir(conn, anterior, sufijos)
+            media_n, p95_n = medir(conn, nuevo, sufijos)
+            print(f"{filas:>10,} filas | LIKE '%ref': media {media_a:8.3f} ms  p95 {p95_a:8.3f} ms"
+                  f" | canje: media {media_n:7.3f} ms  p95 {p95_n:7.3f} ms | x{media_a / media_n:,.0f}")
+    finally:
+        conn.close()
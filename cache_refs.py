@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# --- CACHÉ CALIENTE DE REFERENCIAS RECIENTES ---
+# Se llena con los avisos NOTIFY de cada pago nuevo (los de todos los workers) y se indexa por
+# sufijo, que es lo que escribe el cajero. Responde sin ir a la base de datos:
+#   * "no encontrado" si ese sufijo se consultó hace poco y no ha llegado ningún pago que lo tenga;
+#   * "ya canjeado" si el único pago reciente con ese sufijo está CANJEADO.
+# Un pago LIBRE siempre se canjea en la base de datos (UPDATE atómico con FOR UPDATE).
+# Si la escucha se desconecta la caché se vacía y se desactiva: pudo perder avisos.
+# Todas las claves llevan el comercio: un sufijo de un comercio nunca responde por otro.
+SUFIJO_MIN = 4
+
+class CacheReferencias:
+    def __init__(self, maximo=5000, ttl=900.0, ttl_negativo=30.0):
+        self.maximo, self.ttl, self.ttl_negativo = maximo, ttl, ttl_negativo
+        self.activa = False
+        self.generacion = 0  # Sube con cada pago nuevo; evita guardar un "no encontrado" obsoleto
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()  # (comercio, referencia) -> (expira, id, emisor, monto, estado)
+        self._sufijos = {}              # (comercio, sufijo) -> {(comercio, referencia)}
+        self._negativos = OrderedDict() # (comercio, sufijo) -> expira
+        self._stats = {"aciertos": 0, "fallos": 0, "no_encontrado": 0, "canjeado": 0, "desalojos": 0}
+
+    @staticmethod
+    def _sufijos_de(clave):
+        comercio, referencia = clave
+        return [(comercio, referencia[-n:]) for n in range(SUFIJO_MIN, len(referencia) + 1)]
+
+    def _quitar(self, clave):
+        self._entradas.pop(clave, None)
+        for s in self._sufijos_de(clave):
+            refs = self._sufijos.get(s)
+            if refs:
+                refs.discard(clave)
+                if not refs: del self._sufijos[s]
+
+    def _vaciar(self):
+        self._entradas.clear(); self._sufijos.clear(); self._negativos.clear()
+
+    def aplicar_evento(self, evento):
+        op = evento.get("op")
+        with self._lock:
+            if op in ("CONECTADO", "DESCONECTADO"):
+                # También sube la generación: un "no encontrado" leído antes de reconectar pudo perder avisos
+                self._vaciar(); self.activa = op == "CONECTADO"; self.generacion += 1; return
+            if not evento.get("referencia"): return
+            ref = (evento.get("comercio_id", 1), evento["referencia"])
+            if op == "INSERT":
+                self.generacion += 1
+                ahora = time.monotonic()
+                self._entradas[ref] = (ahora + self.ttl, evento["id"], evento.get("emisor"), evento.get("monto"), evento.get("estado"))
+                self._entradas.move_to_end(ref)
+                for s in self._sufijos_de(ref):
+                    self._sufijos.setdefault(s, set()).add(ref)
+                    self._negativos.pop(s, None)
+                # Se desaloja en orden de llegada: lo que queda siempre es lo más reciente
+                while len(self._entradas) > self.maximo or (self._entradas and next(iter(self._entradas.values()))[0] < ahora):
+                    self._quitar(next(iter(self._entradas))); self._stats["desalojos"] += 1
+            elif op == "UPDATE" and ref in self._entradas:
+                expira, id_pago, emisor, monto, _ = self._entradas[ref]
+                self._entradas[ref] = (expira, id_pago, emisor, monto, evento.get("estado"))
+
+    def consultar(self, sufijo, comercio_id=1):
+        # Devuelve (estado, datos) si puede responder solo, o None si hay que ir a la base de datos
+        with self._lock:
+            if not self.activa or len(sufijo) < SUFIJO_MIN:
+                self._stats["fallos"] += 1; return None
+            ahora, clave = time.monotonic(), (comercio_id, sufijo)
+            expira = self._negativos.get(clave)
+            if expira is not None:
+                if expira >= ahora:
+                    self._stats["aciertos"] += 1; self._stats["no_encontrado"] += 1
+                    return "NO_ENCONTRADO", None
+                del self._negativos[clave]
+            refs = self._sufijos.get(clave, ())
+            # Con más de un candidato decide la base de datos (ORDER BY id DESC)
+            if len(refs) == 1:
+                ref = next(iter(refs))
+                expira, _, emisor, monto, estado = self._entradas[ref]
+                if expira >= ahora and estado == "CANJEADO":
+                    self._stats["aciertos"] += 1; self._stats["canjeado"] += 1
+                    return "CANJEADO", (emisor, monto, estado, ref[1])
+            self._stats["fallos"] += 1
+            return None
+
+    def recordar_ausente(self, sufijo, generacion, comercio_id=1):
+        # Solo si no llegó ningún pago entre la consulta a la base de datos y este momento
+        with self._lock:
+            if not self.activa or generacion != self.generacion or len(sufijo) < SUFIJO_MIN: return
+            clave = (comercio_id, sufijo)
+            self._negativos[clave] = time.monotonic() + self.ttl_negativo
+            self._negativos.move_to_end(clave)
+            while len(self._negativos) > self.maximo: self._negativos.popitem(last=False)
+
+    def estadisticas(self):
+        with self._lock:
+            s = dict(self._stats)
+            s.update(activa=self.activa, referencias=len(self._entradas), negativos=len(self._negativos))
+        consultas = s["aciertos"] + s["fallos"]
+        s["tasa_aciertos"] = round(s["aciertos"] / consultas, 4) if consultas else 0.0
+        return s
+
+CACHE = CacheReferencias(
+    maximo=int(os.getenv("CACHE_REFS_MAX", "5000")),
+    ttl=float(os.getenv("CACHE_REFS_TTL", "900")),
+    ttl_negativo=float(os.getenv("CACHE_REFS_TTL_NEGATIVO", "30")),
+)
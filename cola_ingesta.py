@@ -0,0 +1,174 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+from pool_db import conexion_db, PoolAgotado
+from ingesta import extraer_lote, guardar_pagos, ZONA_NEGOCIO
+from comercios import comercio_de_hash
+from particiones import asegurar
+from huellas import purgar
+
+# --- COLA LOCAL DE INGESTA (SQLite en modo WAL) ---
+# /webhook-bdv solo anota el mensaje crudo aquí y responde; un worker lo pasa a Postgres
+# por lotes, reintentando con espera exponencial si la base de datos no responde. Si el lote falla por
+# otra cosa (un mensaje con un NUL, un error del extractor), se reintenta mensaje por mensaje; el que
+# falle COLA_FALLOS_MAX veces queda apartado como fallido y se informa en /admin/estadisticas y /metrics.
+COLA_ARCHIVO = os.getenv("COLA_ARCHIVO", "cola_ingesta.db")
+COLA_LOTE = int(os.getenv("COLA_LOTE", "200"))
+COLA_INTERVALO = float(os.getenv("COLA_INTERVALO", "1"))
+COLA_ESPERA_MAX = float(os.getenv("COLA_ESPERA_MAX", "300"))
+COLA_FALLOS_MAX = int(os.getenv("COLA_FALLOS_MAX", "5"))
+COLA_RESERVA = 120  # Segundos que un lote queda reservado para el worker que lo tomó
+MANTENIMIENTO_INTERVALO = 3600  # Cada cuánto el worker crea las particiones próximas y purga las huellas viejas
+
+_local = threading.local()
+_despertar = threading.Event()
+_worker = {"pid": None, "hilo": None}
+
+def _conexion():
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "pid", None) != os.getpid():
+        conn = sqlite3.connect(COLA_ARCHIVO, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")  # Un pago aceptado no se pierde aunque se caiga el equipo
+        conn.execute("""CREATE TABLE IF NOT EXISTS cola (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, mensaje TEXT NOT NULL, recibido TEXT NOT NULL,
+            intentos INTEGER NOT NULL DEFAULT 0, proximo REAL NOT NULL DEFAULT 0, error TEXT,
+            token TEXT NOT NULL DEFAULT '', fallos INTEGER NOT NULL DEFAULT 0)""")
+        columnas = {c[1] for c in conn.execute("PRAGMA table_info(cola)")}
+        # Colas creadas antes de los comercios: sus mensajes quedan en el comercio principal
+        if "token" not in columnas: conn.execute("ALTER TABLE cola ADD COLUMN token TEXT NOT NULL DEFAULT ''")
+        # fallos: errores del propio mensaje (no caídas de Postgres); con COLA_FALLOS_MAX queda apartado
+        if "fallos" not in columnas: conn.execute("ALTER TABLE cola ADD COLUMN fallos INTEGER NOT NULL DEFAULT 0")
+        _local.conn, _local.pid = conn, os.getpid()
+    return conn
+
+def encolar(mensajes, token_hash=""):
+    # token_hash identifica al comercio (ver comercios.py); se resuelve al drenar
+    recibido = datetime.now(ZONA_NEGOCIO).isoformat()
+    conn = _conexion()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany("INSERT INTO cola (mensaje, recibido, token) VALUES (?, ?, ?)", [(m, recibido, token_hash) for m in mensajes])
+    _despertar.set()
+
+def pendientes():
+    return _conexion().execute("SELECT COUNT(*) FROM cola WHERE fallos < ?", (COLA_FALLOS_MAX,)).fetchone()[0]
+
+def fallidos():
+    return _conexion().execute("SELECT COUNT(*) FROM cola WHERE fallos >= ?", (COLA_FALLOS_MAX,)).fetchone()[0]
+
+def reintentar_fallidos():
+    # Tras corregir la causa (extractor, huellas...): los fallidos vuelven a la cola
+    with _conexion() as conn:
+        return conn.execute("UPDATE cola SET fallos = 0, intentos = 0, proximo = 0 WHERE fallos >= ?", (COLA_FALLOS_MAX,)).rowcount
+
+def _reservar(tamano):
+    # Toma y reserva un lote en una transacción exclusiva para que dos workers no procesen lo mismo
+    conn, ahora = _conexion(), time.time()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        filas = conn.execute("SELECT id, mensaje, recibido, intentos, token, fallos FROM cola WHERE proximo <= ? AND fallos < ? ORDER BY id LIMIT ?",
+                             (ahora, COLA_FALLOS_MAX, tamano)).fetchall()
+        if filas:
+            conn.executemany("UPDATE cola SET proximo = ? WHERE id = ?", [(ahora + COLA_RESERVA, f[0]) for f in filas])
+    return filas
+
+def _guardar(filas):
+    # Un INSERT por comercio presente en el lote, todos en la misma transacción
+    grupos = {}
+    for f in filas: grupos.setdefault(f[4], []).append(f)
+    por_comercio = []
+    for token_hash, grupo in grupos.items():
+        comercio_id = comercio_de_hash(token_hash)
+        if comercio_id is None:
+            print(f"⚠️ Cola de ingesta: {len(grupo)} mensaje(s) con un token que ya no es válido, descartados"); continue
+        lista_pagos, _ = extraer_lote([f[1] for f in grupo], [datetime.fromisoformat(f[2]) for f in grupo])
+        if lista_pagos: por_comercio.append((comercio_id, lista_pagos))
+    if por_comercio:
+        with conexion_db() as conn:
+            for comercio_id, lista_pagos in por_comercio: guardar_pagos(conn, lista_pagos, comercio_id)
+            conn.commit()
+
+def _es_caida(e):
+    # Postgres no responde: el mensaje no tiene la culpa
+    return isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError, PoolAgotado))
+
+def _aplazar(filas, e, culpa):
+    # Reintento con espera exponencial: 2, 4, 8 ... hasta COLA_ESPERA_MAX segundos. Solo un error del
+    # mensaje (culpa) suma a fallos: una caída larga de Postgres no aparta mensajes buenos.
+    ahora = time.time()
+    with _conexion() as conn:
+        conn.executemany("UPDATE cola SET intentos = intentos + 1, fallos = fallos + ?, error = ?, proximo = ? WHERE id = ?",
+                         [(int(culpa), str(e)[:500], ahora + min(COLA_ESPERA_MAX, 2 ** (f[3] + 1)), f[0]) for f in filas])
+
+def _borrar(filas):
+    with _conexion() as conn:
+        conn.executemany("DELETE FROM cola WHERE id = ?", [(f[0],) for f in filas])
+
+def procesar_lote(tamano=COLA_LOTE):
+    filas = _reservar(tamano)
+    if not filas: return 0
+    try: _guardar(filas)
+    except Exception as e:
+        if _es_caida(e) or len(filas) == 1:
+            _aplazar(filas, e, not _es_caida(e)); raise
+        # Un mensaje que no entra no puede frenar a los demás del lote: uno por uno
+        print(f"⚠️ Cola de ingesta: el lote de {len(filas)} falló ({e}); se reintenta mensaje por mensaje")
+        for n, f in enumerate(filas):
+            try: _guardar([f])
+            except Exception as e:
+                if _es_caida(e): _aplazar(filas[n:], e, False); raise
+                _aplazar([f], e, True)
+                apartado = " y queda apartado como fallido" if f[5] + 1 >= COLA_FALLOS_MAX else ""
+                print(f"⚠️ Cola de ingesta: el mensaje {f[0]} falló{apartado}: {e}")
+            else: _borrar([f])
+        return len(filas)
+    _borrar(filas)
+    return len(filas)
+
+def mantenimiento():
+    # Sin partición para el mes de recibido_en el INSERT falla: el worker no depende solo del cron.
+    # Cada tarea por separado: que falle una (sin permiso de DDL, un lock) no impide la otra.
+    for tarea in (asegurar, purgar):
+        try:
+            with conexion_db() as conn: tarea(conn)
+        except Exception as e: print(f"⚠️ Mantenimiento ({tarea.__name__}): {e}")
+
+def drenar(detener=None):
+    detener, revisadas = detener or threading.Event(), 0
+    while not detener.is_set():
+        # El intento cuenta aunque falle: el mantenimiento no puede dejar la cola sin drenar
+        if time.monotonic() - revisadas >= MANTENIMIENTO_INTERVALO:
+            revisadas = time.monotonic(); mantenimiento()
+        try:
+            while procesar_lote(): pass
+        except Exception as e:
+            print(f"⚠️ Cola de ingesta: {e}")
+        _despertar.wait(COLA_INTERVALO); _despertar.clear()
+
+def asegurar_worker():
+    # Un hilo de drenado por proceso (cada worker de gunicorn tiene el suyo)
+    if _worker["pid"] == os.getpid() and _worker["hilo"].is_alive(): return
+    hilo = threading.Thread(target=drenar, name="cola-ingesta", daemon=True)
+    hilo.start()
+    _worker.update(pid=os.getpid(), hilo=hilo)
+
+if __name__ == "__main__":
+    # Worker como proceso aparte: python cola_ingesta.py (con COLA_WORKER=externo en la app web)
+    # python cola_ingesta.py --reintentar-fallidos  -> devuelve a la cola los mensajes apartados
+    import argparse
+    parser = argparse.ArgumentParser(description="Worker de la cola local de ingesta")
+    parser.add_argument("--reintentar-fallidos", action="store_true", help="Devuelve a la cola los mensajes apartados y sale")
+    if parser.parse_args().reintentar_fallidos:
+        print(f"✅ {reintentar_fallidos()} mensaje(s) de vuelta en la cola"); raise SystemExit
+    print(f"🚀 Drenando {COLA_ARCHIVO} hacia Postgres ({pendientes()} pendientes, {fallidos()} fallidos)...")
+    try: drenar()
+    except KeyboardInterrupt: print("👋 Worker detenido")
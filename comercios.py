@@ -0,0 +1,140 @@
+import argparse
+import hashlib
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import psycopg2
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from ingesta import ZONA_NEGOCIO
+from particiones import MESES_ADELANTE, crear_mes, sumar_meses
+from pool_db import conexion_db
+
+# --- COMERCIOS (varios negocios en una misma instalación) ---
+# Cada comercio tiene su partición de pagos (pagos_c<id>, a su vez particionada por mes), un token para el webhook de sus teléfonos
+# y una clave de admin. El comercio 1 es el original: webhooks sin token y ADMIN_PASSWORD.
+# Del token solo se guarda el SHA-256; la cola local también anota el hash, nunca el token.
+COMERCIO_PRINCIPAL = 1
+CACHE_TTL = 60         # Segundos que se recuerda token -> comercio (también lo que tarda en caer un token rotado)
+CACHE_TTL_AUSENTE = 5  # Un token o slug desconocido se recuerda poco: que tokens al azar no llenen la caché
+CACHE_MAX = 1000       # Entradas; se descartan las menos usadas
+
+_cache, _lock = OrderedDict(), threading.Lock()  # clave -> (valor, expira)
+_SIN_DATO = object()
+
+def hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest() if token else ""
+
+def _leer(clave):
+    with _lock:
+        entrada = _cache.get(clave)
+        if entrada is None: return _SIN_DATO
+        if entrada[1] <= time.monotonic(): del _cache[clave]; return _SIN_DATO
+        _cache.move_to_end(clave)
+        return entrada[0]
+
+def _guardar(clave, valor):
+    with _lock:
+        _cache[clave] = (valor, time.monotonic() + (CACHE_TTL if valor is not None else CACHE_TTL_AUSENTE))
+        _cache.move_to_end(clave)
+        while len(_cache) > CACHE_MAX: _cache.popitem(last=False)
+    return valor
+
+def _recordado(clave, buscar):
+    valor = _leer(clave)
+    return _guardar(clave, buscar()) if valor is _SIN_DATO else valor
+
+def _consultar(sql, parametros):
+    with conexion_db() as conn:
+        cursor = conn.cursor(); cursor.execute(sql, parametros)
+        return cursor.fetchone()
+
+def comercio_de_hash(token_hash):
+    # "" (sin token) es el comercio principal; un hash desconocido o de un comercio inactivo da None.
+    # Si Postgres no responde se propaga psycopg2.Error para que quien llama decida.
+    if not token_hash: return COMERCIO_PRINCIPAL
+    def buscar():
+        fila = _consultar("SELECT id FROM comercios WHERE token_hash = %s AND activo", (token_hash,))
+        return fila[0] if fila else None
+    return _recordado(("token", token_hash), buscar)
+
+def token_rechazado(token_hash):
+    # Solo mira la caché, nunca Postgres (el webhook no espera a la base): True si ese hash se buscó hace
+    # poco y no es de ningún comercio activo. Uno que nunca se buscó pasa y lo resuelve la cola al drenar.
+    return bool(token_hash) and _leer(("token", token_hash)) is None
+
+async def comercio_de_hash_async(pg, token_hash):
+    # comercio_de_hash para asgi.py: `pg` es un pool o una conexión de asyncpg; comparte la misma caché
+    if not token_hash: return COMERCIO_PRINCIPAL
+    clave = ("token", token_hash)
+    valor = _leer(clave)
+    if valor is not _SIN_DATO: return valor
+    return _guardar(clave, await pg.fetchval("SELECT id FROM comercios WHERE token_hash = $1 AND activo", token_hash))
+
+def comercio_de_slug(slug):
+    # (id, nombre) del comercio activo con ese slug, o None
+    return _recordado(("slug", slug), lambda: _consultar("SELECT id, nombre FROM comercios WHERE slug = %s AND activo", (slug,)))
+
+def validar_clave(comercio_id, clave):
+    fila = _consultar("SELECT clave_hash FROM comercios WHERE id = %s AND activo", (comercio_id,))
+    return bool(fila and fila[0] and clave and check_password_hash(fila[0], clave))
+
+def crear_comercio(conn, nombre, slug, clave):
+    # Alta del comercio y de su partición; devuelve (id, token). El token solo se muestra esta vez.
+    if not re.fullmatch(r"[a-z0-9-]{2,40}", slug): raise ValueError("El slug solo admite a-z, 0-9 y guiones")
+    token = secrets.token_urlsafe(24)
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO comercios (nombre, slug, token_hash, clave_hash) VALUES (%s, %s, %s, %s) RETURNING id",
+                   (nombre, slug, hash_token(token), generate_password_hash(clave)))
+    comercio_id = cursor.fetchone()[0]
+    cursor.execute(f"CREATE TABLE pagos_c{comercio_id} PARTITION OF pagos FOR VALUES IN ({comercio_id}) PARTITION BY RANGE (recibido_en)")
+    hoy = datetime.now(ZONA_NEGOCIO).date().replace(day=1)
+    for n in range(MESES_ADELANTE + 1): crear_mes(cursor, comercio_id, sumar_meses(hoy, n))
+    conn.commit()
+    return comercio_id, token
+
+def rotar_token(conn, slug):
+    token = secrets.token_urlsafe(24)
+    cursor = conn.cursor()
+    cursor.execute("UPDATE comercios SET token_hash = %s WHERE slug = %s RETURNING id", (hash_token(token), slug))
+    if not cursor.fetchone(): conn.rollback(); raise ValueError(f"No existe el comercio {slug}")
+    conn.commit()
+    return token
+
+def cambiar_clave(conn, slug, clave):
+    cursor = conn.cursor()
+    cursor.execute("UPDATE comercios SET clave_hash = %s WHERE slug = %s", (generate_password_hash(clave), slug))
+    if cursor.rowcount == 0: conn.rollback(); raise ValueError(f"No existe el comercio {slug}")
+    conn.commit()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Alta y mantenimiento de comercios")
+    sub = parser.add_subparsers(dest="orden", required=True)
+    p = sub.add_parser("crear", help="Crea el comercio, su partición de pagos y su token de webhook")
+    p.add_argument("nombre"); p.add_argument("slug"); p.add_argument("clave", help="Clave del panel admin del comercio")
+    sub.add_parser("listar", help="Lista los comercios y cuántos pagos tiene cada uno")
+    p = sub.add_parser("token", help=f"Genera un token nuevo (el anterior deja de funcionar en {CACHE_TTL} s)"); p.add_argument("slug")
+    p = sub.add_parser("clave", help="Cambia la clave del panel admin"); p.add_argument("slug"); p.add_argument("clave")
+    args = parser.parse_args()
+    try:
+        with conexion_db() as conn:
+            if args.orden == "crear":
+                comercio_id, token = crear_comercio(conn, args.nombre, args.slug, args.clave)
+                print(f"✅ Comercio {comercio_id} creado (partición pagos_c{comercio_id})")
+                print(f"🔑 Token del webhook: {token}  -> /webhook-bdv?token={token} o cabecera X-Token")
+                print(f"🌐 Portal del cajero: /c/{args.slug}")
+            elif args.orden == "listar":
+                cursor = conn.cursor()
+                cursor.execute("""SELECT c.id, c.slug, c.nombre, c.activo, count(p.id) FROM comercios c
+                                  LEFT JOIN pagos p ON p.comercio_id = c.id GROUP BY c.id ORDER BY c.id""")
+                for fila in cursor.fetchall(): print("{:>4} | {:<20} | {:<30} | {} | {:,} pagos".format(*fila))
+            elif args.orden == "token":
+                print(f"🔑 Token nuevo de {args.slug}: {rotar_token(conn, args.slug)}")
+            else:
+                cambiar_clave(conn, args.slug, args.clave); print(f"✅ Clave de {args.slug} actualizada")
+    except (ValueError, psycopg2.Error) as e:
+        print(f"❌ {e}")
@@ -0,0 +1,232 @@
+import sys
+
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+from pool_db import parametros_conexion
+from ingesta import ZONA_NEGOCIO
+
+# --- MIGRACIONES DEL ESQUEMA ---
+# Cada migración se aplica una sola vez y queda anotada en `esquema_migraciones`.
+# Las marcadas como concurrentes (CREATE INDEX CONCURRENTLY) corren fuera de transacción
+# para no bloquear las escrituras de una tabla que ya está en producción.
+MIGRACIONES = [
+    ("001_tabla_pagos", False, """
+        CREATE TABLE IF NOT EXISTS pagos (
+            id SERIAL PRIMARY KEY,
+            fecha_recepcion TEXT,
+            hora_recepcion TEXT,
+            emisor TEXT,
+            monto TEXT,
+            referencia TEXT UNIQUE,
+            mensaje_completo TEXT,
+            estado TEXT DEFAULT 'LIBRE',
+            fecha_canje TEXT,
+            banco TEXT
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS pagos_referencia_key ON pagos (referencia);
+    """),
+    # Búsqueda por últimos dígitos: reverse(referencia) LIKE '4321%' sí usa un B-tree
+    ("002_indice_sufijo_referencia", True, """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_pagos_referencia_reversa
+            ON pagos (reverse(referencia) text_pattern_ops);
+    """),
+    # Monto, moneda y fecha de recepción tipados. Sin DEFAULT volátil en el ADD COLUMN para no
+    # reescribir la tabla; las filas existentes se completan con `python backfill.py`.
+    ("003_columnas_tipadas", False, """
+        ALTER TABLE pagos ADD COLUMN IF NOT EXISTS monto_num NUMERIC,
+                          ADD COLUMN IF NOT EXISTS moneda TEXT,
+                          ADD COLUMN IF NOT EXISTS recibido_en TIMESTAMPTZ;
+        ALTER TABLE pagos ALTER COLUMN recibido_en SET DEFAULT now();
+    """),
+    ("004_indice_recibido_en", True, """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_pagos_recibido_en ON pagos (recibido_en);
+    """),
+    # Marca de última modificación para los respaldos incrementales de backup.py
+    ("005_actualizado_en", False, """
+        ALTER TABLE pagos ADD COLUMN IF NOT EXISTS actualizado_en TIMESTAMPTZ;
+        ALTER TABLE pagos ALTER COLUMN actualizado_en SET DEFAULT now();
+        CREATE OR REPLACE FUNCTION pagos_marcar_actualizado() RETURNS trigger AS $$
+        BEGIN NEW.actualizado_en := now(); RETURN NEW; END $$ LANGUAGE plpgsql;
+        DROP TRIGGER IF EXISTS pagos_actualizado_en ON pagos;
+        CREATE TRIGGER pagos_actualizado_en BEFORE UPDATE ON pagos FOR EACH ROW EXECUTE FUNCTION pagos_marcar_actualizado();
+    """),
+    ("006_indice_actualizado_en", True, """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_pagos_actualizado_en ON pagos (actualizado_en);
+    """),
+    # Aviso por NOTIFY de cada pago nuevo o cambio de estado (caché de referencias de cada worker)
+    ("007_notificar_cambios", False, """
+        CREATE OR REPLACE FUNCTION pagos_notificar() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('pagos_cambios', json_build_object(
+                'op', TG_OP, 'id', NEW.id, 'referencia', NEW.referencia, 'estado', NEW.estado, 'banco', NEW.banco,
+                'emisor', NEW.emisor, 'monto', NEW.monto, 'moneda', NEW.moneda,
+                'fecha_recepcion', NEW.fecha_recepcion, 'hora_recepcion', NEW.hora_recepcion)::text);
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql;
+        DROP TRIGGER IF EXISTS pagos_notificar_insert ON pagos;
+        CREATE TRIGGER pagos_notificar_insert AFTER INSERT ON pagos FOR EACH ROW EXECUTE FUNCTION pagos_notificar();
+        DROP TRIGGER IF EXISTS pagos_notificar_estado ON pagos;
+        CREATE TRIGGER pagos_notificar_estado AFTER UPDATE OF estado ON pagos FOR EACH ROW
+            WHEN (OLD.estado IS DISTINCT FROM NEW.estado) EXECUTE FUNCTION pagos_notificar();
+    """),
+    # Varios comercios en una misma instalación: cada uno con su token de webhook y su clave de admin.
+    # El comercio 1 (principal) es el de siempre: webhooks sin token y ADMIN_PASSWORD.
+    ("008_comercios", False, """
+        CREATE TABLE IF NOT EXISTS comercios (
+            id SERIAL PRIMARY KEY,
+            nombre TEXT NOT NULL,
+            slug TEXT NOT NULL UNIQUE,
+            token_hash TEXT UNIQUE,
+            clave_hash TEXT,
+            activo BOOLEAN NOT NULL DEFAULT TRUE,
+            creado_en TIMESTAMPTZ DEFAULT now()
+        );
+        INSERT INTO comercios (id, nombre, slug) VALUES (1, 'Principal', 'principal') ON CONFLICT DO NOTHING;
+        SELECT setval(pg_get_serial_sequence('comercios', 'id'), (SELECT max(id) FROM comercios));
+    """),
+    # pagos pasa a estar particionada por comercio (LIST). La tabla actual no se copia: se renombra a
+    # pagos_c1 y se adjunta como partición del comercio 1; el CHECK evita revalidar sus filas. Solo se
+    # reconstruyen la clave primaria y el índice único, que ahora incluyen comercio_id.
+    ("009_particion_por_comercio", False, """
+        ALTER TABLE pagos RENAME TO pagos_c1;
+        ALTER TABLE pagos_c1 ADD COLUMN comercio_id INTEGER NOT NULL DEFAULT 1;
+        ALTER TABLE pagos_c1 ADD CONSTRAINT pagos_c1_comercio CHECK (comercio_id = 1);
+        DROP TRIGGER IF EXISTS pagos_actualizado_en ON pagos_c1;
+        DROP TRIGGER IF EXISTS pagos_notificar_insert ON pagos_c1;
+        DROP TRIGGER IF EXISTS pagos_notificar_estado ON pagos_c1;
+        ALTER TABLE pagos_c1 DROP CONSTRAINT IF EXISTS pagos_pkey;
+        ALTER TABLE pagos_c1 DROP CONSTRAINT IF EXISTS pagos_referencia_key;
+        DROP INDEX IF EXISTS pagos_referencia_key;
+        ALTER INDEX IF EXISTS idx_pagos_referencia_reversa RENAME TO pagos_c1_referencia_reversa;
+        ALTER INDEX IF EXISTS idx_pagos_recibido_en RENAME TO pagos_c1_recibido_en;
+        ALTER INDEX IF EXISTS idx_pagos_actualizado_en RENAME TO pagos_c1_actualizado_en;
+
+        CREATE TABLE pagos (LIKE pagos_c1 INCLUDING DEFAULTS) PARTITION BY LIST (comercio_id);
+        ALTER SEQUENCE pagos_id_seq OWNED BY pagos.id;
+        ALTER TABLE pagos ATTACH PARTITION pagos_c1 FOR VALUES IN (1);
+        ALTER TABLE pagos_c1 DROP CONSTRAINT pagos_c1_comercio;
+        ALTER TABLE pagos ADD PRIMARY KEY (comercio_id, id);
+        ALTER TABLE pagos ADD CONSTRAINT pagos_comercio_referencia_key UNIQUE (comercio_id, referencia);
+        ALTER TABLE pagos ADD CONSTRAINT pagos_comercio_fk FOREIGN KEY (comercio_id) REFERENCES comercios (id);
+
+        -- Índices del padre con ON ONLY + ATTACH: se reutilizan los de pagos_c1 en vez de reconstruirlos
+        CREATE INDEX idx_pagos_referencia_reversa ON ONLY pagos (reverse(referencia) text_pattern_ops);
+        ALTER INDEX idx_pagos_referencia_reversa ATTACH PARTITION pagos_c1_referencia_reversa;
+        CREATE INDEX idx_pagos_recibido_en ON ONLY pagos (recibido_en);
+        ALTER INDEX idx_pagos_recibido_en ATTACH PARTITION pagos_c1_recibido_en;
+        CREATE INDEX idx_pagos_actualizado_en ON ONLY pagos (actualizado_en);
+        ALTER INDEX idx_pagos_actualizado_en ATTACH PARTITION pagos_c1_actualizado_en;
+
+        CREATE OR REPLACE FUNCTION pagos_notificar() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('pagos_cambios', json_build_object(
+                'op', TG_OP, 'id', NEW.id, 'comercio_id', NEW.comercio_id, 'referencia', NEW.referencia, 'estado', NEW.estado,
+                'banco', NEW.banco, 'emisor', NEW.emisor, 'monto', NEW.monto, 'moneda', NEW.moneda,
+                'fecha_recepcion', NEW.fecha_recepcion, 'hora_recepcion', NEW.hora_recepcion)::text);
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql;
+        CREATE TRIGGER pagos_actualizado_en BEFORE UPDATE ON pagos FOR EACH ROW EXECUTE FUNCTION pagos_marcar_actualizado();
+        CREATE TRIGGER pagos_notificar_insert AFTER INSERT ON pagos FOR EACH ROW EXECUTE FUNCTION pagos_notificar();
+        CREATE TRIGGER pagos_notificar_estado AFTER UPDATE OF estado ON pagos FOR EACH ROW
+            WHEN (OLD.estado IS DISTINCT FROM NEW.estado) EXECUTE FUNCTION pagos_notificar();
+    """),
+    # Particiones mensuales por recibido_en dentro de cada comercio (ver particiones.py). Lo existente no
+    # se copia: cada pagos_c<id> se adjunta entera como pagos_c<id>_historico (hasta el mes que viene).
+    # Una clave única de pagos tendría que incluir recibido_en, así que la unicidad de la referencia por
+    # comercio pasa a la tabla pagos_referencias. Las filas que backfill.py no llegó a convertir toman
+    # recibido_en de fecha_recepcion/hora_recepcion como backfill.convertir_fecha; actualizado_en (o
+    # la hora de la migración) solo si no se pueden leer.
+    ("010_particion_mensual", False, """
+        CREATE FUNCTION pg_temp.convertir_fecha(fecha TEXT, hora TEXT) RETURNS TIMESTAMPTZ AS $$
+        BEGIN
+            IF hora IS NOT NULL THEN
+                BEGIN
+                    RETURN to_timestamp(trim(fecha) || ' ' || upper(trim(hora)), 'FXDD/MM/YYYY HH12:MI AM')::timestamp AT TIME ZONE '{zona}';
+                EXCEPTION WHEN others THEN NULL;
+                END;
+            END IF;
+            BEGIN
+                RETURN to_timestamp(trim(fecha), 'FXDD/MM/YYYY')::timestamp AT TIME ZONE '{zona}';
+            EXCEPTION WHEN others THEN RETURN NULL;
+            END;
+        END $$ LANGUAGE plpgsql;
+        UPDATE pagos SET recibido_en = COALESCE(pg_temp.convertir_fecha(fecha_recepcion, hora_recepcion), actualizado_en, now())
+        WHERE recibido_en IS NULL;
+        ALTER TABLE pagos ALTER COLUMN recibido_en SET NOT NULL;
+
+        CREATE TABLE pagos_referencias (
+            comercio_id INTEGER NOT NULL REFERENCES comercios (id),
+            referencia TEXT NOT NULL,
+            recibido_en TIMESTAMPTZ NOT NULL,
+            PRIMARY KEY (comercio_id, referencia)
+        );
+        INSERT INTO pagos_referencias SELECT comercio_id, referencia, recibido_en FROM pagos WHERE referencia IS NOT NULL;
+        ALTER TABLE pagos DROP CONSTRAINT pagos_comercio_referencia_key;
+        ALTER TABLE pagos DROP CONSTRAINT pagos_pkey;
+
+        DO $$
+        DECLARE c RECORD; hasta TIMESTAMPTZ;
+        BEGIN
+            FOR c IN SELECT id FROM comercios WHERE to_regclass('pagos_c' || id) IS NOT NULL ORDER BY id LOOP
+                EXECUTE format('SELECT (GREATEST(date_trunc(''month'', now() AT TIME ZONE %1$L),
+                                                 date_trunc(''month'', max(recibido_en) AT TIME ZONE %1$L)) + interval ''1 month'') AT TIME ZONE %1$L
+                                FROM pagos_c%2$s', '{zona}', c.id) INTO hasta;
+                EXECUTE format('ALTER TABLE pagos DETACH PARTITION pagos_c%s', c.id);
+                EXECUTE format('ALTER TABLE pagos_c%1$s RENAME TO pagos_c%1$s_historico', c.id);
+                EXECUTE format('CREATE TABLE pagos_c%1$s PARTITION OF pagos FOR VALUES IN (%1$s) PARTITION BY RANGE (recibido_en)', c.id);
+                EXECUTE format('ALTER TABLE pagos_c%1$s ATTACH PARTITION pagos_c%1$s_historico FOR VALUES FROM (MINVALUE) TO (%2$L)', c.id, hasta);
+            END LOOP;
+        END $$;
+
+        ALTER TABLE pagos ADD PRIMARY KEY (comercio_id, id, recibido_en);
+        CREATE INDEX idx_pagos_referencia ON pagos (comercio_id, referencia);
+    """.replace("{zona}", ZONA_NEGOCIO.key)),
+    # Índice de huellas (huellas.py): claves por banco/monto/sufijo y banco/monto/emisor/ventana, y la
+    # alerta que deja en el pago. El índice parcial sirve al filtro "solo alertas" de /admin.
+    ("011_huellas", False, """
+        ALTER TABLE pagos ADD COLUMN alerta TEXT;
+        CREATE TABLE pagos_huellas (
+            comercio_id INTEGER NOT NULL REFERENCES comercios (id),
+            clave TEXT NOT NULL,
+            referencia TEXT NOT NULL,
+            recibido_en TIMESTAMPTZ NOT NULL,
+            PRIMARY KEY (comercio_id, clave, referencia)
+        );
+        CREATE INDEX idx_pagos_huellas_recibido ON pagos_huellas (recibido_en);
+        CREATE INDEX idx_pagos_alerta ON pagos (comercio_id, id) WHERE alerta IS NOT NULL;
+    """),
+]
+
+def migrar(conn, salida=print):
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE IF NOT EXISTS esquema_migraciones (nombre TEXT PRIMARY KEY, aplicada TIMESTAMPTZ DEFAULT now())")
+    cursor.execute("SELECT nombre FROM esquema_migraciones")
+    aplicadas = {f[0] for f in cursor.fetchall()}
+    for nombre, concurrente, sql in MIGRACIONES:
+        if nombre in aplicadas: continue
+        salida(f"⏳ Aplicando {nombre}...")
+        if concurrente:
+            for sentencia in filter(str.strip, sql.split(";")): cursor.execute(sentencia)
+            cursor.execute("INSERT INTO esquema_migraciones (nombre) VALUES (%s)", (nombre,))
+        else:
+            conn.autocommit = False
+            cursor.execute(sql)
+            cursor.execute("INSERT INTO esquema_migraciones (nombre) VALUES (%s)", (nombre,))
+            conn.commit(); conn.autocommit = True
+    salida("✅ Esquema al día")
+
+if __name__ == "__main__":
+    # python esquema.py  -> aplica las migraciones pendientes
+    conn = psycopg2.connect(**parametros_conexion())
+    try:
+        migrar(conn)
+        # Particiones del mes actual y los próximos (también: python particiones.py mantener)
+        from particiones import asegurar
+        asegurar(conn)
+    except psycopg2.Error as e:
+        print(f"❌ Error migrando: {e}"); sys.exit(1)
+    finally: conn.close()
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import os
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs, urlsplit
+
+import psycopg2
+from dotenv import load_dotenv
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+
+load_dotenv(override=True)
+
+from notificaciones import CANAL, parametros_escucha
+
+# --- SERVIDOR DE EVENTOS EN TIEMPO REAL (Server-Sent Events) ---
+# Proceso aparte con asyncio: cada página abierta es solo una corrutina en espera, no un hilo de
+# gunicorn. Una única conexión LISTEN reparte los avisos del trigger pagos_notificar a todos.
+#   GET /eventos        -> portal del cajero: banco, monto y estado (nada de la referencia, que es lo
+#                          que canjea /verificar)
+#   GET /eventos/admin  -> panel: la fila completa; exige la sesión del admin
+# Cada cliente solo recibe los pagos del comercio de su sesión firmada (/c/<slug> o login); nunca de
+# un parámetro de la URL.
+# Uso: python eventos.py  (EVENTOS_PUERTO, por defecto 5001)
+EVENTOS_PUERTO = int(os.getenv("EVENTOS_PUERTO", "5001"))
+ORIGENES = {o.strip() for o in os.getenv("EVENTOS_ORIGENES", "").split(",") if o.strip()}
+LATIDO = 15         # Segundos entre comentarios ": latido" para que los proxies no corten la conexión
+COLA_CLIENTE = 100  # Eventos pendientes por cliente antes de darlo por lento y cerrarlo
+CANAL_EVENTOS = os.getenv("EVENTOS_CANAL", CANAL)  # bench/bench_eventos.py usa uno propio
+
+# Valida la cookie de sesión de Flask con la misma SECRET_KEY que main.py
+_app_sesion = Flask("eventos")
+_app_sesion.secret_key = os.getenv("SECRET_KEY", "clave_sistemas_mv_2026")
+_serializador = SecureCookieSessionInterface().get_signing_serializer(_app_sesion)
+
+def comercio_sesion(cabeceras, admin):
+    # Comercio de la sesión de Flask (el principal si no eligió ninguno, como main.comercio_actual).
+    # Para admin, None si no hay sesión iniciada.
+    cookie = SimpleCookie(cabeceras.get("cookie", "")).get(_app_sesion.config["SESSION_COOKIE_NAME"])
+    sesion = {}
+    if cookie:
+        try: sesion = _serializador.loads(cookie.value)
+        except Exception: sesion = {}
+    if admin and not sesion.get("logged_in"): return None
+    return sesion.get("comercio_id", 1)
+
+def evento_publico(evento):
+    return {"op": evento.get("op"), "banco": evento.get("banco"), "monto": evento.get("monto"),
+            "moneda": evento.get("moneda"), "estado": evento.get("estado")}
+
+class Difusor:
+    def __init__(self):
+        self.clientes = {}  # cola -> (es_admin, comercio_id)
+        self.entregados = 0
+
+    def suscribir(self, admin, comercio_id):
+        cola = asyncio.Queue(COLA_CLIENTE); self.clientes[cola] = (admin, comercio_id)
+        return cola
+
+    def desuscribir(self, cola):
+        self.clientes.pop(cola, None)
+
+    def publicar(self, evento):
+        completo = json.dumps(evento, ensure_ascii=False)
+        publico = json.dumps(evento_publico(evento), ensure_ascii=False)
+        comercio_id = evento.get("comercio_id", 1)
+        for cola, (admin, comercio) in list(self.clientes.items()):
+            if comercio != comercio_id: continue
+            try: cola.put_nowait(completo if admin else publico); self.entregados += 1
+            except asyncio.QueueFull:
+                # Cliente demasiado lento: se le cierra la conexión y el navegador reconecta solo
+                self.desuscribir(cola); cola.get_nowait(); cola.put_nowait(None)
+
+DIFUSOR = Difusor()
+
+async def escuchar_postgres():
+    # LISTEN sobre el mismo bucle de asyncio: el socket de psycopg2 se vigila con add_reader
+    loop, espera = asyncio.get_running_loop(), 1
+    while True:
+        conn, cerrada = None, asyncio.Event()
+        try:
+            conn = await loop.run_in_executor(None, lambda: psycopg2.connect(**parametros_escucha()))
+            conn.autocommit = True
+            conn.cursor().execute(f"LISTEN {CANAL_EVENTOS}")
+            espera = 1
+            def leer():
+                try: conn.poll()
+                except psycopg2.Error: cerrada.set(); return
+                while conn.notifies:
+                    try: DIFUSOR.publicar(json.loads(conn.notifies.pop(0).payload))
+                    except ValueError: continue
+            loop.add_reader(conn.fileno(), leer)
+            print(f"👂 Escuchando {CANAL_EVENTOS}")
+            while not cerrada.is_set():
+                try: await asyncio.wait_for(cerrada.wait(), 30)
+                except asyncio.TimeoutError: conn.cursor().execute("SELECT 1")
+        except Exception as e:
+            print(f"⚠️ LISTEN desconectado: {e}")
+        finally:
+            if conn is not None:
+                try: loop.remove_reader(conn.fileno())
+                except (ValueError, psycopg2.Error): pass
+                conn.close()
+        await asyncio.sleep(espera); espera = min(espera * 2, 60)
+
+async def leer_peticion(reader):
+    linea = (await reader.readline()).decode("latin-1").split()
+    cabeceras = {}
+    while True:
+        h = await reader.readline()
+        if h in (b"\r\n", b"\n", b""): break
+        nombre, _, valor = h.decode("latin-1").partition(":")
+        cabeceras[nombre.strip().lower()] = valor.strip()
+    if len(linea) < 2: return (None, None, {}), cabeceras
+    url = urlsplit(linea[1])
+    return (linea[0], url.path, parse_qs(url.query)), cabeceras
+
+def cabeceras_cors(cabeceras):
+    origen = cabeceras.get("origin")
+    if origen and origen in ORIGENES:
+        return f"Access-Control-Allow-Origin: {origen}\r\nAccess-Control-Allow-Credentials: true\r\nVary: Origin\r\n"
+    return ""
+
+async def atender(reader, writer):
+    cola = None
+    try:
+        (metodo, ruta, _), cabeceras = await asyncio.wait_for(leer_peticion(reader), 10)
+        if metodo != "GET" or ruta not in ("/eventos", "/eventos/admin"):
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"); return
+        admin = ruta == "/eventos/admin"
+        comercio_id = comercio_sesion(cabeceras, admin)
+        if comercio_id is None:
+            writer.write(b"HTTP/1.1 401 Unauthorized\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"); return
+        writer.write(("HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                      "X-Accel-Buffering: no\r\nConnection: keep-alive\r\n" + cabeceras_cors(cabeceras) + "\r\nretry: 3000\n\n").encode())
+        await writer.drain()
+        cola = DIFUSOR.suscribir(admin, comercio_id)
+        while True:
+            try: dato = await asyncio.wait_for(cola.get(), LATIDO)
+            except asyncio.TimeoutError: writer.write(b": latido\n\n")
+            else:
+                if dato is None: break
+                writer.write(f"event: pago\ndata: {dato}\n\n".encode())
+            await writer.drain()
+    except (ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError): pass
+    finally:
+        if cola is not None: DIFUSOR.desuscribir(cola)
+        try:
+            writer.close(); await writer.wait_closed()
+        except ConnectionError: pass
+
+async def principal(host="0.0.0.0", puerto=EVENTOS_PUERTO):
+    servidor = await asyncio.start_server(atender, host, puerto, backlog=1024)
+    print(f"🚀 Eventos en http://{host}:{puerto}/eventos")
+    async with servidor:
+        await asyncio.gather(servidor.serve_forever(), escuchar_postgres())
+
+if __name__ == "__main__":
+    try: asyncio.run(principal())
+    except KeyboardInterrupt: print("👋 Servidor de eventos detenido")
@@ -0,0 +1,89 @@
+import json
+import os
+import re
+from decimal import Decimal, InvalidOperation
+
+# --- MOTOR DE PATRONES BANCARIOS ---
+# Las definiciones viven en bancos.json (banco, clave, emisor, monto, referencia, moneda, decimal)
+# para poder añadir un banco sin tocar código. Todo se compila una sola vez al cargar el módulo.
+RUTA_BANCOS = os.getenv("BANCOS_ARCHIVO", os.path.join(os.path.dirname(os.path.abspath(__file__)), "bancos.json"))
+
+MONEDA_DEFECTO = ("VES", ",")  # Filas antiguas sin banco: bolívares con coma decimal
+
+def limpiar_texto(texto):
+    return texto.replace('"', '').replace('\\n', ' ').replace('\n', ' ').strip()
+
+def convertir_monto(texto, decimal=","):
+    # "1.234,56" -> Decimal("1234.56") | "150.000" -> Decimal("150000") | "25.50" (decimal=".") -> Decimal("25.50")
+    if texto is None: return None
+    texto = str(texto).strip()
+    texto = texto.replace(".", "").replace(",", ".") if decimal == "," else texto.replace(",", "")
+    try: valor = Decimal(texto)
+    except InvalidOperation: return None
+    return valor if valor.is_finite() else None
+
+class MotorBancos:
+    def __init__(self, definiciones):
+        self.bancos = []
+        self.monedas = {}  # banco -> (moneda, separador decimal)
+        self.claves = []   # Clave de cada banco compilada aparte (coincidencias que empiezan en el mismo punto)
+        alternativas = []
+        for i, d in enumerate(definiciones):
+            self.bancos.append((
+                d["banco"],
+                re.compile(d["emisor"], re.IGNORECASE),
+                re.compile(d["monto"], re.IGNORECASE),
+                re.compile(d["referencia"], re.IGNORECASE),
+            ))
+            self.monedas[d["banco"]] = (d.get("moneda", MONEDA_DEFECTO[0]), d.get("decimal", MONEDA_DEFECTO[1]))
+            self.claves.append(re.compile(d["clave"], re.IGNORECASE))
+            alternativas.append(f"(?P<b{i}>{d['clave']})")
+        # Una sola expresión detecta todos los bancos mencionados en el texto
+        self.detector = re.compile("|".join(alternativas), re.IGNORECASE)
+
+    @classmethod
+    def desde_archivo(cls, ruta=RUTA_BANCOS):
+        with open(ruta, encoding="utf-8") as f: return cls(json.load(f))
+
+    def detectar(self, texto_limpio):
+        # Cada búsqueda sigue un carácter después del inicio de la anterior (no tras su final), así
+        # "Banco de Venezuela" no tapa una clave "Venezuela". En una misma posición la alternancia solo
+        # informa la primera clave que coincide: las de después ("BDV" y "BDV digital") se prueban ahí.
+        encontrados, desde, buscar = set(), 0, self.detector.search
+        while len(encontrados) < len(self.bancos):
+            m = buscar(texto_limpio, desde)
+            if not m: break
+            i, desde = int(m.lastgroup[1:]), m.start() + 1
+            encontrados.add(i)
+            for j in range(i + 1, len(self.claves)):
+                if j not in encontrados and self.claves[j].match(texto_limpio, m.start()): encontrados.add(j)
+        return sorted(encontrados)  # Mismo orden que el archivo de definiciones
+
+    def normalizar_monto(self, banco, monto):
+        moneda, decimal = self.monedas.get(banco, MONEDA_DEFECTO)
+        return convertir_monto(monto, decimal), moneda
+
+    def extraer(self, texto):
+        texto_limpio = limpiar_texto(texto)
+        pagos_detectados = []
+        for i in self.detectar(texto_limpio):
+            banco, re_emi, re_mon, re_ref = self.bancos[i]
+            m_ref = re_ref.search(texto_limpio)
+            if m_ref:
+                m_emi = re_emi.search(texto_limpio)
+                m_mon = re_mon.search(texto_limpio)
+                monto_num, moneda = self.normalizar_monto(banco, m_mon.group(1) if m_mon else None)
+                pagos_detectados.append({
+                    "banco": banco,
+                    "emisor": m_emi.group(1) if m_emi else "S/D",
+                    "monto": m_mon.group(1) if m_mon else "0,00",
+                    "referencia": m_ref.group(1),
+                    "monto_num": monto_num,
+                    "moneda": moneda
+                })
+        return pagos_detectados
+
+MOTOR = MotorBancos.desde_archivo()
+
+def extractor_inteligente(texto):
+    return MOTOR.extraer(texto)
@@ -0,0 +1,189 @@
+import argparse
+import os
+import re
+import time
+from datetime import datetime
+
+import psycopg2
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+from metricas import ALERTAS
+from pool_db import parametros_conexion
+
+# --- HUELLAS: DUPLICADOS PROBABLES Y REPETICIONES SOSPECHOSAS ---
+# La unicidad de pagos_referencias solo ve la referencia exacta. Los bancos reenvían avisos con la
+# referencia reformateada (ceros, prefijos) y Sofitasa enmascara el teléfono (0414***4567), así que
+# cada pago deja en pagos_huellas dos claves que se consultan por índice, sin recorrer pagos:
+#   s:<banco>|<monto>|<sufijo de la referencia>       -> mismo pago con otra referencia (DUPLICADO)
+#   m:<banco>|<monto>|<emisor>|<ventana de minutos>   -> mismo emisor y monto en minutos (REPETIDO)
+# Un pago cuya clave ya tiene otra referencia queda con `alerta` en pagos (se ve en /admin).
+# Uso: python huellas.py reprocesar [--comercio 1] [--desde 2026-01-01] [--limpiar]
+HUELLA_VENTANA = int(os.getenv("HUELLA_VENTANA", "10"))  # Minutos de la ventana de repetición
+HUELLAS_DIAS = int(os.getenv("HUELLAS_DIAS", "30"))      # Días que se conservan las claves
+SUFIJO = 6
+TIPOS = {"s": "DUPLICADO", "m": "REPETIDO"}
+
+def emisor_normalizado(emisor):
+    # Solo dígitos (0414-1234567 y 04141234567 dan lo mismo). Enmascarado (0414***4567) solo quedan
+    # los extremos; la clave incluye el banco, y cada banco enmascara siempre igual.
+    emisor = emisor or ""
+    digitos = re.sub(r"\D", "", emisor)
+    if "*" in emisor: return digitos[:4] + "*" + digitos[-4:] if len(digitos) >= 8 else ""
+    return digitos if len(digitos) >= 7 else ""
+
+def monto_normalizado(pago):
+    if pago.get("monto_num") is not None: return f"{pago['monto_num']:.2f}"
+    return re.sub(r"\D", "", pago.get("monto") or "")
+
+def claves(pago):
+    # (guardar, buscar): la de repetición se busca también en la ventana anterior (un reenvío a las 10:09 y 10:11)
+    banco, monto = pago["banco"], monto_normalizado(pago)
+    referencia = re.sub(r"\D", "", pago["referencia"]) or pago["referencia"]
+    guardar = [f"s:{banco}|{monto}|{referencia[-SUFIJO:]}"]
+    buscar = list(guardar)
+    emisor = emisor_normalizado(pago.get("emisor"))
+    if emisor and monto:
+        ventana = int(pago["recibido"].timestamp() // (HUELLA_VENTANA * 60))
+        guardar.append(f"m:{banco}|{monto}|{emisor}|{ventana}")
+        buscar += [guardar[-1], f"m:{banco}|{monto}|{emisor}|{ventana - 1}"]
+    return guardar, buscar
+
+# Busca y registra en el mismo viaje; la búsqueda ve las huellas de antes de esta sentencia. Las claves
+# "s:" van primero (DESC), así un duplicado se informa como tal aunque además sea una repetición.
+SQL_MARCAR = """WITH h (comercio_id, referencia, recibido_en, guardar, buscar) AS ({}),
+    previa AS (SELECT DISTINCT ON (h.referencia) h.referencia, b.clave, x.referencia AS otra
+               FROM h CROSS JOIN LATERAL unnest(h.buscar) AS b (clave)
+               JOIN pagos_huellas x ON x.comercio_id = h.comercio_id AND x.clave = b.clave AND x.referencia <> h.referencia
+               ORDER BY h.referencia, b.clave DESC, x.recibido_en DESC),
+    nuevas AS (INSERT INTO pagos_huellas (comercio_id, clave, referencia, recibido_en)
+               SELECT h.comercio_id, g.clave, h.referencia, h.recibido_en FROM h CROSS JOIN LATERAL unnest(h.guardar) AS g (clave)
+               ON CONFLICT DO NOTHING)
+    SELECT referencia, clave, otra FROM previa"""
+SQL_ALERTA = """UPDATE pagos SET alerta = v.alerta FROM ({}) AS v (comercio_id, referencia, recibido_en, alerta)
+                WHERE pagos.comercio_id = v.comercio_id AND pagos.recibido_en = v.recibido_en AND pagos.referencia = v.referencia"""
+
+def preparar(pagos, comercio_id):
+    # Filas para SQL_MARCAR y alertas entre pagos del mismo lote (esos aún no están en pagos_huellas)
+    filas, vistas, alertas = [], {}, {}
+    for p in pagos:
+        guardar, buscar = claves(p)
+        filas.append((comercio_id, p["referencia"], p["recibido"], guardar, buscar))
+        for clave in sorted(buscar, reverse=True):
+            otra = vistas.get(clave)
+            if otra and otra != p["referencia"] and p["referencia"] not in alertas: alertas[p["referencia"]] = (clave, otra)
+        for clave in guardar: vistas.setdefault(clave, p["referencia"])
+    return filas, alertas
+
+def texto_alerta(clave, otra):
+    return f"{TIPOS[clave[0]]}: {'otra referencia del mismo pago' if clave[0] == 's' else 'mismo emisor y monto'} ({otra})"
+
+def filas_alerta(pagos, comercio_id, alertas):
+    salida = []
+    for p in pagos:
+        if p["referencia"] not in alertas: continue
+        clave, otra = alertas[p["referencia"]]
+        ALERTAS.sumar(TIPOS[clave[0]])
+        salida.append((comercio_id, p["referencia"], p["recibido"], texto_alerta(clave, otra)))
+    return salida
+
+def marcar(cursor, pagos, comercio_id=1):
+    # Registra las huellas de los pagos recién insertados (con "recibido") y les pone alerta si
+    # corresponde. Un viaje a Postgres, dos si hay alertas. Devuelve cuántos quedaron marcados.
+    if not pagos: return 0
+    filas, alertas = preparar(pagos, comercio_id)
+    execute_values(cursor, SQL_MARCAR.format("VALUES %s"), filas, template="(%s, %s, %s::timestamptz, %s::text[], %s::text[])",
+                   page_size=len(filas))
+    for referencia, clave, otra in cursor.fetchall(): alertas.setdefault(referencia, (clave, otra))
+    filas = filas_alerta(pagos, comercio_id, alertas)
+    if filas: execute_values(cursor, SQL_ALERTA.format("VALUES %s"), filas, template="(%s, %s, %s::timestamptz, %s)", page_size=len(filas))
+    return len(filas)
+
+async def marcar_async(conn, pagos, comercio_id=1):
+    # Lo mismo con asyncpg (asgi.py)
+    if not pagos: return 0
+    filas, alertas = preparar(pagos, comercio_id)
+    comercios, referencias, recibidos, guardar, buscar = zip(*filas)
+    # Los arreglos de claves van como texto por fila ("{a,b}") porque unnest no despliega arreglos de arreglos
+    previas = await conn.fetch(SQL_MARCAR.format("SELECT c, r, t, g::text[], b::text[] FROM unnest($1::integer[], $2::text[], "
+                                                 "$3::timestamptz[], $4::text[], $5::text[]) AS u (c, r, t, g, b)"),
+                               list(comercios), list(referencias), list(recibidos), [_arreglo(g) for g in guardar], [_arreglo(b) for b in buscar])
+    for referencia, clave, otra in previas: alertas.setdefault(referencia, (clave, otra))
+    filas = filas_alerta(pagos, comercio_id, alertas)
+    if filas:
+        await conn.execute(SQL_ALERTA.format("SELECT * FROM unnest($1::integer[], $2::text[], $3::timestamptz[], $4::text[])"),
+                           *(list(c) for c in zip(*filas)))
+    return len(filas)
+
+def _arreglo(claves):
+    return "{" + ",".join('"' + c.replace("\\", "\\\\").replace('"', '\\"') + '"' for c in claves) + "}"
+
+def purgar(conn, dias=HUELLAS_DIAS):
+    # Las claves viejas ya no sirven para detectar reenvíos; las referencias exactas siguen en pagos_referencias
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM pagos_huellas WHERE recibido_en < now() - %s * interval '1 day'", (dias,))
+    conn.commit()
+    return cursor.rowcount
+
+# --- REPROCESO DEL HISTÓRICO ---
+def reprocesar(conn, comercio_id=None, desde=None, lote=5000, limpiar=False):
+    # Pasa los pagos guardados, en orden de llegada, por el mismo índice que la ingesta. Los campos
+    # salen de volver a extraer mensaje_completo (los guardados pueden venir de un extractor viejo);
+    # si el mensaje no se reconoce se usan los de la fila.
+    from extractor import extractor_inteligente
+    condiciones, parametros = ["TRUE"], []
+    if comercio_id: condiciones.append("comercio_id = %s"); parametros.append(comercio_id)
+    if desde: condiciones.append("recibido_en >= %s"); parametros.append(desde)
+    where = " AND ".join(condiciones)
+    escritura = conn.cursor()
+    if limpiar:
+        escritura.execute(f"DELETE FROM pagos_huellas WHERE {where}", parametros)
+        escritura.execute(f"UPDATE pagos SET alerta = NULL WHERE alerta IS NOT NULL AND {where}", parametros)
+        conn.commit()
+    # Cursor con nombre en una conexión aparte: las escrituras se confirman por lote sin cerrarlo
+    lectura = psycopg2.connect(**parametros_conexion())
+    cursor = lectura.cursor(name="huellas_reproceso")
+    cursor.itersize = lote
+    cursor.execute(f"""SELECT comercio_id, referencia, recibido_en, banco, emisor, monto, monto_num, mensaje_completo
+                       FROM pagos WHERE {where} AND referencia IS NOT NULL ORDER BY recibido_en, id""", parametros)
+    inicio, total, marcados = time.perf_counter(), 0, 0
+    try:
+        while True:
+            filas = cursor.fetchmany(lote)
+            if not filas: break
+            por_comercio = {}
+            for c_id, referencia, recibido, banco, emisor, monto, monto_num, mensaje in filas:
+                pago = {"banco": banco, "emisor": emisor, "monto": monto, "monto_num": monto_num}
+                extraidos = [p for p in (extractor_inteligente(mensaje) if mensaje else []) if p["referencia"] == referencia]
+                if extraidos: pago.update({k: extraidos[0][k] for k in ("banco", "emisor", "monto", "monto_num")})
+                pago.update(referencia=referencia, recibido=recibido)
+                por_comercio.setdefault(c_id, []).append(pago)
+            for c_id, pagos in por_comercio.items(): marcados += marcar(escritura, pagos, c_id)
+            conn.commit()
+            total += len(filas)
+            print(f"⏳ {total:,} pagos, {marcados:,} alertas, {total / (time.perf_counter() - inicio):,.0f} pagos/s")
+    finally:
+        cursor.close(); lectura.close()
+    print(f"✅ {total:,} pagos reprocesados en {time.perf_counter() - inicio:.1f} s; {marcados:,} con alerta")
+
+if __name__ == "__main__":
+    from ingesta import ZONA_NEGOCIO
+    parser = argparse.ArgumentParser(description="Índice de duplicados probables y repeticiones sospechosas")
+    sub = parser.add_subparsers(dest="orden", required=True)
+    p = sub.add_parser("reprocesar", help="Pasa los pagos guardados por el índice (en orden de llegada)")
+    p.add_argument("--comercio", type=int)
+    p.add_argument("--desde", type=lambda s: datetime.strptime(s, "%Y-%m-%d").replace(tzinfo=ZONA_NEGOCIO), help="AAAA-MM-DD")
+    p.add_argument("--lote", type=int, default=5000)
+    p.add_argument("--limpiar", action="store_true", help="Borra antes las huellas y alertas del rango (reconstrucción)")
+    p = sub.add_parser("purgar", help=f"Borra las claves de más de --dias (por defecto {HUELLAS_DIAS})")
+    p.add_argument("--dias", type=int, default=HUELLAS_DIAS)
+    args = parser.parse_args()
+    conn = psycopg2.connect(**parametros_conexion())
+    try:
+        if args.orden == "reprocesar": reprocesar(conn, args.comercio, args.desde, args.lote, args.limpiar)
+        else: print(f"✅ {purgar(conn, args.dias):,} claves borradas")
+    except psycopg2.Error as e:
+        print(f"❌ {e}")
+    finally: conn.close()
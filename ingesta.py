@@ -0,0 +1,102 @@
+import json
+import os
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from psycopg2.extras import execute_values
+
+from extractor import MOTOR, extractor_inteligente, limpiar_texto
+from metricas import DUPLICADAS, EXTRACCION, MENSAJES
+from huellas import marcar, marcar_async
+
+ZONA_NEGOCIO = ZoneInfo(os.getenv("TZ_NEGOCIO", "America/Caracas"))
+
+# --- INGESTA DE NOTIFICACIONES (compartida por /webhook-bdv y /webhook-bdv/lote) ---
+def leer_mensajes(cuerpo, tipo=""):
+    # Acepta: lista JSON (textos u objetos {"mensaje": ...}), objeto {"mensajes": [...]},
+    # objeto {"mensaje": ...} o NDJSON (una notificación por línea)
+    cuerpo = cuerpo.strip()
+    if not cuerpo: return []
+    if "ndjson" not in tipo:
+        try: datos = json.loads(cuerpo)
+        except ValueError: datos = None
+        else:
+            if isinstance(datos, dict): datos = datos.get("mensajes", [datos])
+            if isinstance(datos, list): return [_texto(d) for d in datos]
+    mensajes = []
+    for linea in cuerpo.splitlines():
+        linea = linea.strip()
+        if not linea: continue
+        try: mensajes.append(_texto(json.loads(linea)))
+        except ValueError: mensajes.append(linea)
+    return mensajes
+
+def _texto(dato):
+    return str(dato.get("mensaje", "")) if isinstance(dato, dict) else str(dato)
+
+def extraer_lote(mensajes, recibidos=None):
+    # Extrae todos los mensajes y descarta referencias repetidas dentro del mismo lote.
+    # `recibidos` (opcional) trae la hora real de llegada de cada mensaje, p. ej. desde la cola.
+    pagos, vistas, repetidas = [], set(), 0
+    for i, texto in enumerate(mensajes):
+        inicio = time.perf_counter()
+        extraidos = extractor_inteligente(texto)
+        EXTRACCION.observar(time.perf_counter() - inicio, extraidos[0]["banco"] if extraidos else "ninguno")
+        if not extraidos:
+            # Solo en el camino raro se averigua por qué: ningún banco reconocido o banco sin referencia
+            MENSAJES.sumar("sin_referencia" if MOTOR.detectar(limpiar_texto(texto)) else "sin_banco"); continue
+        MENSAJES.sumar("ok")
+        for p in extraidos:
+            if p["referencia"] in vistas: repetidas += 1; continue
+            vistas.add(p["referencia"]); p["mensaje_completo"] = texto
+            if recibidos: p["recibido"] = recibidos[i]
+            pagos.append(p)
+    if repetidas: DUPLICADAS.sumar("lote", cantidad=repetidas)
+    return pagos, repetidas
+
+TIPOS_PAGO = ("text", "text", "text", "text", "text", "text", "text", "numeric", "text", "timestamptz", "integer")
+COLUMNAS_PAGO = "fecha_recepcion, hora_recepcion, emisor, monto, referencia, mensaje_completo, banco, monto_num, moneda, recibido_en, comercio_id"
+# La unicidad por comercio la da pagos_referencias (pagos está particionada por mes y su clave única
+# tendría que incluir recibido_en): solo pasan a pagos las referencias que entraron ahí.
+SQL_GUARDAR = (f"WITH v ({COLUMNAS_PAGO}) AS ({{}}), "
+               "nuevas AS (INSERT INTO pagos_referencias (comercio_id, referencia, recibido_en) SELECT comercio_id, referencia, recibido_en FROM v "
+               "ON CONFLICT DO NOTHING RETURNING comercio_id, referencia) "
+               f"INSERT INTO pagos ({COLUMNAS_PAGO}) SELECT {', '.join('v.' + c for c in COLUMNAS_PAGO.split(', '))} "
+               "FROM v JOIN nuevas USING (comercio_id, referencia) RETURNING referencia")
+
+def filas_pagos(pagos, comercio_id):
+    # Además de los textos de siempre se guardan monto_num/moneda/recibido_en tipados (orden de COLUMNAS_PAGO)
+    ahora, filas = datetime.now(ZONA_NEGOCIO), []
+    for p in pagos:
+        recibido = (p.get("recibido") or ahora).astimezone(ZONA_NEGOCIO)
+        filas.append((recibido.strftime("%d/%m/%Y"), recibido.strftime("%I:%M %p"), p["emisor"], p["monto"],
+                      p["referencia"], p.get("mensaje_completo"), p["banco"], p.get("monto_num"), p.get("moneda"), recibido, comercio_id))
+    return filas
+
+def insertados(pagos, filas, referencias):
+    # Los pagos que entraron, con su hora de llegada, para el índice de huellas
+    referencias = {r[0] for r in referencias}
+    return [dict(p, recibido=f[9]) for p, f in zip(pagos, filas) if f[4] in referencias]
+
+def guardar_pagos(conn, pagos, comercio_id=1):
+    # Un solo INSERT multi-fila; las referencias ya vistas en el comercio se descartan. Los nuevos pasan
+    # por huellas.marcar (duplicados con otra referencia). El commit queda a cargo de quien llama.
+    if not pagos: return 0
+    filas = filas_pagos(pagos, comercio_id)
+    cursor = conn.cursor()
+    insertadas = execute_values(cursor, SQL_GUARDAR.format("VALUES %s"), filas,
+        template="(" + ", ".join("%s" if t == "text" else f"%s::{t}" for t in TIPOS_PAGO) + ")", page_size=len(filas), fetch=True)
+    if len(insertadas) < len(filas): DUPLICADAS.sumar("base", cantidad=len(filas) - len(insertadas))
+    marcar(cursor, insertados(pagos, filas, insertadas), comercio_id)
+    return len(insertadas)
+
+async def guardar_pagos_async(conn, pagos, comercio_id=1):
+    # Lo mismo con asyncpg (asgi.py): las filas viajan como un arreglo por columna y se despliegan con unnest
+    if not pagos: return 0
+    filas = filas_pagos(pagos, comercio_id)
+    desplegar = "SELECT * FROM unnest(" + ", ".join(f"${i}::{t}[]" for i, t in enumerate(TIPOS_PAGO, 1)) + ")"
+    insertadas = await conn.fetch(SQL_GUARDAR.format(desplegar), *(list(c) for c in zip(*filas)))
+    if len(insertadas) < len(filas): DUPLICADAS.sumar("base", cantidad=len(filas) - len(insertadas))
+    await marcar_async(conn, insertados(pagos, filas, insertadas), comercio_id)
+    return len(insertadas)
@@ -1,81 +1,86 @@
-import psycopg2
-import re
+import csv
+import gzip
+import hashlib
 import os
-import pandas as pd
-from flask import Flask, request, render_template_string, redirect, url_for, session, send_file
-from datetime import datetime
-from io import BytesIO
+import sqlite3
+import tempfile
+import time
+from flask import Flask, request, render_template, redirect, url_for, session, send_file, jsonify, Response, stream_with_context, g, abort
+from datetime import datetime, timedelta
+from io import StringIO
 from dotenv import load_dotenv
+from jinja2 import DictLoader
+from pool_db import POOL, conexion_db
+from ingesta import leer_mensajes, extraer_lote, guardar_pagos, ZONA_NEGOCIO
+from cola_ingesta import encolar, asegurar_worker, pendientes, fallidos
+from verificacion import canjear_referencia
+from extractor import MOTOR
+from notificaciones import ESCUCHA
+from cache_refs import CACHE
+from comercios import COMERCIO_PRINCIPAL, hash_token, comercio_de_hash, comercio_de_slug, token_rechazado, validar_clave
+from metricas import REGISTRO, HTTP_DURACION, VERIFICACIONES, EXPORTACION_DURACION, EXPORTACION_BYTES
 
 # --- CONFIGURACIÓN ---
 load_dotenv(override=True)
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "clave_sistemas_mv_2026")
+LOTE_MAX = int(os.getenv("LOTE_MAX", "1000"))
+INGESTA_COLA = os.getenv("INGESTA_COLA", "1") == "1"      # 0 = el webhook escribe directo en Postgres
+COLA_WORKER = os.getenv("COLA_WORKER", "proceso")         # proceso = hilo en cada worker web | externo = python cola_ingesta.py
+USAR_CACHE = os.getenv("CACHE_REFS", "1") == "1"         # 0 = /verificar siempre consulta la base de datos
+EVENTOS_URL = os.getenv("EVENTOS_URL", "").rstrip("/")    # URL pública de eventos.py (vacía = sin actualización en vivo)
+TOKEN_OBLIGATORIO = os.getenv("TOKEN_OBLIGATORIO", "0") == "1"  # 1 = rechaza webhooks sin token (nada cae en el comercio principal)
+METRICAS_TOKEN = os.getenv("METRICAS_TOKEN", "")          # Si se define, /metrics exige "Authorization: Bearer <token>"
 
 # --- BASE DE DATOS ---
-def get_db_connection():
-    return psycopg2.connect(
-        host=os.getenv("DB_HOST"),
-        database=os.getenv("DB_NAME"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASS"),
-        port=os.getenv("DB_PORT", "5432"),
-        sslmode="require" if "neon.tech" in (os.getenv("DB_HOST") or "") else "disable"
-    )
+# Todas las rutas piden prestada una conexión al pool (pool_db.py) con `with conexion_db() as conn:`
+
+# --- MÉTRICAS (latencia por ruta; ver metricas.py) ---
+@app.before_request
+def iniciar_cronometro(): g.inicio = time.perf_counter()
+
+@app.after_request
+def medir_peticion(resp):
+    # La plantilla de la ruta (/admin, /verificar...) y no la URL concreta, para no multiplicar series
+    if 'inicio' in g:
+        ruta = request.url_rule.rule if request.url_rule else "sin_ruta"
+        HTTP_DURACION.observar(time.perf_counter() - g.inicio, ruta, request.method, resp.status_code)
+    return resp
+
+@REGISTRO.indicador
+def indicadores_pool():
+    s = POOL.estadisticas()
+    return [("notipagos_pool_en_uso", "Conexiones prestadas", s["en_uso"]),
+            ("notipagos_pool_libres", "Conexiones libres en el pool", s["libres"]),
+            ("notipagos_pool_creadas", "Conexiones abiertas desde el arranque", s["creadas"]),
+            ("notipagos_pool_esperas", "Préstamos que tuvieron que esperar una conexión", s["esperas"]),
+            ("notipagos_pool_agotado", "Préstamos que agotaron la espera", s["agotado"]),
+            ("notipagos_pool_espera_media_segundos", "Espera media por una conexión", s["espera_media_ms"] / 1000)]
+
+@REGISTRO.indicador
+def indicadores_cola_cache():
+    c = CACHE.estadisticas()
+    return [("notipagos_cola_pendientes", "Mensajes en la cola local sin guardar", pendientes()),
+            ("notipagos_cola_fallidos", "Mensajes apartados tras COLA_FALLOS_MAX errores propios", fallidos()),
+            ("notipagos_cache_activa", "1 si la caché de referencias está escuchando NOTIFY", int(c["activa"])),
+            ("notipagos_cache_aciertos", "Consultas respondidas por la caché", c["aciertos"]),
+            ("notipagos_cache_fallos", "Consultas que fueron a la base de datos", c["fallos"]),
+            ("notipagos_cache_referencias", "Referencias recientes en la caché", c["referencias"])]
+
+@app.route('/metrics')
+def metricas():
+    if METRICAS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICAS_TOKEN}": abort(401)
+    return Response(REGISTRO.exponer(), mimetype='text/plain; version=0.0.4')
 
 # --- RUTA PARA CRON JOB ---
 @app.route('/health')       
 def health_check():
     try:
-        conn = get_db_connection(); conn.close()
+        with conexion_db() as conn:
+            cursor = conn.cursor(); cursor.execute("SELECT 1"); cursor.fetchone()
         return "OK - Sistema Activo", 200
     except Exception as e: return f"Error: {str(e)}", 500
 
-# --- EXTRACTOR INTELIGENTE (Versión 2026 Optimizado) ---
-def extractor_inteligente(texto):
-    # El programa usa un limpiador de texto
-    texto_limpio = texto.replace('"', '').replace('\\n', ' ').replace('\n', ' ').strip()
-    pagos_detectados = []
-    
-    patrones = {
-        "BDV": (
-            r"BDV|PagomovilBDV", 
-            r"(?:del|tlf|desde el tlf)\s*(\d{4}[- ]\d+|\d{10,11})", 
-            r"(?:por|Bs\.?|Monto:)\s*([\d.]+,\d{2})", 
-            r"Ref:\s*(\d+)"
-        ),
-        "BANESCO": (
-            r"Banesco", 
-            r"(?:de|desde|tlf)\s*(\d{10,11})", 
-            r"(?:Bs\.?|Monto:?\s*Bs\.?|por)\s*([\d.]+,\d{2})", 
-            r"Ref:\s*(\d+)"
-        ),
-        "SOFITASA": (
-            r"SOFITASA", 
-            r"Telf\.(\d{4,11}|\d{4}\*\*\*\d{4})", 
-            r"Bs\.?([\d.]+,\d{2})", 
-            r"Ref:(\d+)"
-        ),
-        "BINANCE": (r"Binance", r"(?:from|de)\s+(.*?)\s+(?:received|el)", r"([\d.]+)\s*USDT", r"(?:ID|Order):\s*(\d+)"),
-        "BANCOLOMBIA": (r"Bancolombia", r"en\s+(.*?)\s+por", r"\$\s*([\d.]+)", r"Ref\.\s*(\d+)"),
-        "NEQUI": (r"Nequi", r"De\s+(.*?)\s?te", r"\$\s*([\d.]+)", r"referencia\s*(\d+)"),
-        "PLAZA": (r"Plaza", r"desde\s+(.*?)\s+por", r"Bs\.\s*([\d.]+,\d{2})", r"Ref:\s*(\d+)")
-    }
-
-    for banco, (key, re_emi, re_mon, re_ref) in patrones.items():
-        if re.search(key, texto_limpio, re.IGNORECASE):
-            m_emi = re.search(re_emi, texto_limpio, re.IGNORECASE)
-            m_mon = re.search(re_mon, texto_limpio, re.IGNORECASE)
-            m_ref = re.search(re_ref, texto_limpio, re.IGNORECASE)
-            if m_ref:
-                pagos_detectados.append({
-                    "banco": banco, 
-                    "emisor": m_emi.group(1) if m_emi else "S/D", 
-                    "monto": m_mon.group(1) if m_mon else "0,00", 
-                    "referencia": m_ref.group(1)
-                })
-    return pagos_detectados
-
 # --- ESTILOS CSS DEFINITIVOS (RESPONSIVE + ESTÉTICA) ---
 CSS_FINAL = '''
 :root { 
@@ -106,6 +111,11 @@ table { width: 100%; border-collapse: collapse; min-width: 900px; }
 th { background: #fcfcfc; padding: 15px; text-align: left; font-size: 11px; color: #888; border-bottom: 2px solid #eee; text-transform: uppercase; }
 td { padding: 15px; border-bottom: 1px solid #f1f1f1; font-size: 13px; }
 
+/* Filtros y Paginación del Panel */
+.filtros { display: flex; flex-wrap: wrap; gap: 10px; align-items: center; }
+.filtros input, .filtros select { padding: 14px; border-radius: 10px; border: 1px solid #ddd; outline: none; font-size: 14px; background: white; }
+.paginacion { display: flex; justify-content: space-between; gap: 10px; margin-top: 15px; }
+
 /* Totales Grid */
 .grid-totales { display: grid; grid-template-columns: repeat(auto-fit, minmax(260px, 1fr)); gap: 20px; margin-top: 20px; }
 .total-item { padding: 30px; border-radius: 18px; color: white; font-weight: bold; text-align: center; font-size: 20px; box-shadow: 0 4px 15px rgba(0,0,0,0.1); }
@@ -126,6 +136,13 @@ td { padding: 15px; border-bottom: 1px solid #f1f1f1; font-size: 13px; }
 
 /* Status Labels */
 .status-badge { padding: 4px 10px; border-radius: 6px; font-size: 11px; font-weight: bold; }
+.estado-libre { color: #1a7f37; background: #dcffe4; }
+.estado-canjeado { color: #af1f2c; background: #ffdce0; }
+.alerta { display: inline-block; margin-top: 4px; padding: 2px 8px; border-radius: 6px; font-size: 10px; font-weight: bold; color: #8a5300; background: #fff3cd; cursor: help; }
+
+/* Eventos en vivo */
+.pago-vivo { padding: 8px 0; border-bottom: 1px solid #f1f1f1; font-size: 13px; }
+.fila-nueva td { background: #fffbe6; }
 
 @media (max-width: 600px) {
     .nav-header { flex-direction: column; text-align: center; gap: 15px; }
@@ -137,7 +154,7 @@ td { padding: 15px; border-bottom: 1px solid #f1f1f1; font-size: 13px; }
 # --- VISTA LOGIN ---
 HTML_LOGIN = '''<!DOCTYPE html><html><head>
 <meta name="viewport" content="width=device-width, initial-scale=1">
-<title>Acceso Admin</title><style>''' + CSS_FINAL + '''</style></head><body>
+<title>Acceso Admin</title><link rel="stylesheet" href="{{ url_for('estilos', v=css_version) }}"></head><body>
 <div class="login-box">
     <div class="card login-card">
         <a href="/" class="btn btn-light" style="position: absolute; top: 15px; left: 15px; padding: 8px 12px; font-size: 12px;">← Volver</a>
@@ -145,6 +162,7 @@ HTML_LOGIN = '''<!DOCTYPE html><html><head>
         <h2 style="color:var(--primary); margin:0;">Panel Admin</h2>
         <p style="color:#777; font-size:14px; margin-bottom:20px;">Ingrese su PIN de Seguridad</p>
         <form method="POST">
+            <input type="text" name="comercio" class="login-input" placeholder="Comercio (opcional)" value="{{ comercio_slug or '' }}" autocomplete="off">
             <input type="password" name="password" class="login-input" placeholder="••••" required autofocus>
             <button type="submit" class="btn btn-primary" style="width:100%; padding:15px; font-size:16px;">ENTRAR AL SISTEMA</button>
         </form>
@@ -155,7 +173,7 @@ HTML_LOGIN = '''<!DOCTYPE html><html><head>
 # --- VISTA PORTAL (VERIFICADOR) ---
 HTML_PORTAL = '''<!DOCTYPE html><html><head>
 <meta name="viewport" content="width=device-width, initial-scale=1">
-<title>Verificador</title><style>''' + CSS_FINAL + '''</style></head><body>
+<title>Verificador</title><link rel="stylesheet" href="{{ url_for('estilos', v=css_version) }}"></head><body>
 <div class="container" style="max-width:480px; margin-top:30px;">
     <div class="nav-header">
         <a href="/" class="btn btn-light">🔄 Refrescar</a>
@@ -164,6 +182,7 @@ HTML_PORTAL = '''<!DOCTYPE html><html><head>
     <div class="card" style="text-align:center;">
         <img src="{{ logo_url }}" class="logo-main" style="margin: 0 auto 20px auto;">
         <h2 style="color:var(--primary);">Verificar Pago</h2>
+        {% if comercio_id != 1 %}<p style="color:#777; margin-top:-10px;">{{ comercio_nombre }}</p>{% endif %}
         <form method="POST" action="/verificar">
             <input type="text" name="ref" placeholder="Referencia" style="width:100%; padding:18px; font-size:22px; border:2px solid #eee; border-radius:12px; text-align:center; margin-bottom:20px;" required autocomplete="off">
             <button type="submit" class="btn btn-primary" style="width:100%; padding:18px; font-size:16px;">CONSULTAR</button>
@@ -182,29 +201,61 @@ HTML_PORTAL = '''<!DOCTYPE html><html><head>
         <audio autoplay><source src="{{ 'https://assets.mixkit.co/active_storage/sfx/2000/2000-preview.mp3' if resultado.clase == 'success' else 'https://assets.mixkit.co/active_storage/sfx/2014/2014-preview.mp3' }}" type="audio/mpeg"></audio>
         {% endif %}
     </div>
+    {% if eventos_url %}
+    <div class="card" id="recientes" style="display:none;">
+        <h4 style="margin:0 0 10px 0; color:var(--primary);">🟢 Pagos recibidos (en vivo)</h4>
+        <div id="listaRecientes"></div>
+    </div>
+    <script>
+    (function () {
+        const lista = document.getElementById("listaRecientes");
+        const fuente = new EventSource("{{ eventos_url }}/eventos", { withCredentials: true });
+        fuente.addEventListener("pago", function (e) {
+            const p = JSON.parse(e.data);
+            if (p.op !== "INSERT") return;
+            document.getElementById("recientes").style.display = "";
+            const fila = document.createElement("div");
+            fila.className = "pago-vivo";
+            fila.textContent = p.banco + " · " + (p.monto || "") + " " + (p.moneda || "");
+            lista.prepend(fila);
+            while (lista.children.length > 8) lista.lastChild.remove();
+        });
+    })();
+    </script>
+    {% endif %}
 </div>
 </body></html>'''
 
 # --- VISTA ADMIN PANEL ---
 HTML_ADMIN = '''<!DOCTYPE html><html><head>
 <meta name="viewport" content="width=device-width, initial-scale=1">
-<title>Panel de Control</title><style>''' + CSS_FINAL + '''</style></head><body>
+<title>Panel de Control</title><link rel="stylesheet" href="{{ url_for('estilos', v=css_version) }}"></head><body>
 <div class="container">
     <div class="nav-header">
         <img src="{{ logo_url }}" height="55">
         <div class="actions">
             <a href="/" class="btn btn-light">🔍 Verificador</a>
-            <a href="/admin/exportar" class="btn btn-primary" style="background:#28a745;">📊 Exportar Excel</a>
+            <a href="{{ url_for('exportar', **filtros) }}" class="btn btn-primary" style="background:#28a745;">📊 Exportar Excel</a>
+            <a href="{{ url_for('exportar', formato='csv', **filtros) }}" class="btn btn-light">⬇️ CSV</a>
             <a href="/logout" class="btn btn-danger">Cerrar Sesión</a>
         </div>
     </div>
     
-    <div class="card" style="padding:12px;">
-        <input type="text" id="adminSearch" placeholder="🔍 Buscar por emisor, referencia o banco..." onkeyup="filterTable()" style="width:100%; padding:14px; border-radius:10px; border:1px solid #ddd; outline:none;">
-    </div>
+    <form method="GET" action="/admin" class="card filtros" style="padding:12px;">
+        <input type="text" name="q" value="{{ filtros.q or '' }}" placeholder="🔍 Buscar por emisor, referencia o banco..." style="flex:3 1 240px;">
+        <select name="banco" style="flex:1 1 120px;">
+            <option value="">Todos los bancos</option>
+            {% for b in bancos %}<option value="{{b}}" {% if filtros.banco == b %}selected{% endif %}>{{b}}</option>{% endfor %}
+        </select>
+        <input type="date" name="desde" value="{{ filtros.desde or '' }}" title="Desde" style="flex:1 1 130px;">
+        <input type="date" name="hasta" value="{{ filtros.hasta or '' }}" title="Hasta" style="flex:1 1 130px;">
+        <label style="font-size:13px; white-space:nowrap;"><input type="checkbox" name="alertas" value="1" {% if filtros.alertas %}checked{% endif %}> Solo alertas ⚠️</label>
+        <button type="submit" class="btn btn-primary">Filtrar</button>
+        {% if filtros %}<a href="/admin" class="btn btn-light">Limpiar</a>{% endif %}
+    </form>
     
     <div class="table-wrapper">
-        <table id="paymentsTable">
+        <table>
             <thead>
                 <tr>
                     <th>Fecha/Hora</th>
@@ -216,25 +267,25 @@ HTML_ADMIN = '''<!DOCTYPE html><html><head>
                     <th>Acción</th>
                 </tr>
             </thead>
-            <tbody>
+            <tbody id="filasPagos">
                 {% for p in pagos %}
-                <tr>
+                <tr data-ref="{{p[5]}}">
                     <td>{{p[1]}}<br><small style="color:#999;">{{p[2]}}</small></td>
-                    <td><span class="badge badge-{{p[9]|lower}}">{{p[9]}}</span></td>
+                    <td><span class="badge badge-{{p[7]|lower}}">{{p[7]}}</span></td>
                     <td>{{p[3]}}</td>
                     <td style="font-weight:700;">
-                        {% if p[9] == 'BINANCE' %}$ {{p[4]}}
-                        {% elif p[9] in ['NEQUI','BANCOLOMBIA'] %}{{p[4]}} COP
+                        {% if p[7] == 'BINANCE' %}$ {{p[4]}}
+                        {% elif p[7] in ['NEQUI','BANCOLOMBIA'] %}{{p[4]}} COP
                         {% else %}Bs. {{p[4]}}{% endif %}
                     </td>
-                    <td><code>{{p[5]}}</code></td>
+                    <td><code>{{p[5]}}</code>{% if p[8] %}<br><span class="alerta" title="{{p[8]}}">⚠️ {{ p[8].split(':')[0] }}</span>{% endif %}</td>
                     <td>
-                        <span class="status-badge" style="color:{% if p[7]=='LIBRE' %}#1a7f37{% else %}#af1f2c{% endif %}; background:{% if p[7]=='LIBRE' %}#dcffe4{% else %}#ffdce0{% endif %};">
-                            {{p[7]}}
+                        <span class="status-badge estado-{{p[6]|lower}}">
+                            {{p[6]}}
                         </span>
                     </td>
                     <td>
-                        {% if p[7] == 'CANJEADO' %}
+                        {% if p[6] == 'CANJEADO' %}
                         <form method="POST" action="/admin/liberar" style="display:flex; gap:5px;">
                             <input type="hidden" name="ref" value="{{p[5]}}">
                             <input type="password" name="pw" placeholder="PIN" style="width:50px; border-radius:6px; border:1px solid #ddd; text-align:center;" required>
@@ -247,98 +298,367 @@ HTML_ADMIN = '''<!DOCTYPE html><html><head>
             </tbody>
         </table>
     </div>
+    {% if paginacion.anterior or paginacion.siguiente %}
+    <div class="paginacion">
+        {% if paginacion.anterior %}<a href="{{ paginacion.anterior }}" class="btn btn-light">← Más recientes</a>{% endif %}
+        {% if paginacion.siguiente %}<a href="{{ paginacion.siguiente }}" class="btn btn-light">Más antiguos →</a>{% endif %}
+    </div>
+    {% endif %}
     
+    <p style="margin:20px 0 0; color:#666; font-size:13px;">Totales desde el {{ totales.desde }}{% if filtros.hasta %} hasta el {{ filtros.hasta.split('-')|reverse|join('/') }}{% endif %}</p>
     <div class="grid-totales">
         <div class="total-item" style="background: linear-gradient(135deg, #D32F2F, #FF5252);">Bs. {{ totales.bs }}</div>
         <div class="total-item" style="background: linear-gradient(135deg, #f3ba2f, #fdd835); color:#000;">$ {{ totales.usd }}</div>
         <div class="total-item" style="background: linear-gradient(135deg, #007A33, #2E7D32);">{{ totales.cop }} COP</div>
     </div>
 </div>
+{% if eventos_url %}
 <script>
-function filterTable() {
-    let input = document.getElementById("adminSearch").value.toUpperCase();
-    let rows = document.getElementById("paymentsTable").getElementsByTagName("tr");
-    for (let i = 1; i < rows.length; i++) {
-        rows[i].style.display = rows[i].textContent.toUpperCase().includes(input) ? "" : "none";
-    }
-}
+(function () {
+    // Solo la primera página sin filtros recibe filas nuevas; los cambios de estado aplican siempre
+    const enVivo = {{ 'true' if not filtros and not paginacion.anterior else 'false' }};
+    const tabla = document.getElementById("filasPagos");
+    const fuente = new EventSource("{{ eventos_url }}/eventos/admin", { withCredentials: true });
+    function celda(fila, texto) { const td = fila.insertCell(); td.textContent = texto; return td; }
+    function marcarEstado(span, estado) { span.className = "status-badge estado-" + estado.toLowerCase(); span.textContent = estado; }
+    fuente.addEventListener("pago", function (e) {
+        const p = JSON.parse(e.data);
+        const existente = tabla.querySelector('tr[data-ref="' + CSS.escape(p.referencia) + '"]');
+        if (existente) {
+            marcarEstado(existente.querySelector(".status-badge"), p.estado);
+            if (p.estado === "LIBRE") existente.lastElementChild.textContent = "";
+            return;
+        }
+        if (p.op !== "INSERT" || !enVivo) return;
+        const fila = tabla.insertRow(0);
+        fila.dataset.ref = p.referencia; fila.className = "fila-nueva";
+        celda(fila, p.fecha_recepcion + " " + p.hora_recepcion);
+        const banco = document.createElement("span");
+        banco.className = "badge badge-" + (p.banco || "").toLowerCase(); banco.textContent = p.banco;
+        fila.insertCell().appendChild(banco);
+        celda(fila, p.emisor);
+        celda(fila, (p.monto || "") + " " + (p.moneda || "")).style.fontWeight = "700";
+        const ref = document.createElement("code"); ref.textContent = p.referencia;
+        fila.insertCell().appendChild(ref);
+        const estado = document.createElement("span"); marcarEstado(estado, p.estado);
+        fila.insertCell().appendChild(estado);
+        fila.insertCell();
+    });
+})();
 </script>
+{% endif %}
 </body></html>'''
 
+# --- PLANTILLAS COMPILADAS Y CSS CACHEADO ---
+# Las plantillas se compilan una sola vez al arrancar (Jinja las guarda en caché) y el CSS se sirve
+# aparte como recurso versionado: el navegador lo descarga una vez y luego responde 304 o usa su caché.
+PLANTILLAS = {"login.html": HTML_LOGIN, "portal.html": HTML_PORTAL, "admin.html": HTML_ADMIN}
+CSS_VERSION = hashlib.sha256(CSS_FINAL.encode()).hexdigest()[:12]
+COMPRIMIR_MIN = 500  # Bytes mínimos para comprimir una respuesta
+app.jinja_loader = DictLoader(PLANTILLAS)
+with app.app_context():
+    for nombre in PLANTILLAS: app.jinja_env.get_template(nombre)
+
+# Las DB_POOL_MIN conexiones de cada worker se abren con la primera petición, en segundo plano
+@app.before_request
+def precalentar_pool(): POOL.precalentar()
+
+# --- CACHÉ DE REFERENCIAS (invalidada entre workers con LISTEN/NOTIFY) ---
+ESCUCHA.suscribir(CACHE.aplicar_evento)
+
+@app.before_request
+def iniciar_escucha():
+    if USAR_CACHE: ESCUCHA.asegurar()
+
+@app.context_processor
+def version_css():
+    return {"css_version": CSS_VERSION, "eventos_url": EVENTOS_URL, "comercio_id": comercio_actual(),
+            "comercio_nombre": session.get('comercio_nombre', ''), "comercio_slug": session.get('comercio_slug', '')}
+
+# --- COMERCIO DE LA SESIÓN ---
+# El portal y el panel trabajan sobre un solo comercio (una sola partición de pagos): el elegido con
+# /c/<slug> o al iniciar sesión. Sin elegir, el comercio principal.
+def comercio_actual(): return session.get('comercio_id', COMERCIO_PRINCIPAL)
+
+@app.route('/c/<slug>')
+def elegir_comercio(slug):
+    comercio = comercio_de_slug(slug)
+    if not comercio: abort(404)
+    if session.get('logged_in') and session.get('comercio_id') != comercio[0]: session.clear()
+    session.update(comercio_id=comercio[0], comercio_nombre=comercio[1], comercio_slug=slug)
+    return redirect(url_for('index'))
+
+@app.route('/estilos.css')
+def estilos():
+    resp = Response(CSS_FINAL, mimetype='text/css')
+    resp.set_etag(CSS_VERSION, weak=True)
+    resp.cache_control.public = True
+    # Solo la URL con la versión actual es inmutable; sin ?v= (o con una vieja) el contenido puede cambiar
+    if request.args.get('v') == CSS_VERSION: resp.cache_control.immutable = True; resp.cache_control.max_age = 31536000
+    else: resp.cache_control.max_age = 3600
+    return resp.make_conditional(request)
+
+@app.after_request
+def comprimir(resp):
+    # gzip para HTML/CSS/JSON/CSV; las respuestas en streaming o de archivo pasan sin tocar
+    resp.vary.add('Accept-Encoding')
+    if (resp.direct_passthrough or resp.is_streamed or 'Content-Encoding' in resp.headers or resp.status_code < 200
+            or resp.status_code in (204, 304) or 'gzip' not in request.headers.get('Accept-Encoding', '')
+            or not (resp.mimetype.startswith('text/') or resp.mimetype == 'application/json')):
+        return resp
+    datos = resp.get_data()
+    if len(datos) < COMPRIMIR_MIN: return resp
+    resp.set_data(gzip.compress(datos, 6))
+    resp.headers['Content-Encoding'] = 'gzip'
+    return resp
+
 # --- RUTAS DE LA APP ---
 @app.route('/')
-def index(): return render_template_string(HTML_PORTAL, logo_url=url_for('static', filename='logo.png'))
+def index(): return render_template('portal.html', logo_url=url_for('static', filename='logo.png'))
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
-    if request.method == 'POST' and request.form.get('password') == os.getenv("ADMIN_PASSWORD", "admin123"):
-        session['logged_in'] = True; return redirect(url_for('admin'))
-    return render_template_string(HTML_LOGIN, logo_url=url_for('static', filename='logo.png'))
+    if request.method == 'POST':
+        # Sin comercio (o "principal") se entra con ADMIN_PASSWORD; los demás con su propia clave
+        slug = request.form.get('comercio', '').strip().lower() or 'principal'
+        comercio = comercio_de_slug(slug)
+        if comercio and clave_valida(comercio[0], request.form.get('password'), "admin123"):
+            session.clear()
+            session.update(logged_in=True, comercio_id=comercio[0], comercio_nombre=comercio[1], comercio_slug=slug)
+            return redirect(url_for('admin'))
+    return render_template('login.html', logo_url=url_for('static', filename='logo.png'))
+
+def clave_valida(comercio_id, clave, defecto=None):
+    if comercio_id == COMERCIO_PRINCIPAL: return clave == os.getenv("ADMIN_PASSWORD", defecto)
+    return validar_clave(comercio_id, clave)
+
+# --- FILTROS Y TOTALES DEL PANEL (calculados en SQL, no en Python) ---
+ADMIN_PAGINA = int(os.getenv("ADMIN_PAGINA", "50"))
+COLUMNAS_ADMIN = "id, fecha_recepcion, hora_recepcion, emisor, monto, referencia, estado, banco, alerta"
+SQL_TOTALES = "SELECT moneda, COALESCE(SUM(monto_num), 0) FROM pagos"
+MONEDAS_TOTALES = {"VES": "bs", "USD": "usd", "COP": "cop"}
+TOTALES_TTL = int(os.getenv("TOTALES_TTL", "30"))  # Segundos que se reutilizan los totales de unos mismos filtros
+_totales = {}
+
+def filtros_admin(args, comercio_id):
+    # Búsqueda por emisor/referencia/banco y rango de fechas (YYYY-MM-DD de los <input type="date">).
+    # Siempre acotada al comercio: Postgres solo lee su partición.
+    condiciones, parametros = ["comercio_id = %s"], [comercio_id]
+    q = args.get('q', '').strip()
+    if q:
+        condiciones.append("(emisor ILIKE %s OR referencia LIKE %s OR banco ILIKE %s)")
+        patron = '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        parametros += [patron, patron, patron]
+    if args.get('banco'):
+        condiciones.append("banco = %s"); parametros.append(args['banco'])
+    # Duplicados probables y repeticiones marcados al ingresar (huellas.py); servido por idx_pagos_alerta
+    if args.get('alertas'): condiciones.append("alerta IS NOT NULL")
+    # Rango sobre recibido_en (indexado), en la zona horaria del negocio; 'hasta' incluye el día completo
+    for campo, operador, dias in (('desde', '>=', 0), ('hasta', '<', 1)):
+        try: fecha = datetime.strptime(args.get(campo, ''), "%Y-%m-%d").replace(tzinfo=ZONA_NEGOCIO)
+        except ValueError: continue
+        condiciones.append(f"recibido_en {operador} %s"); parametros.append(fecha + timedelta(days=dias))
+    return condiciones, parametros
+
+def totales_admin(cursor, condiciones, parametros, args):
+    # Sin 'desde' los totales empiezan el día 1 del mes actual (o del mes de 'hasta'): Postgres solo
+    # lee ese mes y no todo el histórico. Pasar de página no los recalcula (mismos filtros, TOTALES_TTL).
+    condiciones, parametros = list(condiciones), list(parametros)
+    if "recibido_en >= %s" in condiciones: desde = parametros[condiciones.index("recibido_en >= %s")]
+    else:
+        try: referencia = datetime.strptime(args.get('hasta', ''), "%Y-%m-%d")
+        except ValueError: referencia = datetime.now(ZONA_NEGOCIO)
+        desde = referencia.replace(day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=ZONA_NEGOCIO)
+        condiciones.append("recibido_en >= %s"); parametros.append(desde)
+    clave = (" AND ".join(condiciones), tuple(parametros))
+    guardado = _totales.get(clave)
+    if guardado and time.monotonic() - guardado[0] < TOTALES_TTL: return guardado[1], desde
+    cursor.execute(SQL_TOTALES + " WHERE " + " AND ".join(condiciones) + " GROUP BY moneda", parametros)
+    sumas = {MONEDAS_TOTALES.get(moneda): total for moneda, total in cursor.fetchall()}
+    if len(_totales) > 256: _totales.clear()
+    _totales[clave] = (time.monotonic(), sumas)
+    return sumas, desde
 
 @app.route('/admin')
 def admin():
     if not session.get('logged_in'): return redirect(url_for('login'))
-    conn = get_db_connection(); cursor = conn.cursor()
-    cursor.execute("SELECT * FROM pagos ORDER BY id DESC")
-    pagos = cursor.fetchall()
-    t_bs, t_usd, t_cop = 0.0, 0.0, 0.0
-    for p in pagos:
-        try:
-            m, b = str(p[4]), p[9]
-            if b == 'BINANCE': t_usd += float(m)
-            elif b in ['NEQUI','BANCOLOMBIA']: t_cop += float(m.replace('.',''))
-            else: t_bs += float(m.replace('.','').replace(',','.'))
-        except: continue
-    totales = {"bs": f"{t_bs:,.2f}", "usd": f"{t_usd:,.2f}", "cop": f"{t_cop:,.0f}"}
-    conn.close(); return render_template_string(HTML_ADMIN, pagos=pagos, totales=totales, logo_url=url_for('static', filename='logo.png'))
+    condiciones, parametros = filtros_admin(request.args, comercio_actual())
+    # Paginación por keyset sobre id: ?antes=<id> avanza, ?despues=<id> retrocede
+    pagina, orden = list(condiciones), "DESC"
+    antes, despues = request.args.get('antes', type=int), request.args.get('despues', type=int)
+    if antes: pagina.append("id < %s")
+    elif despues: pagina.append("id > %s"); orden = "ASC"
+    cursor_id = [antes or despues] if (antes or despues) else []
+    with conexion_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {COLUMNAS_ADMIN} FROM pagos WHERE " + " AND ".join(pagina)
+                       + f" ORDER BY id {orden} LIMIT %s", parametros + cursor_id + [ADMIN_PAGINA + 1])
+        pagos = cursor.fetchall()
+        sumas, desde = totales_admin(cursor, condiciones, parametros, request.args)
+    hay_mas = len(pagos) > ADMIN_PAGINA
+    pagos = pagos[:ADMIN_PAGINA]
+    if orden == "ASC": pagos.reverse()
+    filtros = {k: v for k, v in request.args.items() if k in ('q', 'banco', 'desde', 'hasta', 'alertas') and v}
+    paginacion = {
+        "siguiente": url_for('admin', antes=pagos[-1][0], **filtros) if pagos and (hay_mas or orden == "ASC") else None,
+        "anterior": url_for('admin', despues=pagos[0][0], **filtros) if pagos and (antes or (despues and hay_mas)) else None,
+    }
+    totales = {"bs": f"{sumas.get('bs', 0):,.2f}", "usd": f"{sumas.get('usd', 0):,.2f}", "cop": f"{sumas.get('cop', 0):,.0f}",
+               "desde": desde.strftime("%d/%m/%Y")}
+    return render_template('admin.html', pagos=pagos, totales=totales, filtros=filtros, paginacion=paginacion,
+                                  bancos=[b[0] for b in MOTOR.bancos], logo_url=url_for('static', filename='logo.png'))
+
+RESULTADOS_VERIFICACION = {
+    "NO_ENCONTRADO": {"clase": "danger", "mensaje": "❌ NO ENCONTRADO"},
+    "CANJEADO": {"clase": "warning", "mensaje": "⚠️ YA CANJEADO"},
+    "VALIDO": {"clase": "success", "mensaje": "✅ VÁLIDO"},
+}
 
 @app.route('/verificar', methods=['POST'])
 def verificar():
     ref = request.form.get('ref', '').strip()
-    conn = get_db_connection(); cursor = conn.cursor()
-    cursor.execute("SELECT id, emisor, monto, estado, referencia FROM pagos WHERE referencia LIKE %s LIMIT 1", ('%' + ref,))
-    pago = cursor.fetchone()
-    if not pago: res = {"clase": "danger", "mensaje": "❌ NO ENCONTRADO"}
-    elif pago[3] == 'CANJEADO': res = {"clase": "warning", "mensaje": "⚠️ YA CANJEADO", "datos": pago[1:]}
+    # La caché responde "no encontrado" / "ya canjeado"; el canje siempre pasa por la base de datos
+    comercio_id = comercio_actual()
+    respuesta = CACHE.consultar(ref, comercio_id)
+    if respuesta: (estado, datos), origen = respuesta, "cache"
     else:
-        cursor.execute("UPDATE pagos SET estado = 'CANJEADO', fecha_canje = %s WHERE id = %s", (datetime.now().strftime("%d/%m %H:%M"), pago[0]))
-        conn.commit(); res = {"clase": "success", "mensaje": "✅ VÁLIDO", "datos": pago[1:]}
-    conn.close(); return render_template_string(HTML_PORTAL, resultado=res, logo_url=url_for('static', filename='logo.png'))
+        generacion, origen = CACHE.generacion, "db"
+        with conexion_db() as conn:
+            estado, datos = canjear_referencia(conn, ref, comercio_id)
+        if estado == "NO_ENCONTRADO": CACHE.recordar_ausente(ref, generacion, comercio_id)
+    VERIFICACIONES.sumar(estado, origen)
+    res = RESULTADOS_VERIFICACION[estado].copy()
+    if datos: res["datos"] = datos
+    return render_template('portal.html', resultado=res, logo_url=url_for('static', filename='logo.png'))
 
 @app.route('/admin/liberar', methods=['POST'])
 def liberar():
-    if session.get('logged_in') and request.form.get('pw') == os.getenv("ADMIN_PASSWORD"):
-        conn = get_db_connection(); cursor = conn.cursor()
-        cursor.execute("UPDATE pagos SET estado = 'LIBRE', fecha_canje = NULL WHERE referencia = %s", (request.form.get('ref'),))
-        conn.commit(); conn.close()
+    if session.get('logged_in') and clave_valida(comercio_actual(), request.form.get('pw')):
+        with conexion_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE pagos SET estado = 'LIBRE', fecha_canje = NULL WHERE comercio_id = %s AND referencia = %s",
+                           (comercio_actual(), request.form.get('ref')))
+            conn.commit()
     return redirect(url_for('admin'))
 
+# --- EXPORTACIÓN EN STREAMING (cursor del lado del servidor, memoria constante) ---
+EXPORT_LOTE = int(os.getenv("EXPORT_LOTE", "2000"))
+COLUMNAS_EXPORT = ['Fecha', 'Hora', 'Banco', 'Emisor', 'Monto', 'Moneda', 'Ref', 'Estado']
+SQL_EXPORT = ("SELECT fecha_recepcion, hora_recepcion, banco, emisor, COALESCE(monto_num::text, monto), moneda, referencia, estado "
+              "FROM pagos")
+
+def filas_exportacion(condiciones, parametros):
+    # Un cursor con nombre trae las filas de EXPORT_LOTE en EXPORT_LOTE en vez de hacer fetchall()
+    with conexion_db() as conn:
+        cursor = conn.cursor(name="exportar_pagos")
+        cursor.itersize = EXPORT_LOTE
+        cursor.execute(SQL_EXPORT + " WHERE " + " AND ".join(condiciones) + " ORDER BY id", parametros)
+        for fila in cursor: yield fila
+        cursor.close()
+
+def generar_csv(filas):
+    # Separador ';' y BOM UTF-8 para que Excel en español lo abra con acentos y columnas correctas
+    inicio, total = time.perf_counter(), 0
+    buffer = StringIO(); escritor = csv.writer(buffer, delimiter=';')
+    buffer.write('\ufeff'); escritor.writerow(COLUMNAS_EXPORT)
+    for i, fila in enumerate(filas, 1):
+        escritor.writerow(fila)
+        if i % EXPORT_LOTE == 0:
+            parte = buffer.getvalue().encode(); total += len(parte)
+            yield parte; buffer.seek(0); buffer.truncate()
+    parte = buffer.getvalue().encode(); total += len(parte)
+    yield parte
+    # Solo se registra si la descarga terminó (el cliente no la canceló a medias)
+    EXPORTACION_DURACION.observar(time.perf_counter() - inicio, "csv"); EXPORTACION_BYTES.observar(total, "csv")
+
 @app.route('/admin/exportar')
 def exportar():
     if not session.get('logged_in'): return redirect(url_for('login'))
-    conn = get_db_connection(); cursor = conn.cursor()
-    cursor.execute("SELECT fecha_recepcion, banco, emisor, monto, referencia, estado FROM pagos")
-    df = pd.DataFrame(cursor.fetchall(), columns=['Fecha', 'Banco', 'Emisor', 'Monto', 'Ref', 'Estado'])
-    out = BytesIO()
-    with pd.ExcelWriter(out, engine='openpyxl') as writer: df.to_excel(writer, index=False)
-    out.seek(0); conn.close()
-    return send_file(out, as_attachment=True, download_name="Reporte_Pagos.xlsx")
+    condiciones, parametros = filtros_admin(request.args, comercio_actual())
+    filas = filas_exportacion(condiciones, parametros)
+    nombre = f"Reporte_Pagos_{datetime.now(ZONA_NEGOCIO).strftime('%Y-%m-%d')}"
+    if request.args.get('formato') == 'csv':
+        return Response(stream_with_context(generar_csv(filas)), mimetype='text/csv',
+                        headers={"Content-Disposition": f"attachment; filename={nombre}.csv"})
+    # Excel: openpyxl en modo write_only escribe fila a fila a un archivo temporal
+    from openpyxl import Workbook
+    inicio = time.perf_counter()
+    libro = Workbook(write_only=True); hoja = libro.create_sheet("Pagos")
+    hoja.append(COLUMNAS_EXPORT)
+    for fila in filas:
+        fila = list(fila)
+        try: fila[4] = float(fila[4])
+        except (TypeError, ValueError): pass
+        hoja.append(fila)
+    archivo = tempfile.TemporaryFile()
+    libro.save(archivo)
+    EXPORTACION_DURACION.observar(time.perf_counter() - inicio, "xlsx"); EXPORTACION_BYTES.observar(archivo.tell(), "xlsx")
+    archivo.seek(0)
+    return send_file(archivo, as_attachment=True, download_name=f"{nombre}.xlsx",
+                     mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+def token_webhook():
+    # Devuelve (token_hash, error). El comercio se reconoce por su token: cabecera X-Token o ?token=
+    # Aquí no se consulta Postgres: solo se rechaza un token que la caché ya sabe inválido. El resto se
+    # encola con su hash y la cola descarta al drenar los que no son de ningún comercio activo.
+    token = request.headers.get('X-Token') or request.args.get('token', '')
+    if not token: return ("", None) if not TOKEN_OBLIGATORIO else (None, "Falta el token del comercio")
+    token_hash = hash_token(token)
+    if token_rechazado(token_hash): return None, "Token inválido"
+    return token_hash, None
 
 @app.route('/webhook-bdv', methods=['POST'])
 def webhook():
+    token_hash, error = token_webhook()
+    if error: return error, 401
     try:
         raw_data = request.get_json(silent=True) or {"mensaje": request.get_data(as_text=True)}
         texto_recibido = str(raw_data.get('mensaje', ''))
-        lista_pagos = extractor_inteligente(texto_recibido)
-        conn = get_db_connection(); cursor = conn.cursor()
-        for p in lista_pagos:
-            cursor.execute("SELECT 1 FROM pagos WHERE referencia = %s", (p['referencia'],))
-            if not cursor.fetchone():
-                cursor.execute("INSERT INTO pagos (fecha_recepcion, hora_recepcion, emisor, monto, referencia, banco) VALUES (%s, %s, %s, %s, %s, %s)", 
-                               (datetime.now().strftime("%d/%m/%Y"), datetime.now().strftime("%I:%M %p"), p['emisor'], p['monto'], p['referencia'], p['banco']))
-        conn.commit(); conn.close(); return "OK", 200
+        if INGESTA_COLA:
+            try:
+                # Se anota en la cola local y se responde sin esperar a Postgres
+                encolar([texto_recibido], token_hash)
+                if COLA_WORKER == "proceso": asegurar_worker()
+                return "OK", 200
+            except sqlite3.Error: pass  # Sin cola disponible se guarda directo
+        lista_pagos, _ = extraer_lote([texto_recibido])
+        if lista_pagos:
+            comercio_id = comercio_de_hash(token_hash)
+            if comercio_id is None: return "Token inválido", 401
+            with conexion_db() as conn:
+                guardar_pagos(conn, lista_pagos, comercio_id); conn.commit()
+        return "OK", 200
     except Exception as e: return str(e), 200
 
+@app.route('/webhook-bdv/lote', methods=['POST'])
+def webhook_lote():
+    # Recibe de una vez la cola de notificaciones que el teléfono acumuló sin conexión
+    token_hash, error = token_webhook()
+    if error: return jsonify(error=error), 401
+    mensajes = leer_mensajes(request.get_data(as_text=True), request.content_type or "")
+    if len(mensajes) > LOTE_MAX: return jsonify(error=f"Máximo {LOTE_MAX} mensajes por lote"), 413
+    lista_pagos, repetidos_lote = extraer_lote(mensajes)
+    try:
+        insertados = 0
+        if lista_pagos:
+            comercio_id = comercio_de_hash(token_hash)
+            if comercio_id is None: return jsonify(error="Token inválido"), 401
+            with conexion_db() as conn:
+                insertados = guardar_pagos(conn, lista_pagos, comercio_id); conn.commit()
+    except Exception as e:
+        # Si Postgres no responde el lote queda en la cola local para no perder ningún pago
+        if not INGESTA_COLA: return jsonify(error=str(e)), 500
+        encolar(mensajes, token_hash)
+        if COLA_WORKER == "proceso": asegurar_worker()
+        return jsonify(mensajes=len(mensajes), encolados=len(mensajes), error=str(e)), 202
+    return jsonify(mensajes=len(mensajes), pagos=len(lista_pagos), insertados=insertados,
+                   duplicados=len(lista_pagos) - insertados + repetidos_lote), 200
+
+@app.route('/admin/estadisticas')
+def estadisticas():
+    if not session.get('logged_in'): return redirect(url_for('login'))
+    return jsonify(pool=POOL.estadisticas(), cola_pendientes=pendientes(), cola_fallidos=fallidos(), cache=CACHE.estadisticas())
+
 @app.route('/logout')
 def logout(): session.clear(); return redirect(url_for('login'))
 
@@ -0,0 +1,110 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# --- MÉTRICAS EN FORMATO PROMETHEUS ---
+# Contadores e histogramas en memoria, sin dependencias. Registrar un valor es tomar un lock y
+# sumar en un dict, así que puede quedar encendido en producción. Cada proceso (worker de
+# gunicorn) lleva sus propias cifras; la etiqueta "proceso" permite sumarlas en Prometheus.
+BUCKETS_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_BYTES = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+def _etiquetas(nombres, valores):
+    pares = ",".join('{}="{}"'.format(n, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                     for n, v in zip(nombres, valores))
+    return "{" + pares + "}"
+
+class Contador:
+    tipo = "counter"
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, tuple(etiquetas)
+        self._valores, self._lock = {}, threading.Lock()
+
+    def sumar(self, *valores, cantidad=1):
+        with self._lock: self._valores[valores] = self._valores.get(valores, 0) + cantidad
+
+    def lineas(self, proceso):
+        with self._lock: valores = dict(self._valores)
+        nombres = ("proceso",) + self.etiquetas
+        return [f"{self.nombre}{_etiquetas(nombres, (proceso,) + k)} {v}" for k, v in sorted(valores.items())]
+
+class Histograma:
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_LATENCIA):
+        self.nombre, self.ayuda, self.etiquetas, self.buckets = nombre, ayuda, tuple(etiquetas), tuple(buckets)
+        self._valores, self._lock = {}, threading.Lock()  # etiquetas -> [conteo por bucket..., suma, total]
+
+    def observar(self, valor, *valores):
+        i = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._valores.get(valores)
+            if serie is None: serie = self._valores[valores] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            serie[i] += 1; serie[-2] += valor; serie[-1] += 1
+
+    def lineas(self, proceso):
+        with self._lock: valores = {k: list(v) for k, v in self._valores.items()}
+        nombres, salida = ("proceso",) + self.etiquetas, []
+        for k, serie in sorted(valores.items()):
+            k, acumulado = (proceso,) + k, 0
+            for limite, n in zip(self.buckets + ("+Inf",), serie):
+                acumulado += n
+                salida.append(f"{self.nombre}_bucket{_etiquetas(nombres + ('le',), k + (limite,))} {acumulado}")
+            salida.append(f"{self.nombre}_sum{_etiquetas(nombres, k)} {serie[-2]:.6f}")
+            salida.append(f"{self.nombre}_count{_etiquetas(nombres, k)} {serie[-1]}")
+        return salida
+
+class Registro:
+    def __init__(self):
+        self.metricas, self.indicadores = [], []  # indicadores: funciones que devuelven [(nombre, ayuda, valor)]
+
+    def registrar(self, metrica):
+        self.metricas.append(metrica); return metrica
+
+    def indicador(self, funcion):
+        self.indicadores.append(funcion); return funcion
+
+    def exponer(self):
+        proceso, salida = os.getpid(), []
+        for m in self.metricas:
+            salida += [f"# HELP {m.nombre} {m.ayuda}", f"# TYPE {m.nombre} {m.tipo}"] + m.lineas(proceso)
+        for funcion in self.indicadores:
+            try: valores = funcion()
+            except Exception: continue
+            for nombre, ayuda, valor in valores:
+                salida += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} gauge", f"{nombre}{_etiquetas(('proceso',), (proceso,))} {valor}"]
+        return "\n".join(salida) + "\n"
+
+REGISTRO = Registro()
+
+# --- MÉTRICAS DE LA APLICACIÓN ---
+HTTP_DURACION = REGISTRO.registrar(Histograma(
+    "notipagos_http_duracion_segundos", "Latencia de las peticiones por ruta", ("ruta", "metodo", "codigo")))
+DB_CONEXION = REGISTRO.registrar(Histograma(
+    "notipagos_db_conexion_segundos", "Tiempo en abrir una conexión nueva a Postgres"))
+DB_CONSULTA = REGISTRO.registrar(Histograma(
+    "notipagos_db_consulta_segundos", "Tiempo de cada consulta (execute) contra Postgres"))
+EXTRACCION = REGISTRO.registrar(Histograma(
+    "notipagos_extraccion_segundos", "Tiempo de extracción por mensaje según el banco detectado", ("banco",),
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005)))
+MENSAJES = REGISTRO.registrar(Contador(
+    "notipagos_mensajes_total", "Mensajes de webhook procesados según resultado (ok, sin_banco, sin_referencia)", ("resultado",)))
+DUPLICADAS = REGISTRO.registrar(Contador(
+    "notipagos_referencias_duplicadas_total", "Referencias ya vistas (en el mismo lote o en la base de datos)", ("origen",)))
+ALERTAS = REGISTRO.registrar(Contador(
+    "notipagos_alertas_total", "Pagos marcados por huellas.py (DUPLICADO: otra referencia del mismo pago, REPETIDO: mismo emisor y monto)", ("tipo",)))
+VERIFICACIONES = REGISTRO.registrar(Contador(
+    "notipagos_verificaciones_total", "Resultados de /verificar y quién respondió (cache o db)", ("resultado", "origen")))
+EXPORTACION_DURACION = REGISTRO.registrar(Histograma(
+    "notipagos_exportacion_segundos", "Duración completa de cada exportación", ("formato",)))
+EXPORTACION_BYTES = REGISTRO.registrar(Histograma(
+    "notipagos_exportacion_bytes", "Tamaño de cada exportación", ("formato",), buckets=BUCKETS_BYTES))
+
+@contextmanager
+def cronometro(histograma, *etiquetas):
+    inicio = time.perf_counter()
+    try: yield
+    finally: histograma.observar(time.perf_counter() - inicio, *etiquetas)
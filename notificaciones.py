@@ -0,0 +1,82 @@
+import json
+import os
+import select
+import threading
+import time
+
+import psycopg2
+
+from pool_db import parametros_conexion
+
+# --- ESCUCHA DE LISTEN/NOTIFY ---
+# Un hilo por proceso mantiene una conexión dedicada con LISTEN y reparte cada evento del trigger
+# pagos_notificar (ver esquema.py) a los suscriptores. Al conectar o perder la conexión emite los
+# eventos sintéticos CONECTADO / DESCONECTADO para que quien cachea sepa que pudo perder avisos.
+CANAL = "pagos_cambios"
+
+def parametros_escucha():
+    # LISTEN no funciona a través del pooler de Neon (PgBouncer en modo transacción): se usa el
+    # endpoint directo, o DB_HOST_LISTEN si se define
+    parametros = parametros_conexion()
+    host = os.getenv("DB_HOST_LISTEN") or (parametros["host"] or "").replace("-pooler.", ".")
+    parametros["host"] = host or parametros["host"]
+    return parametros
+
+class Escucha:
+    def __init__(self, canal=CANAL):
+        self.canal = canal
+        self.conectado = False
+        self._suscriptores = []
+        self._lock = threading.Lock()
+        self._pid, self._hilo = None, None
+
+    def suscribir(self, funcion):
+        with self._lock: self._suscriptores.append(funcion)
+
+    def desuscribir(self, funcion):
+        with self._lock:
+            if funcion in self._suscriptores: self._suscriptores.remove(funcion)
+
+    def asegurar(self):
+        if self._pid == os.getpid() and self._hilo.is_alive(): return
+        with self._lock:
+            if self._pid == os.getpid() and self._hilo.is_alive(): return
+            self.conectado = False
+            self._hilo = threading.Thread(target=self._bucle, name="escucha-notify", daemon=True)
+            self._pid = os.getpid(); self._hilo.start()
+
+    def _emitir(self, evento):
+        with self._lock: suscriptores = list(self._suscriptores)
+        for funcion in suscriptores:
+            try: funcion(evento)
+            except Exception as e: print(f"⚠️ Suscriptor de {self.canal}: {e}")
+
+    def _bucle(self):
+        espera = 1
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**parametros_escucha())
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {self.canal}")
+                self.conectado, espera = True, 1
+                self._emitir({"op": "CONECTADO"})
+                while True:
+                    if select.select([conn], [], [], 30) == ([], [], []):
+                        conn.cursor().execute("SELECT 1")  # Detecta conexiones muertas en silencio
+                    conn.poll()
+                    while conn.notifies:
+                        aviso = conn.notifies.pop(0)
+                        try: self._emitir(json.loads(aviso.payload))
+                        except ValueError: continue
+            except Exception as e:
+                if self.conectado: print(f"⚠️ Escucha {self.canal} desconectada: {e}")
+                self.conectado = False
+                self._emitir({"op": "DESCONECTADO"})
+            finally:
+                if conn is not None:
+                    try: conn.close()
+                    except psycopg2.Error: pass
+            time.sleep(espera); espera = min(espera * 2, 60)
+
+ESCUCHA = Escucha()
@@ -0,0 +1,139 @@
+import argparse
+import os
+import re
+from datetime import date, datetime
+
+import psycopg2
+from psycopg2 import errors
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+from pool_db import parametros_conexion
+from ingesta import ZONA_NEGOCIO
+
+# --- PARTICIONES MENSUALES Y ARCHIVO ---
+# Cada comercio (pagos_c<id>) está particionado por mes de recibido_en: pagos_c<id>_AAAA_MM.
+# Lo que ya existía al migrar quedó en pagos_c<id>_historico (desde siempre hasta el mes de la
+# migración). `mantener` crea por adelantado las particiones de los próximos meses y `archivar`
+# separa las que quedaron atrás, las guarda comprimidas en un CSV que backup.py sabe restaurar y
+# las elimina. Uso: python particiones.py mantener | archivar --meses 6 [--conservar]
+MESES_ADELANTE = 3
+ARCHIVO_DIR = os.getenv("ARCHIVO_DIR", "archivo")
+ARCHIVO_MESES = int(os.getenv("ARCHIVO_MESES", "12"))
+RE_HASTA = re.compile(r"TO \('([^']+)'\)")
+
+def sumar_meses(mes, n):
+    total = mes.year * 12 + mes.month - 1 + n
+    return date(total // 12, total % 12 + 1, 1)
+
+def crear_mes(cursor, comercio_id, mes):
+    # Crea pagos_c<id>_AAAA_MM si falta. Un mes que ya cubre el histórico se deja como está.
+    nombre = f"pagos_c{comercio_id}_{mes:%Y_%m}"
+    cursor.execute("SELECT to_regclass(%s)", (nombre,))
+    if cursor.fetchone()[0]: return False
+    cursor.execute("SAVEPOINT crear_mes")
+    try:
+        cursor.execute(f"CREATE TABLE {nombre} PARTITION OF pagos_c{comercio_id} FOR VALUES FROM (%s) TO (%s)",
+                       (datetime.combine(mes, datetime.min.time(), ZONA_NEGOCIO),
+                        datetime.combine(sumar_meses(mes, 1), datetime.min.time(), ZONA_NEGOCIO)))
+    except errors.InvalidObjectDefinition:  # Se solapa con pagos_c<id>_historico
+        cursor.execute("ROLLBACK TO SAVEPOINT crear_mes"); return False
+    cursor.execute("RELEASE SAVEPOINT crear_mes")
+    return True
+
+def asegurar(conn, meses_adelante=MESES_ADELANTE):
+    # Mes actual y los siguientes para todos los comercios; idempotente
+    conn.autocommit = False  # Los SAVEPOINT de crear_mes necesitan una transacción (migrar la deja en autocommit)
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM comercios ORDER BY id")
+    hoy, creadas = datetime.now(ZONA_NEGOCIO).date().replace(day=1), 0
+    for (comercio_id,) in cursor.fetchall():
+        for n in range(meses_adelante + 1): creadas += crear_mes(cursor, comercio_id, sumar_meses(hoy, n))
+    conn.commit()
+    return creadas
+
+def asegurar_para(cursor, tabla):
+    # Antes de restaurar: particiones de todos los meses presentes en `tabla` (comercio_id, recibido_en)
+    cursor.execute(f"SELECT DISTINCT comercio_id, (date_trunc('month', recibido_en AT TIME ZONE %s))::date FROM {tabla}",
+                   (str(ZONA_NEGOCIO),))
+    for comercio_id, mes in cursor.fetchall(): crear_mes(cursor, comercio_id, mes)
+
+def vencidas(cursor, meses):
+    # [(padre, particion, limites, pendiente)] de los meses completos anteriores al corte, el histórico
+    # incluido. `limites` es el FOR VALUES con el que se vuelve a adjuntar; `pendiente`, un DETACH a medias.
+    corte = datetime.combine(sumar_meses(datetime.now(ZONA_NEGOCIO).date().replace(day=1), -meses), datetime.min.time(), ZONA_NEGOCIO)
+    cursor.execute("""SELECT i.inhparent::regclass::text, hija.relname, pg_get_expr(hija.relpartbound, hija.oid), i.inhdetachpending
+                      FROM pg_inherits i JOIN pg_class hija ON hija.oid = i.inhrelid
+                      JOIN pg_inherits c ON c.inhrelid = i.inhparent
+                      WHERE c.inhparent = 'pagos'::regclass ORDER BY hija.relname""")
+    salida = []
+    for padre, nombre, limites, pendiente in cursor.fetchall():
+        m = RE_HASTA.search(limites or "")
+        if not m: continue
+        cursor.execute("SELECT %s::timestamptz <= %s", (m.group(1), corte))
+        if cursor.fetchone()[0]: salida.append((padre, nombre, limites, pendiente))
+    return salida
+
+def separadas(cursor):
+    # Meses o históricos que ya no están adjuntos a pagos (--conservar, o un archivado de antes que falló):
+    # no se ven en /admin, /verificar ni los respaldos, y vencidas() ya no los encuentra
+    cursor.execute(r"""SELECT relname FROM pg_class WHERE relkind IN ('r', 'p') AND NOT relispartition
+                       AND relname ~ '^pagos_c\d+_(\d{4}_\d{2}|historico)$' ORDER BY relname""")
+    return [f[0] for f in cursor.fetchall()]
+
+def archivar(conn, meses=ARCHIVO_MESES, conservar=False):
+    # Vuelca cada partición vencida con COPY a ARCHIVO_DIR/<particion>.csv.gz mientras sigue adjunta y,
+    # si el archivo tiene todas sus filas, la separa (DETACH ... CONCURRENTLY, sin bloquear inserciones)
+    # y la elimina. Si algo falla antes, el mes sigue en pagos como si nada.
+    # pagos_referencias no se toca: una referencia archivada sigue contando como duplicada.
+    from backup import COLUMNAS, abrir
+    os.makedirs(ARCHIVO_DIR, exist_ok=True)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    for nombre in separadas(cursor):
+        print(f"⚠️ {nombre} está separada de pagos: borrarla si ya está archivada, o volver a adjuntarla")
+    for padre, nombre, limites, pendiente in vencidas(cursor, meses):
+        print(f"📦 {nombre} ({limites})...")
+        if pendiente:
+            # Un DETACH CONCURRENTLY interrumpido la deja a medio separar: se completa y se vuelve a adjuntar
+            cursor.execute(f"ALTER TABLE {padre} DETACH PARTITION {nombre} FINALIZE")
+            cursor.execute(f"ALTER TABLE {padre} ATTACH PARTITION {nombre} {limites}")
+        archivo = os.path.join(ARCHIVO_DIR, f"{nombre}.csv.gz")
+        try:
+            with abrir(archivo, "w") as f:
+                cursor.copy_expert(f"COPY (SELECT {', '.join(COLUMNAS)} FROM {nombre} ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER)", f)
+            escritas = cursor.rowcount
+            cursor.execute(f"SELECT count(*) FROM {nombre}")
+            completo = cursor.fetchone()[0] == escritas
+        except (psycopg2.Error, OSError) as e:
+            print(f"❌ {nombre}: {e}"); completo = False
+        if not completo:
+            if os.path.exists(archivo): os.remove(archivo)
+            print(f"❌ {nombre} no se pudo archivar completa; sigue adjunta"); continue
+        cursor.execute(f"ALTER TABLE {padre} DETACH PARTITION {nombre} CONCURRENTLY")
+        # Lo que entró entre el COPY y el DETACH (una restauración, una fecha vieja) no está en el archivo
+        cursor.execute(f"SELECT count(*) FROM {nombre}")
+        if cursor.fetchone()[0] != escritas:
+            cursor.execute(f"ALTER TABLE {padre} ATTACH PARTITION {nombre} {limites}")
+            os.remove(archivo)
+            print(f"❌ {nombre} cambió mientras se archivaba; sigue adjunta, volver a intentarlo"); continue
+        if not conservar: cursor.execute(f"DROP TABLE {nombre}")
+        print(f"✅ {escritas:,} pagos en {archivo}" + (" (tabla separada conservada)" if conservar else ""))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Particiones mensuales de pagos y archivo de meses antiguos")
+    sub = parser.add_subparsers(dest="orden", required=True)
+    p = sub.add_parser("mantener", help="Crea las particiones del mes actual y los próximos")
+    p.add_argument("--meses", type=int, default=MESES_ADELANTE)
+    p = sub.add_parser("archivar", help="Archiva y elimina las particiones anteriores a --meses")
+    p.add_argument("--meses", type=int, default=ARCHIVO_MESES, help=f"Meses completos que se conservan (por defecto {ARCHIVO_MESES})")
+    p.add_argument("--conservar", action="store_true", help="Separa y archiva, pero no elimina la tabla")
+    args = parser.parse_args()
+    conn = psycopg2.connect(**parametros_conexion())
+    try:
+        if args.orden == "mantener": print(f"✅ {asegurar(conn, args.meses)} partición(es) nueva(s)")
+        else: archivar(conn, args.meses, args.conservar)
+    except psycopg2.Error as e:
+        print(f"❌ {e}")
+    finally: conn.close()
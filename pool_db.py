@@ -0,0 +1,200 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+from dotenv import load_dotenv
+
+from metricas import DB_CONEXION, DB_CONSULTA, cronometro
+
+load_dotenv(override=True)
+
+# --- PARÁMETROS DE CONEXIÓN ---
+def parametros_conexion():
+    host = os.getenv("DB_HOST") or ""
+    return dict(
+        host=os.getenv("DB_HOST"),
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASS"),
+        port=os.getenv("DB_PORT", "5432"),
+        sslmode="require" if "neon.tech" in host else "disable",
+        # Sin tope, un Postgres que no contesta deja al hilo colgado en connect() el tiempo del TCP del sistema
+        connect_timeout=int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+    )
+
+class PoolAgotado(PoolError):
+    pass
+
+class CursorMedido(extensions.cursor):
+    # Cada execute del pool queda en el histograma de tiempo de consulta (también execute_values)
+    def execute(self, consulta, parametros=None):
+        with cronometro(DB_CONSULTA): return super().execute(consulta, parametros)
+
+    def executemany(self, consulta, parametros):
+        with cronometro(DB_CONSULTA): return super().executemany(consulta, parametros)
+
+# --- POOL DE CONEXIONES (Seguro para hilos y workers de gunicorn) ---
+class PoolConexiones:
+    def __init__(self, minimo=1, maximo=10, espera_max=10.0, verificar_tras=30.0, vida_max=1800.0, inactiva_max=300.0):
+        self.minimo, self.maximo = max(0, minimo), max(1, maximo, minimo)
+        self.espera_max = espera_max          # Segundos máximos esperando una conexión libre
+        self.verificar_tras = verificar_tras  # Inactividad (s) tras la cual se hace ping al tomarla
+        self.vida_max = vida_max              # Edad (s) a partir de la cual se recicla
+        self.inactiva_max = inactiva_max      # Por encima del mínimo, las libres ociosas más de esto se cierran
+        self._cond = threading.Condition()
+        self._reiniciar()
+
+    def _reiniciar(self):
+        # Tras un fork (gunicorn --preload) las conexiones del padre no se tocan: cerrarlas
+        # enviaría el cierre por un socket compartido. Se guardan para que no las libere el GC.
+        self._heredadas = getattr(self, "_libres", []) + list(getattr(self, "_prestadas", {}).values())
+        self._pid = os.getpid()
+        self._libres = []     # [(conn, creada, ultimo_uso)]
+        self._prestadas = {}  # id(conn) -> (conn, creada)
+        self._abriendo = 0    # Cupos reservados mientras se conecta o se revisa una conexión fuera del lock
+        self._precalentado = False
+        self._stats = {"creadas": 0, "recicladas": 0, "descartadas": 0, "prestamos": 0,
+                       "esperas": 0, "agotado": 0, "espera_total_ms": 0.0, "espera_max_ms": 0.0}
+
+    def _abrir(self):
+        with cronometro(DB_CONEXION): conn = psycopg2.connect(cursor_factory=CursorMedido, **parametros_conexion())
+        with self._cond: self._stats["creadas"] += 1
+        return conn, time.monotonic()
+
+    def _sana(self, conn, creada, ultimo_uso):
+        ahora = time.monotonic()
+        if conn.closed or ahora - creada > self.vida_max: return False
+        if ahora - ultimo_uso < self.verificar_tras: return True
+        try:
+            cur = conn.cursor(); cur.execute("SELECT 1"); cur.close(); conn.rollback()
+            return True
+        except psycopg2.Error: return False
+
+    def _cerrar(self, conn):
+        try: conn.close()
+        except psycopg2.Error: pass
+
+    def tomar(self):
+        inicio = time.monotonic(); espero = False
+        with self._cond:
+            if self._pid != os.getpid(): self._reiniciar()
+            while True:
+                # Tanto la libre que se revisa como la que se abre ocupan cupo hasta quedar prestadas
+                if self._libres:
+                    conn, creada, ultimo_uso = self._libres.pop(); self._abriendo += 1
+                    break
+                if len(self._prestadas) + self._abriendo < self.maximo:
+                    conn = None; self._abriendo += 1
+                    break
+                espero = True
+                restante = self.espera_max - (time.monotonic() - inicio)
+                if restante <= 0:
+                    self._stats["agotado"] += 1
+                    raise PoolAgotado(f"Pool agotado: {self.maximo} conexiones en uso")
+                self._cond.wait(restante)
+
+        if conn is None or not self._sana(conn, creada, ultimo_uso):
+            if conn is not None:
+                with self._cond: self._stats["recicladas"] += 1
+                self._cerrar(conn)
+            try: conn, creada = self._abrir()
+            except BaseException:
+                with self._cond:
+                    self._abriendo -= 1; self._cond.notify()
+                raise
+
+        espera_ms = (time.monotonic() - inicio) * 1000
+        with self._cond:
+            self._abriendo -= 1
+            self._prestadas[id(conn)] = (conn, creada)
+            self._stats["prestamos"] += 1
+            self._stats["esperas"] += espero
+            self._stats["espera_total_ms"] += espera_ms
+            self._stats["espera_max_ms"] = max(self._stats["espera_max_ms"], espera_ms)
+        return conn
+
+    def devolver(self, conn, descartar=False):
+        # Una conexión rota o a mitad de transacción fallida no vuelve al pool
+        if not descartar and not conn.closed:
+            try:
+                estado = conn.info.transaction_status
+                if estado == extensions.TRANSACTION_STATUS_UNKNOWN: descartar = True
+                elif estado != extensions.TRANSACTION_STATUS_IDLE: conn.rollback()
+            except psycopg2.Error: descartar = True
+        with self._cond:
+            if self._pid != os.getpid(): return
+            conn_creada = self._prestadas.pop(id(conn), None)
+            if conn_creada is None: return
+            cerrar = []
+            if descartar or conn.closed or len(self._libres) >= self.maximo:
+                self._stats["descartadas"] += 1; cerrar.append(conn)
+            else:
+                self._libres.append((conn, conn_creada[1], time.monotonic()))
+            # Las más antiguas están al principio de la lista (se presta desde el final)
+            limite = time.monotonic() - self.inactiva_max
+            while len(self._libres) > self.minimo and self._libres[0][2] < limite:
+                cerrar.append(self._libres.pop(0)[0]); self._stats["descartadas"] += 1
+            self._cond.notify()
+        for c in cerrar: self._cerrar(c)
+
+    @contextmanager
+    def conexion(self):
+        conn = self.tomar()
+        try:
+            yield conn
+        except psycopg2.OperationalError:
+            self.devolver(conn, descartar=True); conn = None
+            raise
+        finally:
+            if conn is not None: self.devolver(conn)
+
+    def precalentar(self):
+        # Abre en segundo plano las `minimo` conexiones una vez por proceso (cada worker de gunicorn),
+        # para que la primera petición no pague la conexión a Neon. Si Postgres no responde, se
+        # abrirán al pedirlas.
+        with self._cond:
+            if self._pid != os.getpid(): self._reiniciar()
+            if self._precalentado: return
+            self._precalentado = True
+        def abrir():
+            for _ in range(self.minimo):
+                with self._cond:
+                    if len(self._libres) + len(self._prestadas) + self._abriendo >= self.minimo: return
+                    self._abriendo += 1
+                try: conn, creada = self._abrir()
+                except psycopg2.Error: conn = None
+                with self._cond:
+                    self._abriendo -= 1
+                    if conn is not None: self._libres.insert(0, (conn, creada, time.monotonic()))
+                    self._cond.notify()
+                if conn is None: return
+        threading.Thread(target=abrir, name="pool-precalentar", daemon=True).start()
+
+    def cerrar_todo(self):
+        with self._cond:
+            libres, self._libres = self._libres, []
+        for conn, _, _ in libres: self._cerrar(conn)
+
+    def estadisticas(self):
+        with self._cond:
+            s = dict(self._stats)
+            s.update(en_uso=len(self._prestadas) + self._abriendo, libres=len(self._libres), minimo=self.minimo, maximo=self.maximo)
+        s["espera_media_ms"] = round(s["espera_total_ms"] / s["prestamos"], 3) if s["prestamos"] else 0.0
+        s["espera_total_ms"] = round(s["espera_total_ms"], 3); s["espera_max_ms"] = round(s["espera_max_ms"], 3)
+        return s
+
+POOL = PoolConexiones(
+    minimo=int(os.getenv("DB_POOL_MIN", "1")),
+    maximo=int(os.getenv("DB_POOL_MAX", "10")),
+    espera_max=float(os.getenv("DB_POOL_ESPERA", "10")),
+    verificar_tras=float(os.getenv("DB_POOL_PING_TRAS", "30")),
+    vida_max=float(os.getenv("DB_POOL_VIDA_MAX", "1800")),
+    inactiva_max=float(os.getenv("DB_POOL_INACTIVA_MAX", "300")),
+)
+
+def conexion_db():
+    return POOL.conexion()
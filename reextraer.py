@@ -0,0 +1,132 @@
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+from datetime import datetime
+
+import psycopg2
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+from pool_db import parametros_conexion
+import extractor
+
+# --- REEXTRACCIÓN DE MENSAJES GUARDADOS ---
+# Vuelve a pasar mensaje_completo por el extractor (el de ahora o el de otro bancos.json) y compara
+# con lo guardado en la fila. Sin --aplicar solo informa: sirve para probar un cambio de patrones
+# contra el tráfico real antes de publicarlo. Con --aplicar corrige las filas por lotes.
+# El mensaje se lee con un cursor con nombre por trozos y se reparte entre procesos; como mucho hay
+# 2 trozos por proceso en vuelo, así que la memoria no crece con el tamaño de la tabla.
+# Uso: python reextraer.py [--bancos bancos_nuevo.json] [--comercio 1] [--desde 2026-01-01] [--aplicar]
+CAMPOS = ("banco", "emisor", "monto", "monto_num", "moneda")
+SIN_DATO = {"emisor": "S/D", "monto": "0,00"}  # Lo que pone el extractor cuando el patrón no encuentra el campo
+
+def iniciar_proceso(bancos):
+    if bancos: extractor.MOTOR = extractor.MotorBancos.desde_archivo(bancos)
+
+def comparar(filas):
+    # En cada proceso: (cambios, retrocesos, no_reconocidos). Un cambio es (clave de la fila, valores
+    # viejos, valores nuevos). Un campo que el extractor ya no encuentra (S/D, 0,00) no pisa el
+    # guardado: cuenta como retroceso del extractor y se informa aparte.
+    cambios, retrocesos, no_reconocidos = [], [], []
+    for comercio_id, recibido, id_pago, referencia, *viejos, mensaje in filas:
+        pagos = [p for p in extractor.MOTOR.extraer(mensaje) if p["referencia"] == referencia]
+        if not pagos: no_reconocidos.append((id_pago, referencia)); continue
+        viejo, nuevo = dict(zip(CAMPOS, viejos)), {c: pagos[0][c] for c in CAMPOS}
+        for campo in ("emisor", "monto"):
+            if nuevo[campo] == SIN_DATO[campo] and viejo[campo] not in (None, SIN_DATO[campo]):
+                retrocesos.append((campo, id_pago, referencia, viejo[campo]))
+                nuevo[campo] = viejo[campo]
+                if campo == "monto": nuevo["monto_num"], nuevo["moneda"] = viejo["monto_num"], viejo["moneda"]
+        if nuevo != viejo: cambios.append(((comercio_id, recibido, id_pago, referencia), viejo, nuevo))
+    return cambios, retrocesos, no_reconocidos
+
+def trozos(cursor, lote, en_vuelo):
+    # El Pool consume la entrada desde su propio hilo sin límite: el semáforo lo frena
+    while True:
+        en_vuelo.acquire()
+        filas = cursor.fetchmany(lote)
+        if not filas: return
+        yield filas
+
+SQL_CORREGIR = """UPDATE pagos SET banco = v.banco, emisor = v.emisor, monto = v.monto, monto_num = v.monto_num::numeric, moneda = v.moneda
+    FROM (VALUES %s) AS v (comercio_id, recibido_en, id, banco, emisor, monto, monto_num, moneda)
+    WHERE pagos.comercio_id = v.comercio_id AND pagos.recibido_en = v.recibido_en::timestamptz AND pagos.id = v.id"""
+
+def reextraer(conn, bancos=None, comercio_id=None, desde=None, hasta=None, lote=2000, procesos=None, aplicar=False, muestras=5):
+    condiciones, parametros = ["mensaje_completo IS NOT NULL", "referencia IS NOT NULL"], []
+    if comercio_id: condiciones.append("comercio_id = %s"); parametros.append(comercio_id)
+    if desde: condiciones.append("recibido_en >= %s"); parametros.append(desde)
+    if hasta: condiciones.append("recibido_en < %s"); parametros.append(hasta)
+    iniciar_proceso(bancos)  # Falla aquí, y no en cada proceso, si el archivo no sirve
+    procesos = procesos or os.cpu_count() or 1
+    # Cursor con nombre en una conexión aparte: las correcciones se confirman por lote sin cerrarlo
+    lectura = psycopg2.connect(**parametros_conexion())
+    cursor = lectura.cursor(name="reextraccion")
+    cursor.itersize = lote
+    cursor.execute(f"""SELECT comercio_id, recibido_en, id, referencia, {', '.join(CAMPOS)}, mensaje_completo
+                       FROM pagos WHERE {' AND '.join(condiciones)}""", parametros)
+    escritura, en_vuelo = conn.cursor(), threading.BoundedSemaphore(procesos * 2)
+    por_campo, ejemplos = dict.fromkeys(CAMPOS, 0), {c: [] for c in CAMPOS}
+    por_retroceso, ejemplos_retroceso = {"emisor": 0, "monto": 0}, []
+    total, filas_cambiadas, sin_reconocer, ejemplos_sin = 0, 0, 0, []
+    inicio = time.perf_counter()
+    try:
+        with multiprocessing.Pool(procesos, initializer=iniciar_proceso, initargs=(bancos,)) as pool:
+            for cantidad, (cambios, retrocesos, no_reconocidos) in pool.imap(_comparar_contando, trozos(cursor, lote, en_vuelo)):
+                en_vuelo.release()
+                total += cantidad; filas_cambiadas += len(cambios); sin_reconocer += len(no_reconocidos)
+                ejemplos_sin += no_reconocidos[:muestras - len(ejemplos_sin)]
+                for campo, id_pago, referencia, valor in retrocesos:
+                    por_retroceso[campo] += 1
+                    if len(ejemplos_retroceso) < muestras: ejemplos_retroceso.append((campo, id_pago, referencia, valor))
+                for (c_id, recibido, id_pago, referencia), viejo, nuevo in cambios:
+                    for campo in CAMPOS:
+                        if viejo[campo] == nuevo[campo]: continue
+                        por_campo[campo] += 1
+                        if len(ejemplos[campo]) < muestras: ejemplos[campo].append((id_pago, referencia, viejo[campo], nuevo[campo]))
+                if aplicar and cambios:
+                    valores = [(c_id, recibido, id_pago, *(nuevo[c] for c in CAMPOS)) for (c_id, recibido, id_pago, _), _, nuevo in cambios]
+                    execute_values(escritura, SQL_CORREGIR, valores, page_size=len(valores))
+                    conn.commit()
+                print(f"⏳ {total:,} mensajes, {filas_cambiadas:,} con diferencias, {total / (time.perf_counter() - inicio):,.0f} msg/s")
+    finally:
+        cursor.close(); lectura.close()
+    segundos = time.perf_counter() - inicio
+    print(f"\n{'✅' if aplicar else '🔎'} {total:,} mensajes en {segundos:.1f} s ({total / segundos if segundos else 0:,.0f} msg/s); "
+          f"{filas_cambiadas:,} filas {'corregidas' if aplicar else 'con diferencias'}")
+    for campo in CAMPOS:
+        if not por_campo[campo]: continue
+        print(f"  {campo}: {por_campo[campo]:,}")
+        for id_pago, referencia, viejo, nuevo in ejemplos[campo]: print(f"     id {id_pago} ref {referencia}: {viejo!r} -> {nuevo!r}")
+    if sin_reconocer:
+        print(f"  ⚠️ {sin_reconocer:,} mensajes en los que el extractor ya no encuentra la referencia guardada (sin tocar)")
+        for id_pago, referencia in ejemplos_sin: print(f"     id {id_pago} ref {referencia}")
+    for campo, cantidad in por_retroceso.items():
+        if cantidad: print(f"  ⚠️ {cantidad:,} filas en las que el extractor ya no encuentra {campo} (se conserva el guardado)")
+    for campo, id_pago, referencia, valor in ejemplos_retroceso: print(f"     id {id_pago} ref {referencia}: {campo} {valor!r}")
+    if aplicar and filas_cambiadas: print("ℹ️ Las huellas se calcularon con los valores viejos: python huellas.py reprocesar --limpiar")
+    return filas_cambiadas
+
+def _comparar_contando(filas): return len(filas), comparar(filas)
+
+if __name__ == "__main__":
+    from ingesta import ZONA_NEGOCIO
+    fecha = lambda s: datetime.strptime(s, "%Y-%m-%d").replace(tzinfo=ZONA_NEGOCIO)
+    parser = argparse.ArgumentParser(description="Vuelve a extraer los mensajes guardados y compara (o corrige) banco, emisor y monto")
+    parser.add_argument("--bancos", help="Otro archivo de patrones para probarlo contra los mensajes guardados (por defecto BANCOS_ARCHIVO)")
+    parser.add_argument("--comercio", type=int)
+    parser.add_argument("--desde", type=fecha, help="AAAA-MM-DD")
+    parser.add_argument("--hasta", type=fecha, help="AAAA-MM-DD (sin incluir)")
+    parser.add_argument("--lote", type=int, default=2000, help="Mensajes por trozo y por transacción (por defecto 2000)")
+    parser.add_argument("--procesos", type=int, help="Procesos del extractor (por defecto, uno por núcleo)")
+    parser.add_argument("--muestras", type=int, default=5, help="Ejemplos por campo en el informe")
+    parser.add_argument("--aplicar", action="store_true", help="Guarda las correcciones (sin esto solo informa)")
+    args = parser.parse_args()
+    conn = psycopg2.connect(**parametros_conexion())
+    try: reextraer(conn, args.bancos, args.comercio, args.desde, args.hasta, args.lote, args.procesos, args.aplicar, args.muestras)
+    except psycopg2.Error as e: print(f"❌ {e}")
+    finally: conn.close()
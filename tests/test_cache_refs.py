@@ -0,0 +1,22 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cache_refs import CacheReferencias
+
+# --- GENERACIÓN Y RECONEXIONES DE LA ESCUCHA ---
+
+def test_reconectar_invalida_ausente_pendiente():
+    # Un "no encontrado" leído antes de que la escucha se cayera y volviera no se guarda
+    cache = CacheReferencias()
+    cache.aplicar_evento({"op": "CONECTADO"})
+    generacion = cache.generacion
+    cache.aplicar_evento({"op": "DESCONECTADO"}); cache.aplicar_evento({"op": "CONECTADO"})
+    cache.recordar_ausente("123456", generacion)
+    assert cache.consultar("123456") is None
+
+def test_ausente_sin_cambios_responde():
+    cache = CacheReferencias()
+    cache.aplicar_evento({"op": "CONECTADO"})
+    cache.recordar_ausente("123456", cache.generacion)
+    assert cache.consultar("123456") == ("NO_ENCONTRADO", None)
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import psycopg2
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cola_ingesta
+
+# --- LOTES CON UN MENSAJE QUE NO ENTRA (sin Postgres: _guardar simulado) ---
+@pytest.fixture
+def cola(tmp_path, monkeypatch):
+    monkeypatch.setattr(cola_ingesta, "COLA_ARCHIVO", str(tmp_path / "cola.db"))
+    monkeypatch.setattr(cola_ingesta._local, "conn", None, raising=False)
+    guardados = []
+    def guardar(filas):
+        if any("\x00" in f[1] for f in filas): raise ValueError("A string literal cannot contain NUL (0x00) characters.")
+        guardados.extend(f[1] for f in filas)
+    monkeypatch.setattr(cola_ingesta, "_guardar", guardar)
+    return guardados
+
+def vencer():
+    cola_ingesta._conexion().execute("UPDATE cola SET proximo = 0")
+
+def test_un_mensaje_malo_no_frena_el_lote(cola):
+    cola_ingesta.encolar(["a", "b\x00", "c"])
+    assert cola_ingesta.procesar_lote() == 3
+    assert cola == ["a", "c"]
+    assert cola_ingesta.pendientes() == 1
+
+def test_tras_varios_fallos_queda_apartado(cola):
+    cola_ingesta.encolar(["b\x00"])
+    for _ in range(cola_ingesta.COLA_FALLOS_MAX):
+        vencer()
+        with pytest.raises(ValueError): cola_ingesta.procesar_lote()
+    vencer()
+    assert cola_ingesta.procesar_lote() == 0
+    assert (cola_ingesta.pendientes(), cola_ingesta.fallidos()) == (0, 1)
+    assert cola_ingesta.reintentar_fallidos() == 1 and cola_ingesta.pendientes() == 1
+
+def test_una_caida_de_postgres_no_suma_fallos(cola, monkeypatch):
+    def caida(filas): raise psycopg2.OperationalError("sin conexión")
+    monkeypatch.setattr(cola_ingesta, "_guardar", caida)
+    cola_ingesta.encolar(["a", "b"])
+    for _ in range(cola_ingesta.COLA_FALLOS_MAX + 2):
+        vencer()
+        with pytest.raises(psycopg2.OperationalError): cola_ingesta.procesar_lote()
+    assert cola_ingesta.fallidos() == 0 and cola_ingesta.pendientes() == 2
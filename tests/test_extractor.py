@@ -0,0 +1,32 @@
+import os
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [RAIZ, os.path.join(RAIZ, "bench")]
+from extractor import MotorBancos, extractor_inteligente
+from bench_extractor import CORPUS, extractor_original
+
+# --- EQUIVALENCIA CON EL EXTRACTOR ORIGINAL ---
+def test_misma_salida_que_el_original():
+    # Mensaje por mensaje, en los campos que producía el original
+    campos = ("banco", "emisor", "monto", "referencia")
+    for texto in CORPUS:
+        obtenido = [{c: p[c] for c in campos} for p in extractor_inteligente(texto)]
+        assert obtenido == extractor_original(texto), texto
+
+# --- CLAVES QUE SE SOLAPAN ---
+def banco(nombre, clave):
+    return {"banco": nombre, "clave": clave, "emisor": r"del\s*(\d+)", "monto": r"Bs\.\s*([\d.]+,\d{2})", "referencia": r"Ref:\s*(\d+)"}
+
+def test_clave_contenida_en_otra():
+    motor = MotorBancos([banco("BV", "Banco de Venezuela"), banco("VZ", "Venezuela")])
+    assert motor.detectar("Banco de Venezuela: recibiste Bs. 10,00 Ref: 123") == [0, 1]
+    assert [p["banco"] for p in motor.extraer("Banco de Venezuela: recibiste Bs. 10,00 Ref: 123")] == ["BV", "VZ"]
+
+def test_claves_que_empiezan_en_el_mismo_punto():
+    motor = MotorBancos([banco("BDV", "BDV"), banco("DIGITAL", "BDV digital")])
+    assert motor.detectar("BDV digital Ref: 1") == [0, 1]
+    assert motor.detectar("BDV Ref: 1") == [0]
+
+def test_sin_banco():
+    assert extractor_inteligente("Recordatorio: su tarjeta vence pronto") == []
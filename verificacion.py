@@ -0,0 +1,62 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+# --- VERIFICACIÓN Y CANJE DE REFERENCIAS ---
+# El cajero escribe los últimos dígitos de la referencia. En vez de LIKE '%1234' (recorre toda
+# la tabla) se busca el prefijo de la referencia invertida, servido por idx_pagos_referencia_reversa.
+# Casi todo lo que se canjea llegó hace poco: primero se buscan los últimos VERIFICAR_DIAS (solo las
+# particiones de esos meses) y únicamente si no aparece se recorren todas.
+VERIFICAR_DIAS = int(os.getenv("VERIFICAR_DIAS", "60"))
+
+def patron_sufijo(ref):
+    invertida = ref[::-1].replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return invertida + "%"
+
+# Un solo viaje a Postgres: la CTE bloquea la fila (FOR UPDATE) y la canjea solo si seguía libre. Una
+# segunda caja que llega a la vez espera el bloqueo, vuelve a leer la fila ya CANJEADA y no la toca.
+SQL_CANJE = """WITH p AS (SELECT id, emisor, monto, estado, referencia, recibido_en FROM pagos
+                          WHERE comercio_id = %s AND reverse(referencia) LIKE %s{} ORDER BY id DESC LIMIT 1 FOR UPDATE),
+                u AS (UPDATE pagos SET estado = 'CANJEADO', fecha_canje = %s FROM p
+                      WHERE pagos.comercio_id = %s AND pagos.recibido_en = p.recibido_en AND pagos.id = p.id AND p.estado <> 'CANJEADO'
+                      RETURNING pagos.id)
+               SELECT p.emisor, p.monto, p.estado, p.referencia, EXISTS (SELECT 1 FROM u) FROM p"""
+
+def parametros_canje(ref, comercio_id, reciente):
+    # (sql, parámetros) de la búsqueda en los últimos VERIFICAR_DIAS o, con reciente=False, en todo el comercio.
+    # El límite va como literal (no now()) para que el planificador descarte particiones al planificar.
+    fecha_canje = datetime.now().strftime("%d/%m %H:%M")
+    if reciente:
+        desde = datetime.now(timezone.utc) - timedelta(days=VERIFICAR_DIAS)
+        return SQL_CANJE.format(" AND recibido_en >= %s"), (comercio_id, patron_sufijo(ref), desde, fecha_canje, comercio_id)
+    return SQL_CANJE.format(""), (comercio_id, patron_sufijo(ref), fecha_canje, comercio_id)
+
+def resultado_canje(fila):
+    if not fila: return "NO_ENCONTRADO", None
+    return ("VALIDO" if fila[4] else "CANJEADO"), tuple(fila[:4])
+
+def numerar(sql):
+    # %s -> $1, $2... para asyncpg
+    partes = sql.split("%s")
+    return "".join(p + (f"${i}" if i < len(partes) else "") for i, p in enumerate(partes, 1))
+
+def canjear_referencia(conn, ref, comercio_id=1):
+    # Dos cajas que consultan la misma referencia a la vez no pueden validarla ambas (ver SQL_CANJE).
+    # Solo se lee la partición del comercio (comercio_id fijo en el WHERE).
+    if not ref: return "NO_ENCONTRADO", None
+    cursor = conn.cursor()
+    cursor.execute(*parametros_canje(ref, comercio_id, True))
+    fila = cursor.fetchone()
+    if not fila:
+        cursor.execute(*parametros_canje(ref, comercio_id, False)); fila = cursor.fetchone()
+    conn.commit()
+    return resultado_canje(fila)
+
+async def canjear_referencia_async(conn, ref, comercio_id=1):
+    # Lo mismo con asyncpg (asgi.py); cada sentencia es su propia transacción
+    if not ref: return "NO_ENCONTRADO", None
+    sql, parametros = parametros_canje(ref, comercio_id, True)
+    fila = await conn.fetchrow(numerar(sql), *parametros)
+    if not fila:
+        sql, parametros = parametros_canje(ref, comercio_id, False)
+        fila = await conn.fetchrow(numerar(sql), *parametros)
+    return resultado_canje(fila)